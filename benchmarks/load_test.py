@@ -0,0 +1,383 @@
+"""
+load_test.py
+=============
+Teste de carga: arranca flood_api:app com o gunicorn (a mesma configuração
+de produção, gunicorn.conf.py) e repete contra ele uma mistura de pedidos
+parecida com a de utilizadores reais, a partir de --concurrency
+utilizadores virtuais em paralelo:
+
+  - page       carregamento da página: províncias, municípios e os pontos
+               de rótulo de municípios e bairros (/api/boundaries);
+  - slider     o slider de floodRate a ser arrastado: POSTs a
+               /api/simulate com valores vizinhos do anterior (passos de
+               1–3%), à província ou a um município;
+  - drilldown  entrar num município: lista de bairros e simulação ao
+               nível de bairro (todos, ou um só).
+
+Relata o débito (pedidos/s), a latência p50/p95/p99 por tipo de pedido e
+no total, as taxas de acerto das caches (de /api/health, somadas por
+worker) e a memória do gunicorn (RSS e PSS — os rasters mapeados da cache
+em disco são partilhados entre workers e o PSS conta-os uma só vez) ao
+longo do teste. A memória só se lê no Linux (/proc) e só com o servidor
+arrancado por este script.
+
+Por omissão corre sobre os dados sintéticos de benchmarks/synthetic_data.py;
+--data-dir usa outro conjunto (por exemplo data/) e --url um servidor já a
+correr.
+
+Uso:
+    python benchmarks/load_test.py [--synthetic 1024 | --data-dir data] [--workers 2] [--threads 4]
+        [--concurrency 8] [--duration 60] [--mix page=2,slider=5,drilldown=3] [--output relatorio.json]
+    python benchmarks/load_test.py --url http://127.0.0.1:5000 --duration 30
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import quote, urlsplit
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from synthetic_data import generate  # noqa: E402
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DEFAULT_MIX = "page=2,slider=5,drilldown=3"
+CACHES = ("flood_cache", "geojson_cache", "topology_cache", "tile_cache")
+
+
+def log(msg):
+    print(f"[load_test] {msg}", file=sys.stderr)
+
+
+# ==================== CLIENTE ====================
+class VirtualUser:
+    """Um utilizador: uma ligação keep-alive e o seu próprio estado do
+    slider (floodRate e zona actuais), para que os pedidos seguidos sejam
+    vizinhos como quando se arrasta o slider."""
+
+    def __init__(self, base_url, municipalities, seed, timeout):
+        parts = urlsplit(base_url)
+        self._address = (parts.hostname, parts.port or 80, timeout)
+        self._conn = self._connect()
+        self.municipalities = municipalities
+        self.rng = random.Random(seed)
+        self.flood_rate = self.rng.randint(10, 90)
+        self.municipality = self.rng.choice(municipalities)
+        self.samples = []  # (tipo de pedido, latência em ms, status)
+
+    def _connect(self):
+        host, port, timeout = self._address
+        return http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def request(self, kind, method, path, body=None):
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        headers = {"Content-Type": "application/json"} if data is not None else {}
+        start = time.perf_counter()
+        payload, status = b"", 0
+        # Como um browser: se a ligação keep-alive foi fechada pelo servidor
+        # (worker reciclado por max_requests), repete uma vez numa nova.
+        for _ in range(2):
+            try:
+                self._conn.request(method, path, body=data, headers=headers)
+                response = self._conn.getresponse()
+                payload, status = response.read(), response.status
+                break
+            except (OSError, http.client.HTTPException):
+                self._conn.close()
+                self._conn = self._connect()
+        self.samples.append((kind, (time.perf_counter() - start) * 1000, status))
+        return payload
+
+    def page(self):
+        self.request("page_provinces", "GET", "/api/provinces")
+        self.request("page_municipalities", "GET", "/api/municipalities?province=Luanda")
+        self.request("page_boundaries", "GET", "/api/boundaries?level=municipality")
+        self.request("page_boundaries", "GET", "/api/boundaries?level=bairro")
+
+    def slider(self):
+        self.flood_rate = min(100, max(0, self.flood_rate + self.rng.choice((-3, -2, -1, 1, 2, 3))))
+        if self.rng.random() < 0.5:
+            body, kind = {"level": "province", "province": "Luanda"}, "slider_province"
+        else:
+            body, kind = {"level": "municipality", "municipality": self.municipality}, "slider_municipality"
+        self.request(kind, "POST", "/api/simulate", {**body, "floodRate": self.flood_rate})
+
+    def drilldown(self):
+        self.municipality = self.rng.choice(self.municipalities)
+        payload = self.request("drilldown_bairros_list", "GET",
+                               f"/api/bairros?municipality={quote(self.municipality)}")
+        try:
+            bairros = [b["name"] for b in json.loads(payload)["data"]]
+        except (ValueError, KeyError, TypeError):
+            bairros = []
+        body = {"level": "bairro", "municipality": self.municipality, "floodRate": self.flood_rate}
+        if bairros and self.rng.random() < 0.5:
+            body["bairro"] = self.rng.choice(bairros)
+        self.request("drilldown_simulate", "POST", "/api/simulate", body)
+
+    def close(self):
+        self._conn.close()
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        if name not in ("page", "slider", "drilldown"):
+            raise ValueError(f'Acção "{name}" desconhecida na mistura (page, slider, drilldown)')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def _get_json(base_url, path, timeout=10):
+    parts = urlsplit(base_url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=timeout)
+    try:
+        conn.request("GET", path)
+        response = conn.getresponse()
+        return response.status, json.loads(response.read() or b"null")
+    finally:
+        conn.close()
+
+
+# ==================== SERVIDOR E MEMÓRIA ====================
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(data_dir, cache_dir, workers, threads, startup_timeout, log_path):
+    port = _free_port()
+    env = {**os.environ, "FLOOD_DATA_DIR": data_dir, "FLOOD_CACHE_DIR": cache_dir,
+           "FLOOD_JOB_DIR": os.path.join(cache_dir, "jobs")}
+    cmd = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}",
+           "--workers", str(workers), "--threads", str(threads), "--log-level", "warning", "flood_api:app"]
+    with open(log_path, "w") as log_file:
+        proc = subprocess.Popen(cmd, cwd=REPO_DIR, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + startup_timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            with open(log_path) as f:
+                tail = f.read()[-4000:]
+            raise RuntimeError(f"gunicorn terminou no arranque (código {proc.returncode}):\n{tail}")
+        try:
+            if _get_json(base_url, "/api/health/ready", timeout=2)[0] == 200:
+                return proc, base_url
+        except (OSError, ValueError):
+            pass
+        time.sleep(0.5)
+    proc.terminate()
+    raise RuntimeError(f"gunicorn não respondeu em {startup_timeout}s")
+
+
+def _children(pid):
+    children = []
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    # ppid é o 2.º campo depois do nome "(comm)", que pode ter espaços.
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            if ppid == pid:
+                children.append(int(entry))
+    return children
+
+
+def process_memory(pid):
+    """(RSS, PSS) em MB do processo pid e dos seus filhos (os workers)."""
+    rss = pss = 0
+    for p in [pid, *_children(pid)]:
+        try:
+            with open(f"/proc/{p}/smaps_rollup") as f:
+                for line in f:
+                    if line.startswith("Rss:"):
+                        rss += int(line.split()[1])
+                    elif line.startswith("Pss:"):
+                        pss += int(line.split()[1])
+        except OSError:
+            continue
+    return round(rss / 1024, 1), round(pss / 1024, 1)
+
+
+# ==================== RELATÓRIO ====================
+def latency_summary(samples, duration_s):
+    latencies = np.array([ms for _, ms, _ in samples]) if samples else np.zeros(0)
+    errors = sum(1 for _, _, status in samples if not 200 <= status < 400)
+    summary = {"requests": len(samples), "errors": errors,
+               "throughput_rps": round(len(samples) / duration_s, 2) if duration_s else 0.0}
+    if len(latencies):
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        summary.update(p50_ms=round(p50, 1), p95_ms=round(p95, 1), p99_ms=round(p99, 1),
+                       max_ms=round(latencies.max(), 1))
+    return summary
+
+
+def cache_summary(health_by_pid):
+    """Contadores de cada cache somados pelos workers (último /api/health
+    visto de cada um)."""
+    summary = {}
+    for cache in CACHES:
+        hits = sum(h.get(cache, {}).get("hits", 0) for h in health_by_pid.values())
+        misses = sum(h.get(cache, {}).get("misses", 0) for h in health_by_pid.values())
+        summary[cache] = {
+            "hits": hits, "misses": misses,
+            "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+        }
+    return summary
+
+
+# ==================== EXECUÇÃO ====================
+def run_load(base_url, mix, concurrency, duration, warmup, sample_interval, seed, server_pid=None, timeout=120):
+    status, municipalities = _get_json(base_url, "/api/municipalities?province=Luanda")
+    names = [m["name"] for m in (municipalities or {}).get("data", [])]
+    if status != 200 or not names:
+        raise RuntimeError("Não foi possível obter a lista de municípios do servidor")
+
+    actions, weights = zip(*mix.items())
+    users = [VirtualUser(base_url, names, seed + i, timeout) for i in range(concurrency)]
+    start = time.monotonic()
+    measure_from = start + warmup
+    stop_at = measure_from + duration
+    stop = threading.Event()
+
+    def loop(user):
+        while time.monotonic() < stop_at and not stop.is_set():
+            action = user.rng.choices(actions, weights)[0]
+            getattr(user, action)()
+            if time.monotonic() < measure_from:
+                user.samples.clear()  # aquecimento: não conta
+
+    health_by_pid, timeline = {}, []
+
+    def sample():
+        # Cada /api/health cai num worker qualquer: vários pedidos por
+        # amostra para apanhar (quase) todos.
+        for _ in range(4):
+            try:
+                health_status, health = _get_json(base_url, "/api/health")
+            except (OSError, ValueError):
+                continue
+            if health_status == 200 and "pid" in health:
+                health_by_pid[health["pid"]] = health
+        point = {"t": round(time.monotonic() - start, 1), "requests": sum(len(u.samples) for u in users)}
+        if server_pid is not None:
+            point["rss_mb"], point["pss_mb"] = process_memory(server_pid)
+        timeline.append(point)
+
+    threads = [threading.Thread(target=loop, args=(u,), daemon=True) for u in users]
+    for t in threads:
+        t.start()
+    try:
+        while any(t.is_alive() for t in threads):
+            sample()
+            time.sleep(sample_interval)
+    except KeyboardInterrupt:
+        stop.set()
+    for t in threads:
+        t.join()
+    sample()
+    for user in users:
+        user.close()
+
+    samples = [s for u in users for s in u.samples]
+    elapsed = min(time.monotonic(), stop_at) - measure_from
+    by_kind = {}
+    for s in samples:
+        by_kind.setdefault(s[0], []).append(s)
+    return {
+        "config": {"mix": mix, "concurrency": concurrency, "duration_s": duration, "warmup_s": warmup},
+        "total": latency_summary(samples, elapsed),
+        "by_kind": {kind: latency_summary(kind_samples, elapsed) for kind, kind_samples in sorted(by_kind.items())},
+        "caches": cache_summary(health_by_pid),
+        "workers_seen": len(health_by_pid),
+        "timeline": timeline,
+    }
+
+
+def print_report(report):
+    total = report["total"]
+    log(f"{total['requests']} pedidos, {total['errors']} erros, {total['throughput_rps']} pedidos/s")
+    log(f"{'tipo':<26} {'n':>6} {'erros':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'máx':>8}  (ms)")
+    for kind, s in [*report["by_kind"].items(), ("TOTAL", total)]:
+        if s["requests"]:
+            log(f"{kind:<26} {s['requests']:>6} {s['errors']:>6} {s['p50_ms']:>8.1f} {s['p95_ms']:>8.1f} "
+                f"{s['p99_ms']:>8.1f} {s['max_ms']:>8.1f}")
+    # Com max_requests (gunicorn.conf.py) os workers são reciclados durante
+    # o teste: cada um que passou conta, com os contadores que tinha.
+    log(f"Caches ({report['workers_seen']} worker(s) vistos, incluindo os reciclados):")
+    for cache, c in report["caches"].items():
+        log(f"    {cache:<16} acertos {c['hit_ratio']:>6.1%} ({c['hits']}/{c['hits'] + c['misses']})")
+    memory = [p for p in report["timeline"] if "rss_mb" in p]
+    if memory:
+        log(f"Memória do gunicorn: RSS {memory[0]['rss_mb']} -> {memory[-1]['rss_mb']} MB "
+            f"(máx {max(p['rss_mb'] for p in memory)}), PSS {memory[0]['pss_mb']} -> {memory[-1]['pss_mb']} MB "
+            f"(máx {max(p['pss_mb'] for p in memory)})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga da API de inundações")
+    parser.add_argument("--url", help="servidor já a correr (senão arranca um gunicorn local)")
+    parser.add_argument("--data-dir", help="dados do servidor local (por omissão: sintéticos)")
+    parser.add_argument("--synthetic", type=int, default=1024, help="lado do DEM sintético")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=8, help="utilizadores virtuais")
+    parser.add_argument("--duration", type=float, default=60, help="segundos medidos")
+    parser.add_argument("--warmup", type=float, default=5, help="segundos iniciais não contados")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="pesos das acções page, slider e drilldown")
+    parser.add_argument("--sample-interval", type=float, default=2.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--startup-timeout", type=float, default=300)
+    parser.add_argument("--output", help="grava o relatório completo (com a série temporal) em JSON")
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+
+    work_dir = server = None
+    try:
+        if args.url:
+            base_url = args.url.rstrip("/")
+        else:
+            work_dir = tempfile.mkdtemp(prefix="flood-load-")
+            data_dir = args.data_dir and os.path.abspath(args.data_dir)
+            if data_dir is None:
+                data_dir = os.path.join(work_dir, "data")
+                generate(data_dir, size=args.synthetic, seed=args.seed)
+            log(f"A arrancar gunicorn ({args.workers} workers x {args.threads} threads) sobre {data_dir}...")
+            server, base_url = start_server(data_dir, os.path.join(work_dir, "cache"), args.workers,
+                                            args.threads, args.startup_timeout, os.path.join(work_dir, "server.log"))
+
+        log(f"{args.concurrency} utilizadores, {args.warmup:.0f}s de aquecimento + {args.duration:.0f}s, "
+            f"mistura {mix}")
+        report = run_load(base_url, mix, args.concurrency, args.duration, args.warmup, args.sample_interval,
+                          args.seed, server_pid=server.pid if server else None)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        if work_dir is not None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        log(f"Relatório gravado em {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+memory_budget.py
+=================
+Pico de memória (RSS) do arranque a frio com FLOOD_MEMORY_BUDGET_MB, sobre
+os dados sintéticos de benchmarks/synthetic_data.py, comparado com o
+orçamento.
+
+O orçamento só dimensiona os tiles da construção dos rasters (ver
+flood_outofcore.tile_side_for_budget), por isso mede-se por fases, num
+processo à parte com DEM_DOWNSAMPLE=1 e uma cache de rasters vazia:
+
+  - imports     flood_model e as bibliotecas, antes de qualquer dado;
+  - rasters     FloodModel a frio (construção por tiles da cache);
+  - api         import de flood_api até /api/health/ready (pirâmide,
+                limites, registo das zonas), sobre a cache já construída;
+  - simulate    um POST /api/simulate à província.
+
+A memória de trabalho dos tiles (pico da fase "rasters" menos o RSS depois
+dos imports) tem de caber no orçamento; com --max-rss-mb o pico do
+processo inteiro também é verificado (ex. o limite de RAM do plano de
+hosting). Sai com código 1 se alguma verificação falhar. Só no Linux
+(/proc e ru_maxrss em KB).
+
+Uso:
+    python benchmarks/memory_budget.py [--size 2048] [--budget-mb 256] [--max-rss-mb 512]
+"""
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# Os dados sintéticos são gerados noutro processo: o pico de RSS (ru_maxrss)
+# passa do pai para o processo de medição através do fork/exec.
+SYNTHETIC_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "synthetic_data.py")
+
+
+def log(msg):
+    print(f"[memory_budget] {msg}", file=sys.stderr)
+
+
+def _rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+
+
+def _peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_worker(data_dir):
+    """Corre as fases neste processo (orçamento, cache e pasta de dados vêm
+    do ambiente) e devolve {fase: {"rss_mb", "peak_rss_mb"}}."""
+    phases = {}
+
+    def mark(name):
+        phases[name] = {"rss_mb": round(_rss_mb(), 1), "peak_rss_mb": round(_peak_rss_mb(), 1)}
+
+    import flood_model
+
+    mark("imports")
+    flood_model.FloodModel(data_dir, cache_dir=os.environ["FLOOD_CACHE_DIR"]).close()
+    mark("rasters")
+
+    import flood_api
+
+    flood_api.wait_until_ready()
+    mark("api")
+    response = flood_api.app.test_client().post(
+        "/api/simulate", json={"waterLevel": 1.5, "floodRate": 60, "level": "province"})
+    if response.status_code != 200:
+        raise RuntimeError(f"/api/simulate: HTTP {response.status_code}")
+    mark("simulate")
+    return {"phases": phases}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pico de RSS do arranque a frio com FLOOD_MEMORY_BUDGET_MB")
+    parser.add_argument("--size", type=int, default=2048, help="lado do DEM sintético")
+    parser.add_argument("--budget-mb", type=float, default=256, help="valor de FLOOD_MEMORY_BUDGET_MB")
+    parser.add_argument("--max-rss-mb", type=float, help="limite para o pico de RSS do processo inteiro")
+    parser.add_argument("--data-dir", help="usa estes dados em vez dos sintéticos")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--worker", metavar="DATA_DIR", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker)))
+        return
+
+    work_dir = tempfile.mkdtemp(prefix="flood-membudget-")
+    try:
+        data_dir = args.data_dir
+        if data_dir is None:
+            data_dir = os.path.join(work_dir, "data")
+            subprocess.run([sys.executable, SYNTHETIC_DATA, data_dir, "--size", str(args.size),
+                            "--seed", str(args.seed)], check=True)
+        cache_dir = os.path.join(work_dir, "cache")
+        env = {
+            **os.environ,
+            "DEM_DOWNSAMPLE": "1",
+            "FLOOD_MEMORY_BUDGET_MB": str(args.budget_mb),
+            "FLOOD_DATA_DIR": data_dir,
+            "FLOOD_CACHE_DIR": cache_dir,
+            "FLOOD_JOB_DIR": os.path.join(cache_dir, "jobs"),
+        }
+        cmd = [sys.executable, __file__, "--worker", data_dir]
+        proc = subprocess.run(cmd, env=env, capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(f"O processo de medição falhou:\n{proc.stderr[-4000:]}")
+        phases = json.loads(proc.stdout.strip().splitlines()[-1])["phases"]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    for name, usage in phases.items():
+        log(f"{name:<10} RSS {usage['rss_mb']:>7.1f} MB  pico {usage['peak_rss_mb']:>7.1f} MB")
+
+    failures = []
+    tiles_mb = phases["rasters"]["peak_rss_mb"] - phases["imports"]["rss_mb"]
+    log(f"Memória de trabalho dos tiles: {tiles_mb:.1f} MB (orçamento {args.budget_mb:.0f} MB)")
+    if tiles_mb > args.budget_mb:
+        failures.append(f"construção dos rasters usou {tiles_mb:.1f} MB > {args.budget_mb:.0f} MB")
+    peak_mb = max(usage["peak_rss_mb"] for usage in phases.values())
+    log(f"Pico de RSS do processo: {peak_mb:.1f} MB")
+    if args.max_rss_mb is not None and peak_mb > args.max_rss_mb:
+        failures.append(f"pico de RSS {peak_mb:.1f} MB > {args.max_rss_mb:.0f} MB")
+
+    for failure in failures:
+        log(f"FALHOU: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
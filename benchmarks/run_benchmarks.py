@@ -0,0 +1,318 @@
+"""
+run_benchmarks.py
+==================
+Benchmarks dos caminhos quentes do motor de inundação sobre os dados
+sintéticos de benchmarks/synthetic_data.py (não precisa de data/):
+
+  - FloodModel.__init__ a frio (constrói a cache de rasters) e a quente
+    (só mapeia a cache), e o import de flood_api (registo das zonas);
+  - compute_flood, simulate_zone (curvas de exposição e caminho por
+    geometria) e flood_geojson, com as caches de resultados vazias;
+  - os endpoints Flask mais usados, pelo test client.
+
+Cada combinação tamanho do DEM x DEM_DOWNSAMPLE corre num processo à parte
+(DEM_DOWNSAMPLE é lido no import de flood_model), com uma cache de rasters
+própria. Por benchmark guarda-se a mediana, o mínimo e o máximo (ms) de
+--repeat repetições.
+
+Os resultados comparam-se com uma baseline em JSON (por omissão
+benchmarks/baselines/default.json) pelo mínimo — o melhor de N é o valor
+menos sensível a ruído de outros processos na máquina. Um benchmark
+regride quando o mínimo, corrigido pela velocidade da máquina no momento
+(benchmark "calibration": trabalho numpy fixo, sem código do projecto),
+passa o da baseline em mais de "tolerance" (fracção) e em mais de
+"min_delta_ms" — os dois limiares ficam no próprio ficheiro da baseline,
+com excepções por benchmark em "per_benchmark". Sai com código 1 se
+houver regressões. As baselines só são comparáveis na mesma máquina:
+gerar uma nova com --save depois de mudar de hardware.
+
+Uso:
+    python benchmarks/run_benchmarks.py [--sizes 512,1024] [--downsample 1,2,4] [--repeat 7]
+    python benchmarks/run_benchmarks.py --save          # grava/actualiza a baseline
+"""
+
+import argparse
+import importlib
+import json
+import math
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from synthetic_data import generate  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baselines", "default.json")
+DEFAULT_THRESHOLDS = {
+    # Folgas largas: numa máquina partilhada o ruído entre corridas chega
+    # aos 30-50% mesmo depois da calibração. Apertar no ficheiro da
+    # baseline quando esta for gerada em hardware dedicado.
+    "tolerance": 0.5,
+    "min_delta_ms": 10.0,
+    # Dominados por I/O de disco e pelo alocador: ainda mais ruidosos.
+    "per_benchmark": {"model_init_cold": 1.0, "model_init_warm": 1.0, "api_startup": 1.0},
+}
+
+# Cenário usado em todos os benchmarks (nível de água em m, taxa 0–1).
+WATER_LEVEL_M = 1.5
+FLOOD_RATE_FRAC = 0.6
+TILE_ZOOM = 12
+
+
+def log(msg):
+    print(f"[benchmarks] {msg}", file=sys.stderr)
+
+
+# ==================== PROCESSO DE MEDIÇÃO ====================
+def _timed(fn, repeat, setup=None):
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return {
+        "median_ms": round(statistics.median(times), 3),
+        "min_ms": round(min(times), 3),
+        "max_ms": round(max(times), 3),
+        "runs": repeat,
+    }
+
+
+def _calibration_workload():
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=1_000_000)
+    np.sort(values)
+    matrix = values.reshape(1000, 1000)
+    (matrix @ matrix[:200].T).sum()
+
+
+def _tile_at(lon, lat, z):
+    n = 2 ** z
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return x, y
+
+
+def run_worker(data_dir, repeat):
+    """Corre todos os benchmarks neste processo (DEM_DOWNSAMPLE, cache e
+    pasta de dados vêm do ambiente) e devolve {benchmark: tempos}."""
+    import resource
+
+    import flood_model
+    from flood_model import FloodModel
+
+    cache_dir = os.environ["FLOOD_CACHE_DIR"]
+    results = {"calibration": _timed(_calibration_workload, repeat)}
+
+    def cold_init():
+        cold_dir = tempfile.mkdtemp(dir=cache_dir, prefix="cold-")
+        try:
+            FloodModel(data_dir, cache_dir=cold_dir)
+        finally:
+            shutil.rmtree(cold_dir, ignore_errors=True)
+
+    results["model_init_cold"] = _timed(cold_init, max(1, min(repeat, 3)))
+    FloodModel(data_dir, cache_dir=cache_dir)
+    results["model_init_warm"] = _timed(lambda: FloodModel(data_dir, cache_dir=cache_dir), repeat)
+
+    # O import de flood_api começa o carregamento em fundo: o FloodModel
+    # (cache já quente), o registo das zonas e a tabela de zonas — o
+    # arranque de um worker, até /api/health/ready.
+    results["api_startup"] = _timed(lambda: importlib.import_module("flood_api").wait_until_ready(), 1)
+    flood_api = sys.modules["flood_api"]
+
+    model = flood_api.flood_model
+    wl, fr = WATER_LEVEL_M, FLOOD_RATE_FRAC
+
+    def clear_caches():
+        for level in model.levels:
+            level._flood_cache.clear()
+            level._geojson_cache.clear()
+        flood_api.flood_tiler._cache.clear()
+        flood_api.topology_cache.clear()
+
+    results["compute_flood"] = _timed(lambda: model.compute_flood(wl, fr), repeat, setup=clear_caches)
+    results["compute_flood_cached"] = _timed(lambda: model.compute_flood(wl, fr), repeat)
+
+    munis = list(flood_api.municipalities_gdf.itertuples())
+    catchments = list(flood_api.catchments_gdf.itertuples())
+    bairro_zones = [(r.geometry.__geo_interface__, ("bairro", r.Index)) for r in catchments]
+    muni_geometries = [(r.geometry.__geo_interface__, None) for r in munis]
+    results["simulate_zone_curves_bairros"] = _timed(
+        lambda: list(model.simulate_zones(bairro_zones, wl, fr)), repeat)
+    model.compute_flood(wl, fr)
+    results["simulate_zone_geometry_municipalities"] = _timed(
+        lambda: list(model.simulate_zones(muni_geometries, wl, fr)), repeat)
+
+    muni_geom = munis[0].geometry.__geo_interface__
+    results["flood_geojson_full"] = _timed(lambda: model.flood_geojson(wl, fr), repeat)
+    results["flood_geojson_municipality"] = _timed(
+        lambda: model.flood_geojson(wl, fr, clip_geometry=muni_geom), repeat)
+
+    client = flood_api.app.test_client()
+    scenario = {"waterLevel": wl, "floodRate": fr * 100}
+    west, south, east, north = flood_api.provinces_gdf.total_bounds
+    tx, ty = _tile_at((west + east) / 2, (south + north) / 2, TILE_ZOOM)
+    query = f"waterLevel={wl}&floodRate={fr * 100}"
+    endpoints = {
+        "api_simulate_province": ("post", "/api/simulate", {**scenario, "level": "province"}),
+        "api_simulate_province_topojson": (
+            "post", "/api/simulate", {**scenario, "level": "province", "format": "topojson"}),
+        "api_simulate_municipality": ("post", "/api/simulate", {**scenario, "level": "municipality",
+                                                               "municipality": munis[0].NAME_2}),
+        "api_simulate_bairros": ("post", "/api/simulate", {**scenario, "level": "bairro",
+                                                          "municipality": munis[0].NAME_2}),
+        "api_boundaries_bairros": ("get", "/api/boundaries?level=bairro", None),
+        "api_municipalities": ("get", "/api/municipalities", None),
+        "api_vector_tile": ("get", f"/api/flood/tiles/{TILE_ZOOM}/{tx}/{ty}.pbf?{query}", None),
+        "api_depth_tile": ("get", f"/api/flood/depth/{TILE_ZOOM}/{tx}/{ty}.png?{query}", None),
+    }
+    for name, (method, url, body) in endpoints.items():
+        def call(method=method, url=url, body=body, name=name):
+            response = client.post(url, json=body) if method == "post" else client.get(url)
+            if response.status_code != 200:
+                raise RuntimeError(f"{name}: HTTP {response.status_code} em {url}")
+            response.get_data()
+        results[name] = _timed(call, repeat, setup=clear_caches)
+
+    return {
+        "dem_shape": list(model.dem_shape),
+        "dem_downsample": flood_model.DEM_DOWNSAMPLE,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "benchmarks": results,
+    }
+
+
+# ==================== ORQUESTRAÇÃO ====================
+def run_config(data_dir, size, downsample, repeat, work_dir):
+    cache_dir = os.path.join(work_dir, f"cache-{size}-{downsample}")
+    os.makedirs(cache_dir, exist_ok=True)
+    env = {
+        **os.environ,
+        "DEM_DOWNSAMPLE": str(downsample),
+        "FLOOD_DATA_DIR": data_dir,
+        "FLOOD_CACHE_DIR": cache_dir,
+        "FLOOD_JOB_DIR": os.path.join(cache_dir, "jobs"),
+    }
+    cmd = [sys.executable, __file__, "--worker", data_dir, "--repeat", str(repeat)]
+    proc = subprocess.run(cmd, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"size={size} downsample={downsample} falhou:\n{proc.stderr[-4000:]}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def machine_info():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare(current, baseline):
+    """Lista de (config, benchmark, baseline ms, actual ms, regrediu?), com
+    os tempos actuais reescalados pela razão entre as calibrações."""
+    thresholds = {**DEFAULT_THRESHOLDS, **baseline.get("thresholds", {})}
+    rows = []
+    for config, result in current["results"].items():
+        base = baseline.get("results", {}).get(config)
+        if base is None:
+            continue
+        speed = base["benchmarks"]["calibration"]["min_ms"] / result["benchmarks"]["calibration"]["min_ms"]
+        for name, timing in result["benchmarks"].items():
+            base_timing = base["benchmarks"].get(name)
+            if base_timing is None or name == "calibration":
+                continue
+            before, after = base_timing["min_ms"], timing["min_ms"] * speed
+            tolerance = thresholds["per_benchmark"].get(name, thresholds["tolerance"])
+            regressed = after > before * (1 + tolerance) and after - before > thresholds["min_delta_ms"]
+            rows.append((config, name, before, after, regressed))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks do motor de inundação sobre dados sintéticos")
+    parser.add_argument("--sizes", default="512,1024", help="lados do DEM sintético, separados por vírgulas")
+    parser.add_argument("--downsample", default="1,2,4", help="valores de DEM_DOWNSAMPLE")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save", action="store_true", help="grava os resultados como baseline")
+    parser.add_argument("--output", help="grava também os resultados neste ficheiro JSON")
+    parser.add_argument("--worker", metavar="DATA_DIR", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker, args.repeat)))
+        return
+
+    work_dir = tempfile.mkdtemp(prefix="flood-bench-")
+    current = {"machine": machine_info(), "seed": args.seed, "results": {}}
+    try:
+        for size in (int(s) for s in args.sizes.split(",")):
+            data_dir = os.path.join(work_dir, f"data-{size}")
+            generate(data_dir, size=size, seed=args.seed)
+            for downsample in (int(d) for d in args.downsample.split(",")):
+                log(f"size={size} downsample={downsample}...")
+                current["results"][f"size={size},downsample={downsample}"] = run_config(
+                    data_dir, size, downsample, args.repeat, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    for config, result in current["results"].items():
+        log(f"{config}  DEM {result['dem_shape']}  pico RSS {result['peak_rss_mb']} MB")
+        for name, timing in result["benchmarks"].items():
+            log(f"    {name:<40} mín {timing['min_ms']:>9.1f} ms  mediana {timing['median_ms']:>9.1f} ms")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=2)
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    if args.save:
+        current["thresholds"] = (baseline or {}).get("thresholds", DEFAULT_THRESHOLDS)
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=2)
+            f.write("\n")
+        log(f"Baseline gravada em {args.baseline}")
+        return
+    if baseline is None:
+        log(f"Sem baseline em {args.baseline} (gerar com --save)")
+        return
+
+    rows = compare(current, baseline)
+    regressions = [row for row in rows if row[4]]
+    for config, name, before, after, regressed in rows:
+        marker = "REGRESSÃO" if regressed else "ok"
+        log(f"{config:<28} {name:<40} {before:>10.1f} -> {after:>10.1f} ms  {marker}")
+    log(f"{len(rows)} comparações, {len(regressions)} regressões")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+synthetic_data.py
+==================
+Gera um conjunto de dados sintético, determinístico (mesma semente = mesmos
+ficheiros), com os mesmos nomes e formatos que scripts/prepare_data.py
+produz em data/, para correr o motor de inundação e a API sem os dados
+reais (o DEM Copernicus não está no repositório):
+
+  - dem_luanda.tif            grelha de size x size a 1" (~30 m): margem de
+                               oceano a oeste (abaixo de 0 m), encosta
+                               costeira a subir para leste com relevo
+                               suave e depressões fechadas espalhadas
+  - population_luanda.tif     grelha 3x mais grossa (~90 m), mais densa
+                               junto à costa, 0 no oceano
+  - provinces.geojson         a província (NAME_1 = "Luanda")
+  - municipalities.geojson    grelha de municípios com nomes reais (para
+                               os factores de risco/drenagem se aplicarem)
+  - bairros_com_municipio.geojson / bairro_catchments.geojson
+                               grelha de bairros por município (ponto e
+                               catchment)
+
+Uso:
+    python benchmarks/synthetic_data.py <pasta> [--size 1024] [--seed 0]
+"""
+
+import argparse
+import os
+
+import geopandas as gpd
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from scipy import ndimage
+from shapely.geometry import Point, box
+
+# Canto noroeste e resolução da grelha sintética (a do Copernicus GLO-30).
+ORIGIN_LON = 13.0
+ORIGIN_LAT = -8.6
+DEM_RES_DEG = 1 / 3600
+POP_FACTOR = 3  # células de DEM por célula de população, em cada eixo
+
+MUNICIPALITY_NAMES = [
+    "Cacuaco", "Sambizanga", "Cazenga", "Ingombota", "Rangel",
+    "Maianga", "Belas", "Kilamba Kiaxi", "Viana", "Talatona", "Samba", "Camama",
+]
+
+
+def log(msg):
+    print(f"[synthetic_data] {msg}")
+
+
+def synthetic_dem(size, seed=0):
+    """Elevação (m, float32) de uma faixa costeira: oceano a oeste, linha
+    de costa ondulada, encosta até ~60 m a leste, ruído suave e depressões
+    gaussianas que retêm água."""
+    rng = np.random.default_rng(seed)
+    v, u = np.mgrid[0:size, 0:size].astype("float64") / max(size - 1, 1)
+    coast = 0.12 + 0.03 * np.sin(2 * np.pi * 3 * v) + 0.015 * np.sin(2 * np.pi * 7 * v + 1.0)
+    inland = np.clip((u - coast) / (1 - coast), 0, None)
+    dem = 60.0 * inland ** 1.3
+
+    noise = ndimage.gaussian_filter(rng.normal(size=(size, size)), sigma=max(size / 64, 1))
+    noise /= np.abs(noise).max() or 1.0
+    dem += 3.0 * noise * np.clip(inland * 10, 0, 1)
+
+    rows, cols = np.mgrid[0:size, 0:size]
+    for _ in range(max(4, size // 64)):
+        cy = rng.uniform(0, size)
+        cx = rng.uniform(0.25 * size, 0.95 * size)
+        radius = rng.uniform(size / 80, size / 25)
+        depth = rng.uniform(2.0, 8.0)
+        dem -= depth * np.exp(-((rows - cy) ** 2 + (cols - cx) ** 2) / (2 * radius ** 2))
+
+    ocean = u < coast
+    dem[ocean] = np.minimum(dem[ocean], -1.0 - 4.0 * (coast[ocean] - u[ocean]) / coast[ocean])
+    return dem.astype("float32")
+
+
+def synthetic_population(dem, seed=0):
+    """Habitantes por célula da grelha de população (POP_FACTOR x mais
+    grossa que o DEM): densidade a cair para o interior, com ruído, 0 onde
+    a célula é sobretudo oceano."""
+    rng = np.random.default_rng(seed + 1)
+    h, w = dem.shape[0] // POP_FACTOR, dem.shape[1] // POP_FACTOR
+    land = (dem[:h * POP_FACTOR, :w * POP_FACTOR] > 0).reshape(h, POP_FACTOR, w, POP_FACTOR).mean(axis=(1, 3))
+    u = np.arange(w)[None, :] / max(w - 1, 1)
+    density = 400.0 * np.exp(-u / 0.4) * rng.lognormal(0.0, 0.5, size=(h, w))
+    return np.where(land > 0.5, density * land, 0.0).astype("float32")
+
+
+def _write_raster(path, data, transform, nodata):
+    profile = {
+        "driver": "GTiff", "height": data.shape[0], "width": data.shape[1], "count": 1,
+        "dtype": "float32", "crs": "EPSG:4326", "transform": transform,
+        "compress": "deflate", "predictor": 2, "nodata": nodata,
+    }
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(data, 1)
+
+
+def _gdf(rows):
+    return gpd.GeoDataFrame(rows, geometry="geometry", crs="EPSG:4326")
+
+
+def _zones(size, municipality_grid, bairro_grid):
+    """Província, municípios (grelha municipality_grid x municipality_grid
+    sobre a parte em terra) e bairros (bairro_grid x bairro_grid por
+    município)."""
+    span = size * DEM_RES_DEG
+    west, east = ORIGIN_LON + 0.08 * span, ORIGIN_LON + span
+    north, south = ORIGIN_LAT, ORIGIN_LAT - span
+    province = gpd.GeoDataFrame({"NAME_1": ["Luanda"]}, geometry=[box(west, south, east, north)], crs="EPSG:4326")
+
+    munis, points, catchments = [], [], []
+    mw, mh = (east - west) / municipality_grid, (north - south) / municipality_grid
+    for i in range(municipality_grid * municipality_grid):
+        name = MUNICIPALITY_NAMES[i % len(MUNICIPALITY_NAMES)]
+        if i >= len(MUNICIPALITY_NAMES):
+            name = f"{name} {i // len(MUNICIPALITY_NAMES) + 1}"
+        x0, y1 = west + (i % municipality_grid) * mw, north - (i // municipality_grid) * mh
+        munis.append({"NAME_1": "Luanda", "NAME_2": name, "geometry": box(x0, y1 - mh, x0 + mw, y1)})
+        bw, bh = mw / bairro_grid, mh / bairro_grid
+        for j in range(bairro_grid * bairro_grid):
+            bx0, by1 = x0 + (j % bairro_grid) * bw, y1 - (j // bairro_grid) * bh
+            cell = box(bx0, by1 - bh, bx0 + bw, by1)
+            bairro = f"{name} Bairro {j + 1}"
+            points.append({"name": bairro, "municipality": name, "geometry": Point(cell.centroid.x, cell.centroid.y)})
+            catchments.append({"name": bairro, "municipality": name, "geometry": cell})
+
+    return province, _gdf(munis), _gdf(points), _gdf(catchments)
+
+
+def generate(out_dir, size=1024, seed=0, municipality_grid=3, bairro_grid=4):
+    """Escreve o conjunto sintético em out_dir (criada se preciso)."""
+    os.makedirs(out_dir, exist_ok=True)
+    dem = synthetic_dem(size, seed)
+    population = synthetic_population(dem, seed)
+    origin = (ORIGIN_LON, ORIGIN_LAT)
+    _write_raster(os.path.join(out_dir, "dem_luanda.tif"), dem, from_origin(*origin, DEM_RES_DEG, DEM_RES_DEG), None)
+    pop_res = DEM_RES_DEG * POP_FACTOR
+    _write_raster(os.path.join(out_dir, "population_luanda.tif"), population,
+                  from_origin(*origin, pop_res, pop_res), 0)
+
+    province, munis, points, catchments = _zones(size, municipality_grid, bairro_grid)
+    for name, gdf in (("provinces", province), ("municipalities", munis),
+                      ("bairros_com_municipio", points), ("bairro_catchments", catchments)):
+        gdf.to_file(os.path.join(out_dir, f"{name}.geojson"), driver="GeoJSON")
+
+    log(f"{out_dir}: DEM {size}x{size} ({dem.min():.1f}–{dem.max():.1f} m), "
+        f"população {population.sum():,.0f}, {len(munis)} municípios, {len(catchments)} bairros")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera dados sintéticos para o motor de inundação")
+    parser.add_argument("out_dir")
+    parser.add_argument("--size", type=int, default=1024, help="lado do DEM em células de ~30 m")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--municipalities", type=int, default=3, help="municípios por lado da grelha")
+    parser.add_argument("--bairros", type=int, default=4, help="bairros por lado, em cada município")
+    args = parser.parse_args()
+    generate(args.out_dir, args.size, args.seed, args.municipalities, args.bairros)
+
+
+if __name__ == "__main__":
+    main()
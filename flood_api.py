@@ -1,13 +1,27 @@
+import functools
+import hashlib
+import json
 import logging
+import math
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 
 import geopandas as gpd
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
 from shapely.ops import unary_union
 
-from flood_model import MUNICIPALITY_RISK, FloodModel, normalize
+from flood_model import MUNICIPALITY_RISK, PROVINCE, normalize
+from flood_cache import ByteLRUCache
+from flood_jobs import JobRunner, JobStore, is_stale as job_is_stale
+from flood_metrics import REQUEST_SECONDS, end_request, render_metrics, stage, start_request
+from flood_pyramid import FloodPyramid
+from flood_regions import RegionRegistry, discover_regions
+from flood_tiles import FloodTiler, valid_tile
+from flood_topojson import DEFAULT_QUANTIZATION, to_topology, topology_nbytes
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -15,38 +29,209 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 CORS(app)
 
-DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+DATA_DIR = os.environ.get("FLOOD_DATA_DIR") or os.path.join(os.path.dirname(__file__), "data")
 
-# ==================== CARREGAMENTO (uma vez, no arranque do processo) ====================
+# Orçamento de memória (MB) da cache de manchas de inundação já convertidas
+# para TopoJSON (format=topojson), por (cenário, zona de recorte, quantização).
+TOPOLOGY_CACHE_MB = float(os.environ.get("FLOOD_TOPOLOGY_CACHE_MB", "32"))
+
+# ==================== CARREGAMENTO (numa thread de fundo) ====================
 # Nada disto faz chamadas de rede: todos os ficheiros vêm de backend/data/,
-# gerados offline por scripts/prepare_data.py. Ver flood_model.py para o
-# motor de inundação (DEM real + população real).
-logger.info("A carregar motor de inundação (DEM, população, limites administrativos)...")
-flood_model = FloodModel(DATA_DIR)
-provinces_gdf = gpd.read_file(os.path.join(DATA_DIR, "provinces.geojson"))
-municipalities_gdf = gpd.read_file(os.path.join(DATA_DIR, "municipalities.geojson"))
-municipalities_gdf = municipalities_gdf[municipalities_gdf["NAME_1"] == "Luanda"].reset_index(drop=True)
-bairros_gdf = gpd.read_file(os.path.join(DATA_DIR, "bairros_com_municipio.geojson"))
-catchments_gdf = gpd.read_file(os.path.join(DATA_DIR, "bairro_catchments.geojson"))
-# Alguns bairros duplicados no mapeamento manual (fetch_bairros.py) geram
-# catchments vazios (o Voronoi/fallback de buffer não deixa área depois de
-# recortar pelo município) — descartar em vez de rebentar o pedido.
-_n_before = len(catchments_gdf)
-catchments_gdf = catchments_gdf[~catchments_gdf.geometry.is_empty].reset_index(drop=True)
-if len(catchments_gdf) < _n_before:
-    logger.warning(f"{_n_before - len(catchments_gdf)} catchment(s) de bairro vazio(s) descartado(s)")
-
-BAIRRO_POINT_LOOKUP = {
-    (normalize(row.get("municipality")), normalize(row.get("name"))): row.geometry
-    for _, row in bairros_gdf.iterrows() if row.geometry is not None and row.get("name")
-}
+# gerados offline por scripts/prepare_data.py (os limites em FlatGeobuf
+# quando existem, ver read_boundaries). Ver flood_model.py para o
+# motor de inundação (DEM real + população real), flood_pyramid.py para a
+# escolha da resolução por zona (FLOOD_DEM_PYRAMID) e flood_regions.py para
+# as outras províncias, carregadas só quando pedidas.
+#
+# O import só define a aplicação; os dados carregam numa thread de fundo
+# (start_loading) e, até ao fim, os endpoints que precisam deles respondem
+# 503 com Retry-After — o servidor aceita ligações logo e /api/health/live
+# responde desde o início. /api/health/ready diz quando o processo está
+# pronto para tráfego. Com o gunicorn cada worker carrega os seus dados
+# depois do fork, já a servir (ver gunicorn.conf.py).
+
+# "0" = o import não começa o carregamento: quem importa chama
+# start_loading() (o gunicorn.conf.py, em cada worker depois do fork — o
+# mestre importa a aplicação sem dados, ver lá porquê).
+LOAD_ON_IMPORT = os.environ.get("FLOOD_LOAD_ON_IMPORT", "1") != "0"
+
+# Segundos sugeridos (cabeçalho Retry-After) aos pedidos recusados enquanto
+# os dados carregam.
+LOADING_RETRY_AFTER_S = 5
+
+# Preenchidos por _load_data.
+provinces_gdf = municipalities_gdf = bairros_gdf = catchments_gdf = None
+BAIRRO_POINT_LOOKUP = {}
+region_registry = flood_model = flood_tiler = job_runner = None
+ZONE_TABLE = None
+
+topology_cache = ByteLRUCache(TOPOLOGY_CACHE_MB * 1e6, sizeof=topology_nbytes)
 
 PROVINCES_STATIC = [{"id": 1, "name": "Luanda", "risk": "Muito Alto"}]
 
-logger.info(
-    f"Pronto: DEM {flood_model.dem_shape}, {len(municipalities_gdf)} municípios, "
-    f"{len(bairros_gdf)} bairros, {len(catchments_gdf)} catchments de bairro"
-)
+# Estado do carregamento neste processo: pid que o começou (um filho criado
+# por fork a meio do carregamento do pai não herda a thread, tem de começar
+# o seu), início, duração e erro.
+_load_state = {"pid": None, "started": None, "seconds": None, "error": None}
+_load_lock = threading.Lock()
+_loaded = threading.Event()  # fim do carregamento, com ou sem erro
+
+
+def read_boundaries(data_dir, name, where=None):
+    """Limites <name> (ex. "municipalities") de data_dir. De preferência o
+    FlatGeobuf que scripts/prepare_data.py gera ao lado do GeoJSON (binário,
+    já só com as linhas e colunas que a API usa), se não for mais antigo que
+    o GeoJSON — editado depois à mão ou por fetch_bairros.py. where: filtro
+    SQL sobre os atributos, aplicado pelo GDAL na leitura."""
+    path = os.path.join(data_dir, f"{name}.geojson")
+    binary_path = os.path.join(data_dir, f"{name}.fgb")
+    if os.path.exists(binary_path) and (
+        not os.path.exists(path) or os.path.getmtime(binary_path) >= os.path.getmtime(path)
+    ):
+        path = binary_path
+    return gpd.read_file(path, where=where)
+
+
+@functools.lru_cache(maxsize=None)
+def region_municipalities(province, data_dir):
+    """Municípios da província, dos limites municipais da sua pasta."""
+    where = "NAME_1 = '{}'".format(province.replace("'", "''"))
+    return read_boundaries(data_dir, "municipalities", where=where).reset_index(drop=True)
+
+
+def _read_catchments(data_dir):
+    gdf = read_boundaries(data_dir, "bairro_catchments")
+    # Alguns bairros duplicados no mapeamento manual (fetch_bairros.py) geram
+    # catchments vazios (o Voronoi/fallback de buffer não deixa área depois de
+    # recortar pelo município) — descartar em vez de rebentar o pedido.
+    n_before = len(gdf)
+    gdf = gdf[~gdf.geometry.is_empty].reset_index(drop=True)
+    if len(gdf) < n_before:
+        logger.warning(f"{n_before - len(gdf)} catchment(s) de bairro vazio(s) descartado(s)")
+    return gdf
+
+
+def register_region_zones(model, province, data_dir):
+    """Rasteriza no modelo, uma única vez, todas as zonas simuláveis da
+    província (ver FloodModel.register_zones) — os pedidos referem-nas por
+    estes ids em vez de voltar a rasterizar a geometria. Os catchments de
+    bairro só existem para Luanda."""
+    model.register_zones({
+        **{("province", row.NAME_1): row.geometry.__geo_interface__
+           for row in provinces_gdf.itertuples() if row.NAME_1 == province},
+        **{("municipality", row.NAME_2): row.geometry.__geo_interface__
+           for row in region_municipalities(province, data_dir).itertuples()},
+        **({("bairro", row.Index): row.geometry.__geo_interface__
+            for row in catchments_gdf.itertuples()} if province == PROVINCE else {}),
+    })
+    return model
+
+
+def load_region(province, data_dir):
+    """Modelo de uma província (ver flood_regions) com as suas zonas
+    registadas."""
+    return register_region_zones(FloodPyramid(data_dir, province=province), province, data_dir)
+
+
+def _load_data():
+    """Lê os ficheiros de data/ e constrói o modelo de Luanda, preenchendo
+    os globais do módulo. Os GeoJSON, a descoberta das regiões e os rasters
+    do modelo não dependem uns dos outros e carregam em paralelo (a leitura
+    do pyogrio e o rasterio largam o GIL); só o registo das zonas espera
+    por todos."""
+    global provinces_gdf, municipalities_gdf, bairros_gdf, catchments_gdf, BAIRRO_POINT_LOOKUP
+    global region_registry, flood_model, flood_tiler, job_runner, ZONE_TABLE
+
+    logger.info("A carregar motor de inundação (DEM, população, limites administrativos)...")
+    with ThreadPoolExecutor(max_workers=6, thread_name_prefix="flood-load") as pool:
+        provinces = pool.submit(read_boundaries, DATA_DIR, "provinces")
+        municipalities = pool.submit(region_municipalities, PROVINCE, DATA_DIR)
+        bairros = pool.submit(read_boundaries, DATA_DIR, "bairros_com_municipio")
+        catchments = pool.submit(_read_catchments, DATA_DIR)
+        region_dirs = pool.submit(discover_regions, DATA_DIR)
+        pyramid = pool.submit(FloodPyramid, DATA_DIR, province=PROVINCE)
+        provinces_gdf, municipalities_gdf = provinces.result(), municipalities.result()
+        bairros_gdf, catchments_gdf = bairros.result(), catchments.result()
+        region_dirs, pyramid = region_dirs.result(), pyramid.result()
+
+    BAIRRO_POINT_LOOKUP = {
+        (normalize(municipality), normalize(name)): geometry
+        for municipality, name, geometry in zip(bairros_gdf["municipality"], bairros_gdf["name"], bairros_gdf.geometry)
+        if geometry is not None and name
+    }
+
+    # Províncias com dados (pastas descobertas por flood_regions), pelo nome
+    # do GADM. Luanda carrega já e fica sempre; as outras só no primeiro
+    # pedido.
+    region_registry = RegionRegistry(
+        {row.NAME_1: region_dirs[normalize(row.NAME_1)]
+         for row in provinces_gdf.itertuples() if normalize(row.NAME_1) in region_dirs},
+        load_region, pinned=(PROVINCE,),
+    )
+    region_registry.add(PROVINCE, register_region_zones(pyramid, PROVINCE, DATA_DIR))
+    flood_model = pyramid
+    flood_tiler = FloodTiler(flood_model)
+    job_runner = JobRunner(JobStore(os.environ.get("FLOOD_JOB_DIR") or os.path.join(flood_model.cache_dir, "jobs")))
+    ZONE_TABLE = _build_zone_table()
+
+    logger.info(
+        f"Pronto: DEM {flood_model.dem_shape}, {len(municipalities_gdf)} municípios, "
+        f"{len(bairros_gdf)} bairros, {len(catchments_gdf)} catchments de bairro; "
+        f"províncias com dados: {', '.join(region_registry.names())}"
+    )
+
+
+def _load_in_background():
+    try:
+        _load_data()
+    except Exception as e:
+        logger.exception("Falha ao carregar os dados do modelo")
+        _load_state["error"] = str(e)
+    _load_state["seconds"] = round(time.time() - _load_state["started"], 2)
+    _loaded.set()
+
+
+def data_ready():
+    return _loaded.is_set() and not _load_state["error"]
+
+
+def start_loading():
+    """Começa o carregamento dos dados numa thread de fundo, uma vez por
+    processo. Um processo criado por fork depois de o pai ter os dados
+    prontos usa-os tal como estão."""
+    with _load_lock:
+        if _load_state["pid"] == os.getpid() or data_ready():
+            return
+        _load_state.update(pid=os.getpid(), started=time.time(), seconds=None, error=None)
+        _loaded.clear()
+    threading.Thread(target=_load_in_background, name="flood-load", daemon=True).start()
+
+
+def after_fork():
+    """No filho de um fork (os workers do gunicorn, ver gunicorn.conf.py):
+    lock e evento de prontidão novos, com o estado herdado do pai — as
+    threads do pai não passam para o filho e podiam tê-los deixado presos.
+    Se o pai já tinha os dados, o filho usa-os; senão começa o seu
+    carregamento em fundo e responde 503 até acabar."""
+    global _load_lock, _loaded
+    loaded = _loaded.is_set()
+    _load_lock, _loaded = threading.Lock(), threading.Event()
+    if loaded:
+        _loaded.set()
+    else:
+        start_loading()
+
+
+def wait_until_ready(timeout=None):
+    """Bloqueia até os dados estarem carregados, começando o carregamento
+    se ainda não começou neste processo. False se o timeout (segundos)
+    passar primeiro; RuntimeError se o carregamento falhou."""
+    start_loading()
+    if not _loaded.wait(timeout):
+        return False
+    if _load_state["error"]:
+        raise RuntimeError(f"Falha ao carregar os dados do modelo: {_load_state['error']}")
+    return True
 
 
 def now_iso():
@@ -57,6 +242,10 @@ def risk_for_municipality(name):
     return MUNICIPALITY_RISK.get(normalize(name), "Médio")
 
 
+def risk_for_province(name):
+    return next((p["risk"] for p in PROVINCES_STATIC if p["name"] == name), "Médio")
+
+
 def water_level_from_payload(data):
     """Nível de água efectivo (m) usado na componente de maré/storm surge.
     Se o utilizador indicar um valor explícito, usa-o directamente (é
@@ -72,6 +261,126 @@ def water_level_from_payload(data):
     return water_level_m, flood_rate_frac
 
 
+def output_format_from_payload(data):
+    """Formato das geometrias na resposta: "geojson" (omissão) ou
+    "topojson" — arcos partilhados uma só vez e coordenadas quantizadas
+    numa grelha de "quantization" pontos por eixo, para ligações lentas."""
+    output_format = str(data.get("format") or "geojson").lower()
+    if output_format not in ("geojson", "topojson"):
+        raise ValueError(f'Formato "{output_format}" inválido. Use: geojson ou topojson')
+    quantization = int(data.get("quantization") or DEFAULT_QUANTIZATION)
+    if not 2 <= quantization <= 10 ** 9:
+        raise ValueError("quantization deve estar entre 2 e 1e9")
+    return output_format, quantization
+
+
+def encode_collection(collection, name, output, cache_key=None):
+    """FeatureCollection tal como está, ou uma Topology TopoJSON com um
+    objecto "name" se output (ver output_format_from_payload) o pedir.
+    Com cache_key a conversão fica em cache (topology_cache)."""
+    output_format, quantization = output
+    if output_format != "topojson":
+        return collection
+    if cache_key is None:
+        with stage("topojson"):
+            return to_topology({name: collection}, quantization)
+    key = (name, cache_key, quantization)
+    topology = topology_cache.get(key)
+    if topology is None:
+        with stage("topojson"):
+            topology = to_topology({name: collection}, quantization)
+        topology_cache.put(key, topology)
+    return topology
+
+
+def flood_extent_for(water_level_m, flood_rate_frac, clip_geom, clip_key, output, model=None):
+    """Mancha de inundação recortada às zonas clip_key (tuplo de zone_ids,
+    união em clip_geom), no formato pedido — ambas as formas em cache.
+    model: o da província das zonas (por omissão, Luanda)."""
+    if clip_geom is None:
+        return encode_collection({"type": "FeatureCollection", "features": []}, "flood", output)
+    model = model or flood_model
+    collection = model.flood_geojson(water_level_m, flood_rate_frac, clip_geometry=clip_geom, clip_key=clip_key)
+    scenario_key = model._flood_key(water_level_m, flood_rate_frac)
+    return encode_collection(collection, "flood", output, cache_key=(model.province, scenario_key, clip_key))
+
+
+# ==================== TABELA DE ZONAS ====================
+# Atributos das zonas que não dependem do pedido (população, área,
+# centróide, ponto de rótulo, risco), calculados uma vez no arranque: os
+# endpoints informativos (dropdowns ao carregar a página) servem-nos daqui,
+# com ETag, em vez de rasterizar cada zona em cada pedido.
+def _zone_attributes(geometry):
+    geom = geometry.__geo_interface__
+    centroid = geometry.centroid
+    label = geometry.representative_point()  # sempre dentro do polígono
+    return {
+        "population": int(round(flood_model.zone_population(geom))),
+        "area": round(flood_model.zone_area_km2(geom), 1),
+        "lat": centroid.y, "lon": centroid.x,
+        "labelLat": label.y, "labelLon": label.x,
+    }
+
+
+def _with_etag(data):
+    """(data, ETag) — o ETag é o hash do conteúdo, estável entre workers."""
+    return data, hashlib.md5(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _build_zone_table():
+    provinces = []
+    for row in provinces_gdf.itertuples():
+        static = next((p for p in PROVINCES_STATIC if p["name"] == row.NAME_1), None)
+        if static:
+            provinces.append({
+                "id": static["id"], "name": row.NAME_1, "risk": static["risk"], **_zone_attributes(row.geometry),
+            })
+    # As outras províncias com dados (flood_regions) entram sem população
+    # nem área: calculá-las obrigaria a carregar já o modelo de cada uma.
+    for row in provinces_gdf.itertuples():
+        if row.NAME_1 in region_registry and not any(p["name"] == row.NAME_1 for p in provinces):
+            centroid, label = row.geometry.centroid, row.geometry.representative_point()
+            provinces.append({
+                "id": len(provinces) + 1, "name": row.NAME_1, "risk": risk_for_province(row.NAME_1),
+                "lat": centroid.y, "lon": centroid.x, "labelLat": label.y, "labelLon": label.x,
+            })
+
+    municipalities = sorted((
+        {"name": row.NAME_2, "province": "Luanda", "risk": risk_for_municipality(row.NAME_2),
+         **_zone_attributes(row.geometry)}
+        for row in municipalities_gdf.itertuples()
+    ), key=lambda r: r["name"])
+    for i, r in enumerate(municipalities, start=1):
+        r["id"] = i
+
+    # Bairros agrupados pelo nome normalizado do município (None = todos),
+    # com ids sequenciais dentro de cada grupo, como na listagem filtrada.
+    bairros_by_municipality = {}
+    for row in catchments_gdf.itertuples():
+        pt = BAIRRO_POINT_LOOKUP.get((normalize(row.municipality), normalize(row.name)))
+        attributes = _zone_attributes(row.geometry)
+        if pt is not None:
+            attributes["lat"], attributes["lon"] = pt.y, pt.x
+        bairro = {"name": row.name, "municipality": row.municipality,
+                  "risk": risk_for_municipality(row.municipality), **attributes}
+        bairros_by_municipality.setdefault(None, []).append(bairro)
+        bairros_by_municipality.setdefault(normalize(row.municipality), []).append(bairro)
+    bairros = {
+        key: _with_etag([{"id": i, **b} for i, b in enumerate(rows, start=1)])
+        for key, rows in bairros_by_municipality.items()
+    }
+
+    return {"provinces": _with_etag(provinces), "municipalities": _with_etag(municipalities), "bairros": bairros}
+
+
+def conditional_json(payload, etag):
+    """jsonify com ETag (fraco: o corpo leva timestamp); um If-None-Match
+    igual responde 304 sem corpo."""
+    response = jsonify(payload)
+    response.set_etag(etag, weak=True)
+    return response.make_conditional(request)
+
+
 # ==================== ROTAS INFORMATIVAS ====================
 @app.route("/api", methods=["GET"])
 def api_home():
@@ -85,21 +394,114 @@ def api_home():
             "Sem chamadas de rede por pedido",
         ],
         "endpoints": {
-            "health": "/api/health", "info": "/api/info", "provinces": "/api/provinces",
+            "health": "/api/health", "liveness": "/api/health/live", "readiness": "/api/health/ready",
+            "metrics": "/metrics", "info": "/api/info", "provinces": "/api/provinces",
             "municipalities": "/api/municipalities?province=X",
             "bairros": "/api/bairros?province=X&municipality=X",
-            "simulate": "/api/simulate (POST)", "elevation": "/api/elevation?lat=X&lon=Y",
+            "simulate": "/api/simulate (POST)", "simulate_batch": "/api/simulate/batch (POST)",
+            "simulate_stream": "/api/simulate/stream (POST NDJSON, GET ?transport=sse)",
+            "simulate_jobs": "/api/simulate/jobs (POST), /api/simulate/jobs/{id}",
+            "flood_tiles": "/api/flood/tiles/{z}/{x}/{y}.pbf?waterLevel=X&floodRate=Y",
+            "flood_depth_tiles": "/api/flood/depth/{z}/{x}/{y}.png?waterLevel=X&floodRate=Y",
+            "boundaries": "/api/boundaries?level=X&municipality=X&format=geojson|topojson",
+            "elevation": "/api/elevation?lat=X&lon=Y",
         },
     })
 
 
+# ==================== MÉTRICAS ====================
+@app.before_request
+def _start_timings():
+    start_request()
+
+
+# Endpoints que respondem enquanto os dados carregam (não os usam).
+_AVAILABLE_WHILE_LOADING = {"api_home", "liveness", "readiness", "metrics"}
+
+
+def _loading_response():
+    """503 com Retry-After: os dados ainda estão a carregar (ou falharam)."""
+    if _load_state["error"]:
+        payload = {"success": False, "status": "error",
+                   "error": f"Falha ao carregar os dados do modelo: {_load_state['error']}"}
+    else:
+        payload = {"success": False, "status": "loading",
+                   "error": "Os dados do modelo ainda estão a carregar; tente de novo dentro de momentos",
+                   "loadingSeconds": round(time.time() - (_load_state["started"] or time.time()), 2)}
+    return jsonify(payload), 503, {"Retry-After": str(LOADING_RETRY_AFTER_S)}
+
+
+@app.before_request
+def _require_data():
+    if data_ready() or request.endpoint is None or request.endpoint in _AVAILABLE_WHILE_LOADING:
+        return None
+    return _loading_response()
+
+
+@app.after_request
+def _finish_timings(response):
+    """Duração do pedido no histograma por endpoint e, salvo em respostas
+    em streaming (o corpo ainda não foi gerado), os tempos por etapa no
+    cabeçalho Server-Timing."""
+    timings = end_request()
+    if timings is None:
+        return response
+    endpoint = request.url_rule.rule if request.url_rule is not None else "<sem rota>"
+    REQUEST_SECONDS.observe((endpoint, request.method, str(response.status_code)),
+                            time.perf_counter() - timings.start)
+    if not response.is_streamed:
+        response.headers["Server-Timing"] = timings.server_timing()
+        # Sem isto o browser esconde os tempos de páginas de outra origem.
+        response.headers["Timing-Allow-Origin"] = "*"
+    return response
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Histogramas por etapa e por endpoint e estado das caches, no formato
+    de texto do Prometheus (ver flood_metrics)."""
+    caches = {"topology": topology_cache.stats()}
+    if data_ready():
+        caches.update({
+            "flood": flood_model.cache_stats(), "geojson": flood_model.geojson_cache_stats(),
+            "tile": flood_tiler.cache_stats(),
+        })
+    return Response(render_metrics(caches), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.route("/api/health/live", methods=["GET"])
+def liveness():
+    """O processo está vivo — responde desde o arranque, ainda com os dados
+    a carregar. Só falha (500) se o carregamento falhou: reiniciar o
+    processo é a única saída."""
+    if _load_state["error"]:
+        return jsonify({"status": "error", "error": _load_state["error"], "pid": os.getpid()}), 500
+    return jsonify({"status": "ok", "timestamp": now_iso(), "pid": os.getpid()})
+
+
+@app.route("/api/health/ready", methods=["GET"])
+def readiness():
+    """Pronto para tráfego: 200 com os dados carregados, 503 (com
+    Retry-After) até lá."""
+    if not data_ready():
+        return _loading_response()
+    return jsonify({"status": "ready", "timestamp": now_iso(), "pid": os.getpid(),
+                    "loadSeconds": _load_state["seconds"]})
+
+
 @app.route("/api/health", methods=["GET"])
 def health():
     return jsonify({
-        "status": "ok", "message": "API activa", "timestamp": now_iso(),
+        "status": "ok", "message": "API activa", "timestamp": now_iso(), "pid": os.getpid(),
         "dem_shape": list(flood_model.dem_shape),
+        "dem_pyramid": [list(level.dem_shape) for level in flood_model.levels],
+        "regions": region_registry.stats(),
         "municipios_carregados": len(municipalities_gdf),
         "bairros_carregados": len(bairros_gdf),
+        "flood_cache": flood_model.cache_stats(),
+        "tile_cache": flood_tiler.cache_stats(),
+        "topology_cache": topology_cache.stats(),
+        "geojson_cache": flood_model.geojson_cache_stats(),
     })
 
 
@@ -109,7 +511,7 @@ def api_info():
         "name": "API de Simulação de Inundações - Angola",
         "version": "5.0.0",
         "data_available": {
-            "provinces": len(PROVINCES_STATIC), "municipalities": len(municipalities_gdf),
+            "provinces": len(region_registry.names()), "municipalities": len(municipalities_gdf),
             "bairros": len(bairros_gdf), "bairro_catchments": len(catchments_gdf),
         },
         "elevation_source": "Copernicus GLO-30 DEM (30m), local",
@@ -119,21 +521,8 @@ def api_info():
 
 @app.route("/api/provinces", methods=["GET"])
 def get_provinces():
-    result = []
-    for _, row in provinces_gdf.iterrows():
-        name = row["NAME_1"]
-        static = next((p for p in PROVINCES_STATIC if p["name"] == name), None)
-        if not static:
-            continue
-        geom = row.geometry.__geo_interface__
-        centroid = row.geometry.centroid
-        result.append({
-            "id": static["id"], "name": name, "risk": static["risk"],
-            "population": int(round(flood_model.zone_population(geom))),
-            "area": round(flood_model.zone_area_km2(geom), 1),
-            "lat": centroid.y, "lon": centroid.x,
-        })
-    return jsonify({"success": True, "data": result, "count": len(result), "timestamp": now_iso()})
+    result, etag = ZONE_TABLE["provinces"]
+    return conditional_json({"success": True, "data": result, "count": len(result), "timestamp": now_iso()}, etag)
 
 
 @app.route("/api/municipalities", methods=["GET"])
@@ -142,54 +531,28 @@ def get_municipalities():
     if normalize(province) not in ("luanda", "all", ""):
         return jsonify({"success": True, "data": [], "count": 0})
 
-    result = []
-    for _, row in municipalities_gdf.iterrows():
-        name = row["NAME_2"]
-        geom = row.geometry.__geo_interface__
-        centroid = row.geometry.centroid
-        result.append({
-            "name": name, "province": "Luanda", "risk": risk_for_municipality(name),
-            "population": int(round(flood_model.zone_population(geom))),
-            "area": round(flood_model.zone_area_km2(geom), 1),
-            "lat": centroid.y, "lon": centroid.x,
-        })
-    result.sort(key=lambda r: r["name"])
-    for i, r in enumerate(result, start=1):
-        r["id"] = i
-    return jsonify({"success": True, "data": result, "count": len(result), "timestamp": now_iso()})
+    result, etag = ZONE_TABLE["municipalities"]
+    return conditional_json({"success": True, "data": result, "count": len(result), "timestamp": now_iso()}, etag)
 
 
 @app.route("/api/bairros", methods=["GET"])
 def get_bairros():
     municipality = request.args.get("municipality", None)
 
-    gdf = catchments_gdf
-    if municipality and municipality != "all":
-        norm_mun = normalize(municipality)
-        gdf = gdf[gdf["municipality"].apply(lambda v: normalize(v) == norm_mun)]
-        if gdf.empty:
-            available = sorted(catchments_gdf["municipality"].dropna().unique().tolist())
-            return jsonify({
-                "success": True, "data": [], "count": 0,
-                "message": f'Nenhum bairro cadastrado para "{municipality}"',
-                "available_municipalities": available, "timestamp": now_iso(),
-            })
-
-    result = []
-    for i, row in enumerate(gdf.itertuples(), start=1):
-        name = row.name
-        muni = row.municipality
-        pt = BAIRRO_POINT_LOOKUP.get((normalize(muni), normalize(name)))
-        lat, lon = (pt.y, pt.x) if pt is not None else (row.geometry.centroid.y, row.geometry.centroid.x)
-        result.append({
-            "id": i, "name": name, "municipality": muni, "risk": risk_for_municipality(muni),
-            "population": int(round(flood_model.zone_population(row.geometry.__geo_interface__))),
-            "lat": lat, "lon": lon,
+    key = normalize(municipality) if municipality and municipality != "all" else None
+    if key not in ZONE_TABLE["bairros"]:
+        available = sorted(catchments_gdf["municipality"].dropna().unique().tolist())
+        return jsonify({
+            "success": True, "data": [], "count": 0,
+            "message": f'Nenhum bairro cadastrado para "{municipality}"',
+            "available_municipalities": available, "timestamp": now_iso(),
         })
-    return jsonify({
+
+    result, etag = ZONE_TABLE["bairros"][key]
+    return conditional_json({
         "success": True, "data": result, "count": len(result),
         "filter": {"municipality": municipality}, "timestamp": now_iso(),
-    })
+    }, etag)
 
 
 @app.route("/api/boundaries", methods=["GET"])
@@ -199,9 +562,16 @@ def get_boundaries():
     que a página carrega. Devolve pontos de propósito: um polígono grande
     com symbol-placement:"point" faz o MapLibre repetir o rótulo uma vez por
     "tile" interno de desenho quando o zoom é alto — um bairro aparecia com
-    o nome duplicado em vários sítios do mapa."""
+    o nome duplicado em vários sítios do mapa.
+
+    format=topojson devolve em "geojson" uma Topology com os pontos
+    quantizados (ver output_format_from_payload)."""
     level = request.args.get("level", "municipality")
     municipality = request.args.get("municipality", "all")
+    try:
+        output = output_format_from_payload(request.args)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
 
     if level == "bairro":
         gdf = catchments_gdf
@@ -216,7 +586,8 @@ def get_boundaries():
                 "type": "Feature", "geometry": {"type": "Point", "coordinates": [lon, lat]},
                 "properties": {"name": row.name, "municipality": row.municipality},
             })
-        return jsonify({"success": True, "geojson": {"type": "FeatureCollection", "features": features}})
+        collection = {"type": "FeatureCollection", "features": features}
+        return jsonify({"success": True, "geojson": encode_collection(collection, "bairros", output)})
 
     features = []
     for row in municipalities_gdf.itertuples():
@@ -225,7 +596,8 @@ def get_boundaries():
             "type": "Feature", "geometry": {"type": "Point", "coordinates": [c.x, c.y]},
             "properties": {"name": row.NAME_2, "risk": risk_for_municipality(row.NAME_2)},
         })
-    return jsonify({"success": True, "geojson": {"type": "FeatureCollection", "features": features}})
+    collection = {"type": "FeatureCollection", "features": features}
+    return jsonify({"success": True, "geojson": encode_collection(collection, "municipalities", output)})
 
 
 @app.route("/api/elevation", methods=["GET"])
@@ -244,14 +616,56 @@ def get_elevation():
     return jsonify({"success": True, "latitude": lat, "longitude": lon, "elevation": elevation, "unit": "meters"})
 
 
+# ==================== TILES ====================
+@app.route("/api/flood/tiles/<int:z>/<int:x>/<int:y>.pbf", methods=["GET"])
+def flood_vector_tile(z, x, y):
+    """Mancha de inundação de um cenário como tile Mapbox Vector Tile
+    (camada "flood", atributo "severity"), para o MapLibre pedir só a área
+    visível em vez da FeatureCollection inteira da simulação."""
+    if not valid_tile(z, x, y):
+        return jsonify({"success": False, "error": "Tile inválido"}), 400
+    try:
+        water_level_m, flood_rate_frac = water_level_from_payload(request.args)
+    except ValueError:
+        return jsonify({"success": False, "error": "Parâmetros waterLevel/floodRate inválidos"}), 400
+
+    tile = flood_tiler.mvt_tile(water_level_m, flood_rate_frac, z, x, y)
+    return Response(tile, mimetype="application/vnd.mapbox-vector-tile",
+                    headers={"Cache-Control": "public, max-age=3600"})
+
+
+@app.route("/api/flood/depth/<int:z>/<int:x>/<int:y>.png", methods=["GET"])
+def flood_depth_tile(z, x, y):
+    """Profundidade da inundação de um cenário como tile raster PNG, com
+    rampa de cores fixa (ver flood_tiles.DEPTH_COLOR_STOPS). Leva ETag:
+    um If-None-Match igual responde 304 sem corpo."""
+    if not valid_tile(z, x, y):
+        return jsonify({"success": False, "error": "Tile inválido"}), 400
+    try:
+        water_level_m, flood_rate_frac = water_level_from_payload(request.args)
+    except ValueError:
+        return jsonify({"success": False, "error": "Parâmetros waterLevel/floodRate inválidos"}), 400
+
+    etag, png = flood_tiler.depth_png(water_level_m, flood_rate_frac, z, x, y)
+    response = Response(png, mimetype="image/png", headers={"Cache-Control": "public, max-age=3600"})
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+
 # ==================== SIMULAÇÃO ====================
-def _muni_result(row, water_level_m, flood_rate_frac, with_bairros):
+def _muni_zone_stats(rows, water_level_m, flood_rate_frac, model=None):
+    """Estatísticas dos municípios de rows, calculadas em paralelo e
+    devolvidas pela mesma ordem (ver FloodModel.simulate_zones). model: o
+    da província dos municípios (por omissão, Luanda)."""
+    zones = [(r.geometry.__geo_interface__, ("municipality", r.NAME_2)) for r in rows]
+    return (model or flood_model).simulate_zones(zones, water_level_m, flood_rate_frac)
+
+
+def _muni_result(row, stats, water_level_m, flood_rate_frac, with_bairros, province=PROVINCE):
     name = row.NAME_2
-    geom = row.geometry.__geo_interface__
-    stats = flood_model.simulate_zone(geom, water_level_m, flood_rate_frac)
     centroid = row.geometry.centroid
     result = {
-        "name": name, "province": "Luanda", "risk": risk_for_municipality(name),
+        "name": name, "province": province, "risk": risk_for_municipality(name),
         "lat": centroid.y, "lon": centroid.x, **stats,
     }
     if with_bairros:
@@ -265,65 +679,359 @@ def _muni_result(row, water_level_m, flood_rate_frac, with_bairros):
 def _bairro_results_for_municipality(muni_name, water_level_m, flood_rate_frac):
     norm_mun = normalize(muni_name)
     sub = catchments_gdf[catchments_gdf["municipality"].apply(lambda v: normalize(v) == norm_mun)]
+    rows = list(sub.itertuples())
+    zones = [(row.geometry.__geo_interface__, ("bairro", row.Index)) for row in rows]
     results = []
-    for row in sub.itertuples():
+    for row, stats in zip(rows, flood_model.simulate_zones(zones, water_level_m, flood_rate_frac)):
         name = row.name
-        stats = flood_model.simulate_zone(row.geometry.__geo_interface__, water_level_m, flood_rate_frac)
         pt = BAIRRO_POINT_LOOKUP.get((norm_mun, normalize(name)))
         lat, lon = (pt.y, pt.x) if pt is not None else (row.geometry.centroid.y, row.geometry.centroid.x)
         results.append({"name": name, "municipality": muni_name, "lat": lat, "lon": lon, **stats})
     return results
 
 
+def simulation_events(data):
+    """Gerador com o corpo de POST /api/simulate: produz (nível, resultado,
+    feitas, total) à medida que cada zona é calculada e devolve (return) a
+    resposta completa, (payload, status HTTP)."""
+    level = data.get("level", "province")
+    province = data.get("province", "all")
+    municipality = data.get("municipality", "all")
+    bairro_sel = data.get("bairro", "all")
+    water_level_m, flood_rate_frac = water_level_from_payload(data)
+    try:
+        output = output_format_from_payload(data)
+    except ValueError as e:
+        return {"success": False, "error": str(e)}, 400
+
+    logger.info(f"Simulação — level={level} province={province} municipality={municipality} "
+                f"bairro={bairro_sel} waterLevel={water_level_m:.2f}m floodRate={flood_rate_frac:.2f}")
+
+    if level == "bairro":
+        return (yield from _simulate_bairro(province, municipality, bairro_sel, water_level_m, flood_rate_frac, output))
+    if level == "municipality":
+        return (yield from _simulate_municipality(province, municipality, water_level_m, flood_rate_frac, output))
+    if level == "province":
+        return (yield from _simulate_province(province, water_level_m, flood_rate_frac, output))
+    return {"success": False, "error": "Nível inválido. Use: province, municipality ou bairro"}, 400
+
+
+def run_simulation(data, progress=None):
+    """(payload, status HTTP) de POST /api/simulate. progress(feitas,
+    total), se dado, é chamado a cada zona calculada (ver os jobs
+    assíncronos). Num processo do pool dos jobs espera primeiro pelos dados
+    (ver wait_until_ready)."""
+    wait_until_ready()
+    events = simulation_events(data)
+    while True:
+        try:
+            _, _, done, total = next(events)
+        except StopIteration as stop:
+            return stop.value
+        if progress is not None:
+            progress(done, total)
+
+
 @app.route("/api/simulate", methods=["POST"])
 def simulate_flood():
     try:
-        data = request.get_json() or {}
-        level = data.get("level", "province")
-        province = data.get("province", "all")
-        municipality = data.get("municipality", "all")
-        bairro_sel = data.get("bairro", "all")
-        water_level_m, flood_rate_frac = water_level_from_payload(data)
+        payload, status = run_simulation(request.get_json() or {})
+        with stage("serialize"):
+            return jsonify(payload), status
+
+    except Exception as e:
+        logger.exception("Erro na simulação")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+# Features da mancha de inundação (ou de limites de bairro) por evento no
+# modo streaming.
+STREAM_CHUNK_FEATURES = 500
+
+
+@app.route("/api/simulate/stream", methods=["GET", "POST"])
+def simulate_stream():
+    """Variante em streaming de /api/simulate (mesmos parâmetros, no corpo
+    JSON ou na query string): um evento por zona à medida que é calculada,
+    depois o resumo (statistics/parameters) e por fim a mancha de inundação
+    em blocos de STREAM_CHUNK_FEATURES features. NDJSON por omissão;
+    Server-Sent Events com Accept: text/event-stream ou transport=sse (GET,
+    para EventSource). Tipos de evento: zone, summary, geojson,
+    boundaries, end, error."""
+    data = request.get_json(silent=True) or request.args.to_dict()
+    sse = data.get("transport") == "sse" or "text/event-stream" in request.headers.get("Accept", "")
+
+    def encode(event):
+        text = json.dumps(event, separators=(",", ":"))
+        return f"event: {event['type']}\ndata: {text}\n\n" if sse else text + "\n"
+
+    def generate():
+        try:
+            for event in _stream_events(data):
+                yield encode(event)
+        except Exception as e:
+            logger.exception("Erro na simulação (streaming)")
+            yield encode({"type": "error", "status": 500, "success": False, "error": str(e)})
+
+    return Response(
+        stream_with_context(generate()), mimetype="text/event-stream" if sse else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _stream_events(data):
+    events = simulation_events(data)
+    while True:
+        try:
+            level, result, done, total = next(events)
+        except StopIteration as stop:
+            payload, status = stop.value
+            break
+        yield {"type": "zone", "level": level, "done": done, "total": total, "data": result}
+
+    if status >= 400:
+        yield {"type": "error", "status": status, **payload}
+        return
+    streamed = ("data", "geojson", "bairros_boundaries")
+    yield {"type": "summary", **{k: v for k, v in payload.items() if k not in streamed}}
+    for key, event_type in (("geojson", "geojson"), ("bairros_boundaries", "boundaries")):
+        collection = payload.get(key)
+        if collection is None:
+            continue
+        if collection["type"] != "FeatureCollection":
+            # TopoJSON: os arcos são partilhados, não se parte em blocos.
+            yield {"type": event_type, "topology": collection}
+            continue
+        features = collection["features"]
+        for start in range(0, len(features), STREAM_CHUNK_FEATURES):
+            yield {"type": event_type, "features": features[start:start + STREAM_CHUNK_FEATURES]}
+    yield {"type": "end"}
+
+
+# ==================== JOBS ASSÍNCRONOS ====================
+def simulation_job_key(data):
+    """Chave de deduplicação de um pedido de simulação: os mesmos campos que
+    run_simulation usa, com o cenário quantizado como na cache do modelo."""
+    water_level_m, flood_rate_frac = water_level_from_payload(data)
+    output_format, quantization = output_format_from_payload(data)
+    return [
+        "simulate", data.get("level", "province"), data.get("province", "all"),
+        normalize(data.get("municipality", "all") or ""), data.get("bairro", "all"),
+        *flood_model._flood_key(water_level_m, flood_rate_frac),
+        output_format, quantization if output_format == "topojson" else None,
+    ]
+
 
-        logger.info(f"Simulação — level={level} province={province} municipality={municipality} "
-                    f"bairro={bairro_sel} waterLevel={water_level_m:.2f}m floodRate={flood_rate_frac:.2f}")
+@app.route("/api/simulate/jobs", methods=["POST"])
+def submit_simulation_job():
+    """Aceita o mesmo corpo que /api/simulate e devolve logo (202) o id do
+    job; o cálculo corre no pool de threads (ver flood_jobs). Um cenário
+    igual a um job existente devolve esse job (deduplicated=true)."""
+    data = request.get_json() or {}
+    try:
+        key = simulation_job_key(data)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    job, created = job_runner.submit(key, run_simulation, data)
+    status_url = f"/api/simulate/jobs/{job['id']}"
+    logger.info(f"Job {job['id']} {'submetido' if created else 'reaproveitado'} ({job['status']})")
+    return jsonify({
+        "success": True, "job": _job_summary(job), "deduplicated": not created, "statusUrl": status_url,
+    }), 202, {"Location": status_url}
+
+
+@app.route("/api/simulate/jobs/<job_id>", methods=["GET"])
+def get_simulation_job(job_id):
+    """Estado (queued/running/done/error) e progresso (0–1) do job; quando
+    terminado, "result" traz a resposta que /api/simulate daria."""
+    job = job_runner.store.get(job_id) if job_id.isalnum() else None
+    if job is None:
+        return jsonify({"success": False, "error": f'Job "{job_id}" não encontrado'}), 404
+
+    head = json.dumps({"success": True, "job": _job_summary(job)}, separators=(",", ":"))
+    result = job_runner.store.read_result(job_id) if job["status"] in ("done", "error") else None
+    if result is None:
+        return Response(head, mimetype="application/json")
+    # O resultado já está serializado em disco: junta-se sem o voltar a ler
+    # como dicionários Python.
+    return Response(head[:-1] + ',"result":' + result + "}", mimetype="application/json")
+
+
+def _job_summary(job):
+    summary = {k: job.get(k) for k in ("id", "status", "progress", "error", "httpStatus")}
+    for k in ("created", "started", "finished"):
+        if job.get(k):
+            summary[k] = datetime.fromtimestamp(job[k], timezone.utc).isoformat()
+    if job_is_stale(job):
+        summary["status"] = "lost"
+    return summary
+
+
+# Limite de cenários por pedido de varrimento — cada cenário custa pouco nas
+# curvas de exposição, mas a resposta cresce com cenários x zonas.
+MAX_BATCH_SCENARIOS = 500
+
+# Intervalos aceites por cenário do varrimento: nível de água em m (muito
+# acima de qualquer cota do país — o cenário já inunda tudo) e taxa em %.
+BATCH_WATER_LEVEL_RANGE_M = (-100.0, 10000.0)
+BATCH_FLOOD_RATE_RANGE = (0.0, 100.0)
+
+
+@app.route("/api/simulate/batch", methods=["POST"])
+def simulate_batch():
+    """Varrimento de sensibilidade: uma lista de cenários (waterLevel,
+    floodRate) avaliados de uma vez para as zonas de um nível, devolvidos
+    como matrizes compactas cenário x zona. Não passa pela cache de
+    compute_flood — as estatísticas saem das curvas de exposição por zona.
+    A mancha de inundação por cenário só vem com includeGeojson=true (um
+    booleano JSON) — por omissão a resposta traz apenas as matrizes."""
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({"success": False, "error": "O corpo do pedido tem de ser um objecto JSON"}), 400
+        level = data.get("level", "municipality")
+        municipality = data.get("municipality", "all")
+        raw_scenarios = data.get("scenarios")
+        include_geojson = data.get("includeGeojson", False)
+
+        if not isinstance(include_geojson, bool):
+            return jsonify({"success": False, "error": "\"includeGeojson\" tem de ser true ou false"}), 400
+        if not isinstance(raw_scenarios, list) or not raw_scenarios:
+            return jsonify({"success": False, "error": "Indique uma lista não vazia em \"scenarios\""}), 400
+        if len(raw_scenarios) > MAX_BATCH_SCENARIOS:
+            return jsonify({
+                "success": False, "error": f"Máximo de {MAX_BATCH_SCENARIOS} cenários por pedido",
+            }), 400
+        scenarios = []
+        for i, raw in enumerate(raw_scenarios):
+            if not isinstance(raw, dict):
+                return jsonify({
+                    "success": False, "error": f"Cenário {i} inválido: esperado um objecto com waterLevel/floodRate",
+                }), 400
+            try:
+                water_level_m, flood_rate_frac = water_level_from_payload(raw)
+            except (TypeError, ValueError):
+                return jsonify({
+                    "success": False, "error": f"Cenário {i} inválido: waterLevel e floodRate têm de ser números",
+                }), 400
+            (min_level, max_level), (min_rate, max_rate) = BATCH_WATER_LEVEL_RANGE_M, BATCH_FLOOD_RATE_RANGE
+            if not (math.isfinite(flood_rate_frac) and min_rate <= flood_rate_frac * 100 <= max_rate):
+                return jsonify({
+                    "success": False,
+                    "error": f"Cenário {i} inválido: floodRate tem de estar entre {min_rate:g} e {max_rate:g}",
+                }), 400
+            if not (math.isfinite(water_level_m) and min_level <= water_level_m <= max_level):
+                return jsonify({
+                    "success": False,
+                    "error": f"Cenário {i} inválido: waterLevel tem de estar entre {min_level:g} e {max_level:g} m",
+                }), 400
+            scenarios.append((water_level_m, flood_rate_frac))
 
-        if level == "bairro":
-            return _simulate_bairro(province, municipality, bairro_sel, water_level_m, flood_rate_frac)
-        if level == "municipality":
-            return _simulate_municipality(province, municipality, water_level_m, flood_rate_frac)
         if level == "province":
-            return _simulate_province(province, water_level_m, flood_rate_frac)
-        return jsonify({"success": False, "error": "Nível inválido. Use: province, municipality ou bairro"}), 400
+            row = provinces_gdf[provinces_gdf["NAME_1"] == "Luanda"].iloc[0]
+            zones = [(("province", "Luanda"), {"name": "Luanda"})]
+            clip_geoms = [row.geometry]
+        elif level == "municipality":
+            sub = municipalities_gdf
+            if municipality != "all":
+                norm = normalize(municipality)
+                sub = sub[sub["NAME_2"].apply(lambda n: normalize(n) == norm)]
+                if sub.empty:
+                    return jsonify({"success": False, "error": f'Município "{municipality}" não encontrado'}), 404
+            zones = [(("municipality", r.NAME_2), {"name": r.NAME_2}) for r in sub.itertuples()]
+            clip_geoms = list(sub.geometry)
+        elif level == "bairro":
+            if not municipality or municipality == "all":
+                return jsonify({
+                    "success": False, "error": "Seleccione um município específico para simular bairros",
+                }), 400
+            norm_mun = normalize(municipality)
+            sub = catchments_gdf[catchments_gdf["municipality"].apply(lambda v: normalize(v) == norm_mun)]
+            if sub.empty:
+                return jsonify({
+                    "success": False, "error": f'Nenhum bairro cadastrado para o município "{municipality}"',
+                }), 404
+            zones = [(("bairro", r.Index), {"name": r.name, "municipality": r.municipality})
+                     for r in sub.itertuples()]
+            clip_geoms = list(sub.geometry)
+        else:
+            return jsonify({"success": False, "error": "Nível inválido. Use: province, municipality ou bairro"}), 400
+
+        logger.info(f"Simulação em lote — level={level} municipality={municipality} "
+                    f"cenários={len(scenarios)} zonas={len(zones)} geojson={include_geojson}")
+
+        stats = flood_model.simulate_zones_batch([zone_id for zone_id, _ in zones], scenarios)
+        response = {
+            "success": True,
+            "zones": [info for _, info in zones],
+            "scenarios": [{"waterLevel": round(w, 2), "floodRate": f * 100} for w, f in scenarios],
+            "stats": {name: matrix.tolist() for name, matrix in stats.items()},
+            "parameters": {"level": level, "municipality": municipality, "includeGeojson": include_geojson},
+            "timestamp": now_iso(),
+        }
+        if include_geojson:
+            clip_geom = unary_union(clip_geoms).__geo_interface__
+            clip_key = tuple(zone_id for zone_id, _ in zones)
+            response["geojson"] = [
+                flood_model.flood_geojson(w, f, clip_geometry=clip_geom, clip_key=clip_key) for w, f in scenarios
+            ]
+        with stage("serialize"):
+            return jsonify(response)
 
     except Exception as e:
-        logger.exception("Erro na simulação")
+        logger.exception("Erro na simulação em lote")
         return jsonify({"success": False, "error": str(e)}), 500
 
 
-def _simulate_province(province, water_level_m, flood_rate_frac):
-    if province not in ("all", "Luanda"):
-        return jsonify({"success": True, "data": [], "count": 0, "message": "Apenas Luanda disponível"})
-
-    row = provinces_gdf[provinces_gdf["NAME_1"] == "Luanda"].iloc[0]
+# Os _simulate_* são geradores (ver simulation_events): produzem cada zona
+# calculada e devolvem (payload, status HTTP).
+def _simulate_province(province, water_level_m, flood_rate_frac, output):
+    """province=all ou Luanda: o modelo principal. Outra província com
+    dados (flood_regions): o seu modelo, construído no primeiro pedido e
+    protegido de ser descartado até a resposta estar completa."""
+    if province == "all" or normalize(province) == normalize(PROVINCE):
+        return (yield from _simulate_region(
+            flood_model, PROVINCE, municipalities_gdf, province, water_level_m, flood_rate_frac, output,
+        ))
+    if province not in region_registry:
+        return {
+            "success": True, "data": [], "count": 0,
+            "message": f'Sem dados para "{province}". Disponíveis: {", ".join(region_registry.names())}',
+        }, 200
+
+    name, data_dir = region_registry.region(province)
+    with region_registry.use(name) as model:
+        return (yield from _simulate_region(
+            model, name, region_municipalities(name, data_dir), province, water_level_m, flood_rate_frac, output,
+        ))
+
+
+def _simulate_region(model, name, munis_gdf, province, water_level_m, flood_rate_frac, output):
+    row = provinces_gdf[provinces_gdf["NAME_1"] == name].iloc[0]
     geom = row.geometry.__geo_interface__
-    stats = flood_model.simulate_zone(geom, water_level_m, flood_rate_frac)
-
-    municipalities_results = [
-        _muni_result(r, water_level_m, flood_rate_frac, with_bairros=False)
-        for r in municipalities_gdf.itertuples()
-    ]
-    result = {
-        "name": "Luanda", "risk": PROVINCES_STATIC[0]["risk"],
-        "lat": row.geometry.centroid.y, "lon": row.geometry.centroid.x,
-        **stats, "municipalities": municipalities_results,
+    stats = model.simulate_zone(geom, water_level_m, flood_rate_frac, zone_id=("province", name))
+    province_result = {
+        "name": name, "risk": risk_for_province(name),
+        "lat": row.geometry.centroid.y, "lon": row.geometry.centroid.x, **stats,
     }
-
-    flood_extent = flood_model.flood_geojson(water_level_m, flood_rate_frac, clip_geometry=geom)
+    rows = list(munis_gdf.itertuples())
+    yield "province", province_result, 0, len(rows) + 1
+
+    municipalities_results = []
+    zone_stats = _muni_zone_stats(rows, water_level_m, flood_rate_frac, model)
+    for done, (r, stats) in enumerate(zip(rows, zone_stats), start=1):
+        municipalities_results.append(
+            _muni_result(r, stats, water_level_m, flood_rate_frac, with_bairros=False, province=name)
+        )
+        yield "municipality", municipalities_results[-1], done, len(rows) + 1
+    result = {**province_result, "municipalities": municipalities_results}
+
+    flood_extent = flood_extent_for(water_level_m, flood_rate_frac, geom, (("province", name),), output, model)
     flooded_count = sum(1 for m in municipalities_results if m["flooded"])
     total_affected = sum(m["affectedPopulation"] for m in municipalities_results)
 
-    return jsonify({
+    return {
         "success": True, "data": [result], "geojson": flood_extent,
         "statistics": {
             "floodedCount": flooded_count, "totalAffected": total_affected,
@@ -333,29 +1041,33 @@ def _simulate_province(province, water_level_m, flood_rate_frac):
         "parameters": {"level": "province", "floodRate": flood_rate_frac * 100,
                         "waterLevel": round(water_level_m, 2), "province": province},
         "timestamp": now_iso(),
-    })
+    }, 200
 
 
-def _simulate_municipality(province, municipality, water_level_m, flood_rate_frac):
+def _simulate_municipality(province, municipality, water_level_m, flood_rate_frac, output):
     sub = municipalities_gdf
     if municipality != "all":
         norm = normalize(municipality)
         sub = sub[sub["NAME_2"].apply(lambda n: normalize(n) == norm)]
         if sub.empty:
-            return jsonify({"success": False, "error": f'Município "{municipality}" não encontrado'}), 404
+            return {"success": False, "error": f'Município "{municipality}" não encontrado'}, 404
 
     with_bairros = municipality != "all"
     rows = list(sub.itertuples())
-    results = [_muni_result(r, water_level_m, flood_rate_frac, with_bairros) for r in rows]
+    results = []
+    zone_stats = _muni_zone_stats(rows, water_level_m, flood_rate_frac)
+    for done, (r, stats) in enumerate(zip(rows, zone_stats), start=1):
+        results.append(_muni_result(r, stats, water_level_m, flood_rate_frac, with_bairros))
+        yield "municipality", results[-1], done, len(rows) + 1
 
     clip_geom = unary_union([r.geometry for r in rows]).__geo_interface__ if rows else None
-    flood_extent = (flood_model.flood_geojson(water_level_m, flood_rate_frac, clip_geometry=clip_geom)
-                     if clip_geom else {"type": "FeatureCollection", "features": []})
+    clip_key = tuple(("municipality", r.NAME_2) for r in rows)
+    flood_extent = flood_extent_for(water_level_m, flood_rate_frac, clip_geom, clip_key, output)
 
     flooded_count = sum(1 for r in results if r["flooded"])
     total_affected = sum(r["affectedPopulation"] for r in results)
 
-    return jsonify({
+    return {
         "success": True, "data": results, "geojson": flood_extent,
         "statistics": {
             "floodedCount": flooded_count, "totalAffected": total_affected, "totalItems": len(results),
@@ -365,36 +1077,37 @@ def _simulate_municipality(province, municipality, water_level_m, flood_rate_fra
                         "waterLevel": round(water_level_m, 2), "province": province,
                         "municipality": municipality},
         "timestamp": now_iso(),
-    })
+    }, 200
 
 
-def _simulate_bairro(province, municipality, bairro_sel, water_level_m, flood_rate_frac):
+def _simulate_bairro(province, municipality, bairro_sel, water_level_m, flood_rate_frac, output):
     if not municipality or municipality == "all":
-        return jsonify({
+        return {
             "success": False, "error": "Seleccione um município específico para simular bairros",
-        }), 400
+        }, 400
 
     norm_mun = normalize(municipality)
     sub = catchments_gdf[catchments_gdf["municipality"].apply(lambda v: normalize(v) == norm_mun)]
     if sub.empty:
         available = sorted(catchments_gdf["municipality"].dropna().unique().tolist())
-        return jsonify({
+        return {
             "success": False, "error": f'Nenhum bairro cadastrado para o município "{municipality}"',
             "available_municipalities": available,
-        }), 404
+        }, 404
 
     if bairro_sel and bairro_sel != "all":
         sub = sub[sub["name"] == bairro_sel]
         if sub.empty:
-            return jsonify({
+            return {
                 "success": False, "error": f'Bairro "{bairro_sel}" não encontrado em {municipality}',
-            }), 404
+            }, 404
 
     results, features = [], []
-    for row in sub.itertuples():
+    rows = list(sub.itertuples())
+    zones = [(row.geometry.__geo_interface__, ("bairro", row.Index)) for row in rows]
+    zone_stats = flood_model.simulate_zones(zones, water_level_m, flood_rate_frac)
+    for done, (row, (geom_dict, _), stats) in enumerate(zip(rows, zones, zone_stats), start=1):
         name = row.name
-        geom_dict = row.geometry.__geo_interface__
-        stats = flood_model.simulate_zone(geom_dict, water_level_m, flood_rate_frac)
         pt = BAIRRO_POINT_LOOKUP.get((norm_mun, normalize(name)))
         lat, lon = (pt.y, pt.x) if pt is not None else (row.geometry.centroid.y, row.geometry.centroid.x)
         result_data = {
@@ -404,15 +1117,17 @@ def _simulate_bairro(province, municipality, bairro_sel, water_level_m, flood_ra
         }
         results.append(result_data)
         features.append({"type": "Feature", "geometry": geom_dict, "properties": result_data})
+        yield "bairro", result_data, done, len(sub) + 1
 
     flooded_count = sum(1 for r in results if r["flooded"])
     total_affected = sum(r["affectedPopulation"] for r in results)
     clip_geom = unary_union([row.geometry for row in sub.itertuples()]).__geo_interface__
-    flood_extent = flood_model.flood_geojson(water_level_m, flood_rate_frac, clip_geometry=clip_geom)
+    clip_key = tuple(("bairro", index) for index in sub.index)
+    flood_extent = flood_extent_for(water_level_m, flood_rate_frac, clip_geom, clip_key, output)
 
-    return jsonify({
+    return {
         "success": True, "data": results, "geojson": flood_extent,
-        "bairros_boundaries": {"type": "FeatureCollection", "features": features},
+        "bairros_boundaries": encode_collection({"type": "FeatureCollection", "features": features}, "bairros", output),
         "statistics": {
             "floodedCount": flooded_count, "totalAffected": total_affected, "totalBairros": len(results),
             "avgRisk": (flooded_count / len(results) * 100) if results else 0,
@@ -421,7 +1136,7 @@ def _simulate_bairro(province, municipality, bairro_sel, water_level_m, flood_ra
                         "waterLevel": round(water_level_m, 2), "province": province,
                         "municipality": municipality, "bairro": bairro_sel},
         "timestamp": now_iso(),
-    })
+    }, 200
 
 
 @app.errorhandler(404)
@@ -434,13 +1149,15 @@ def internal_error(error):
     return jsonify({"success": False, "error": "Erro interno do servidor"}), 500
 
 
+if LOAD_ON_IMPORT:
+    start_loading()
+
+
 if __name__ == "__main__":
     print("\n" + "=" * 70)
     print("API de Simulação de Inundações — Angola v5.0 (DEM real)")
     print("=" * 70)
     print("Servidor      : http://0.0.0.0:5000")
-    print(f"Municípios    : {len(municipalities_gdf)}")
-    print(f"Bairros       : {len(bairros_gdf)}")
-    print(f"Grid DEM      : {flood_model.dem_shape}")
+    print("Dados         : a carregar em segundo plano (ver /api/health/ready)")
     print("=" * 70 + "\n")
     app.run(debug=True, host="0.0.0.0", port=5000)
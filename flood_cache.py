@@ -0,0 +1,109 @@
+"""
+flood_cache.py
+===============
+Cache LRU limitada por memória (bytes), com contadores, usada para os
+resultados caros do motor de inundação (ver FloodModel.compute_flood).
+
+Em vez de um número fixo de entradas, cada entrada conta pelo tamanho real
+dos seus arrays e as menos usadas recentemente são despejadas até caber no
+orçamento. Opcionalmente as entradas "frias" (fora das mais recentes) são
+guardadas comprimidas — um cenário que volta a ser pedido passado um bocado
+sai muito mais barato a descomprimir do que a recalcular, e ocupa uma
+fracção da memória enquanto espera.
+
+Segura para uso concorrente pelas threads de um worker gunicorn.
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class ByteLRUCache:
+    def __init__(self, max_bytes, sizeof, compress=None, decompress=None, hot_entries=2):
+        """sizeof(valor) -> bytes ocupados; compress/decompress (opcionais)
+        convertem um valor para/de uma forma compacta, também medida com
+        sizeof. hot_entries: quantas entradas mais recentes ficam sempre
+        descomprimidas."""
+        self.max_bytes = int(max_bytes)
+        self._sizeof = sizeof
+        self._compress = compress
+        self._decompress = decompress
+        self._hot_entries = hot_entries
+        self._entries = OrderedDict()  # chave -> (valor, bytes, comprimido?)
+        self._lock = threading.Lock()
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.compressions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            value, nbytes, compressed = entry
+            if compressed:
+                value = self._decompress(value)
+                self._replace(key, value, self._sizeof(value), False)
+            self._entries.move_to_end(key)
+            self._cool_and_evict()
+            return value
+
+    def put(self, key, value):
+        nbytes = self._sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self.resident_bytes -= self._entries.pop(key)[1]
+            if nbytes > self.max_bytes:
+                return  # maior que o orçamento inteiro: não se guarda
+            self._entries[key] = (value, nbytes, False)
+            self.resident_bytes += nbytes
+            self._cool_and_evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.resident_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "compressed_entries": sum(1 for _, _, c in self._entries.values() if c),
+                "resident_bytes": self.resident_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "compressions": self.compressions,
+            }
+
+    # ------------------------------------------------------------- internos
+    def _replace(self, key, value, nbytes, compressed):
+        self.resident_bytes += nbytes - self._entries[key][1]
+        self._entries[key] = (value, nbytes, compressed)
+
+    def _cool_and_evict(self):
+        if self._compress is not None:
+            cold = len(self._entries) - self._hot_entries
+            for key in list(self._entries)[:max(cold, 0)]:
+                value, _, compressed = self._entries[key]
+                if not compressed:
+                    packed = self._compress(value)
+                    self._replace(key, packed, self._sizeof(packed), True)
+                    self.compressions += 1
+        while self.resident_bytes > self.max_bytes and self._entries:
+            _, (_, nbytes, _) = self._entries.popitem(last=False)
+            self.resident_bytes -= nbytes
+            self.evictions += 1
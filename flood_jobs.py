@@ -0,0 +1,201 @@
+"""
+flood_jobs.py
+==============
+Simulações assíncronas: POST /api/simulate/jobs devolve logo um id e o
+cálculo corre num pool de threads limitado, fora das threads de pedidos do
+gunicorn (uma simulação de província com polígonos a DEM_DOWNSAMPLE=1
+aproxima-se do timeout de 120 s e, enquanto corre, prenderia uma das poucas
+threads do worker). As threads do pool usam o modelo já carregado no
+worker — nada é importado nem carregado de novo (ver FLOOD_JOB_WORKERS para
+o custo disso).
+
+O estado de cada job (e o resultado, já serializado em JSON) fica em
+disco, num directório partilhado por todos os workers gunicorn — o GET de
+estado pode cair num worker diferente do que aceitou o job. O id do job é
+o hash da chave do cenário, por isso submissões repetidas do mesmo cenário
+(de qualquer worker) dão o mesmo job em vez de o recalcular. O número de
+jobs guardados é limitado (os mais antigos terminados são apagados).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Threads de cálculo por worker gunicorn (com WEB_CONCURRENCY workers, o
+# máximo de jobs em simultâneo é WEB_CONCURRENCY * FLOOD_JOB_WORKERS).
+# Compromisso: threads no próprio worker partilham o modelo carregado (um
+# processo à parte teria de carregar o seu), mas competem pelo GIL com as
+# threads de pedidos — a vectorização dos polígonos (rasterio.features.shapes,
+# shapely) é sobretudo Python e prende-o durante segundos. Por omissão 1, para
+# uma rajada de jobs não deixar os pedidos interactivos sem CPU; mais só num
+# host com folga.
+JOB_WORKERS = int(os.environ.get("FLOOD_JOB_WORKERS", "1"))
+
+# Jobs guardados em disco e tempo (s) sem actualizações a partir do qual um
+# job "running"/"queued" é dado como perdido (worker reciclado ou morto a
+# meio) e pode ser resubmetido.
+JOB_STORE_MAX = int(os.environ.get("FLOOD_JOB_STORE_MAX", "200"))
+JOB_STALE_S = float(os.environ.get("FLOOD_JOB_STALE_S", "900"))
+
+
+def job_id_for(key):
+    return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:24]
+
+
+class JobStore:
+    """Um <id>.json de estado e um <id>.result.json por job; escritas
+    atómicas (ficheiro temporário + rename)."""
+
+    def __init__(self, directory, max_jobs=JOB_STORE_MAX):
+        self.directory = directory
+        self.max_jobs = max_jobs
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, job_id, suffix=".json"):
+        return os.path.join(self.directory, job_id + suffix)
+
+    def _write(self, path, text):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+    def create(self, job_id, key):
+        """Regista o job como "queued"; False se já existir (outro pedido,
+        possivelmente de outro worker, chegou primeiro)."""
+        now = time.time()
+        job = {"id": job_id, "status": "queued", "progress": 0.0, "key": key,
+               "created": now, "updated": now}
+        try:
+            fd = os.open(self._path(job_id), os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(job, f)
+        return True
+
+    def get(self, job_id):
+        try:
+            with open(self._path(job_id), encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def update(self, job_id, **fields):
+        job = self.get(job_id) or {"id": job_id}
+        job.update(fields, updated=time.time())
+        self._write(self._path(job_id), json.dumps(job))
+        return job
+
+    def write_result(self, job_id, text):
+        self._write(self._path(job_id, ".result.json"), text)
+
+    def read_result(self, job_id):
+        try:
+            with open(self._path(job_id, ".result.json"), encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def discard(self, job_id):
+        for suffix in (".json", ".result.json"):
+            try:
+                os.remove(self._path(job_id, suffix))
+            except FileNotFoundError:
+                pass
+
+    def prune(self):
+        """Apaga os jobs terminados mais antigos acima de max_jobs."""
+        jobs = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".json") and not name.endswith(".result.json"):
+                job = self.get(name[:-len(".json")])
+                if job is not None:
+                    jobs.append(job)
+        finished = sorted((j for j in jobs if j.get("status") in ("done", "error")), key=lambda j: j["updated"])
+        for job in finished[:max(len(jobs) - self.max_jobs, 0)]:
+            self.discard(job["id"])
+
+
+def is_stale(job):
+    return job["status"] in ("queued", "running") and time.time() - job.get("updated", 0) > JOB_STALE_S
+
+
+class JobRunner:
+    """Pool de threads (criado no primeiro job de cada processo) + JobStore.
+    O pool é recriado se o processo mudar: um JobRunner herdado por fork
+    chega ao filho sem as threads do pai."""
+
+    def __init__(self, store, workers=JOB_WORKERS):
+        self.store = store
+        self.workers = workers
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, key, fn, *args):
+        """Corre fn(*args, progress=callback) no pool, com fn a devolver
+        (payload, http_status). Devolve (job, criado?) — um job existente
+        para a mesma chave é reaproveitado, salvo se falhou ou se perdeu."""
+        job_id = job_id_for(key)
+        job = self.store.get(job_id)
+        if job is not None and job["status"] != "error" and not is_stale(job):
+            return job, False
+        if job is not None:
+            self.store.discard(job_id)
+        if not self.store.create(job_id, key):
+            return self.store.get(job_id), False
+
+        future = self._pool().submit(_run_job, self.store, job_id, fn, *args)
+        future.add_done_callback(lambda f: self._on_done(job_id, f))
+        self.store.prune()
+        return self.store.get(job_id), True
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="flood-job")
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _on_done(self, job_id, future):
+        # Erros dentro de fn ficam registados por _run_job; aqui só chegam
+        # falhas fora dele (ex. ao escrever o estado em disco).
+        error = future.exception()
+        if error is not None:
+            logger.error(f"Job {job_id} falhou no pool: {error!r}")
+            self.store.update(job_id, status="error", error=str(error) or repr(error))
+
+
+def _run_job(store, job_id, fn, *args):
+    """Corre numa thread do pool."""
+    store.update(job_id, status="running", started=time.time())
+    last_reported = [0.0]
+
+    def progress(done, total):
+        fraction = done / total if total else 1.0
+        # Uma escrita em disco a cada 5% no máximo.
+        if fraction - last_reported[0] >= 0.05:
+            last_reported[0] = fraction
+            store.update(job_id, progress=round(fraction, 3))
+
+    try:
+        payload, http_status = fn(*args, progress=progress)
+    except Exception as e:
+        logger.exception(f"Erro no job {job_id}")
+        store.update(job_id, status="error", error=str(e), finished=time.time())
+        return
+
+    store.write_result(job_id, json.dumps(payload, separators=(",", ":")))
+    if http_status >= 400:
+        store.update(job_id, status="error", error=payload.get("error"), httpStatus=http_status,
+                     finished=time.time())
+    else:
+        store.update(job_id, status="done", progress=1.0, httpStatus=http_status, finished=time.time())
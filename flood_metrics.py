@@ -0,0 +1,158 @@
+"""
+flood_metrics.py
+=================
+Tempos por etapa do cálculo (compute_flood, rasterização das zonas,
+agregação para o grid de população, sieve, vectorização, serialização) e
+por endpoint, para saber onde foi o tempo de um pedido lento:
+
+  - acumulados em histogramas e expostos em /metrics no formato de texto
+    do Prometheus (0.0.4), junto com o estado das caches;
+  - somados por pedido e devolvidos no cabeçalho Server-Timing, que o
+    separador de rede das devtools do browser mostra por pedido.
+
+O formato de exposição é simples o bastante para o escrever aqui, sem
+depender do prometheus_client. Cada worker gunicorn tem os seus próprios
+contadores: /metrics responde com os do worker que atende o scrape.
+"""
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Limites (s) dos buckets dos histogramas: de 1 ms (avaliar uma curva de
+# zona) até ao timeout do gunicorn (120 s).
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 120.0)
+
+
+class Histogram:
+    """Histograma Prometheus com etiquetas; seguro entre threads."""
+
+    def __init__(self, name, help_text, label_names, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}  # etiquetas -> [contagens por bucket, soma, total]
+        self._lock = threading.Lock()
+
+    def observe(self, labels, seconds):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[0][i] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, (list(c), s, n)) for labels, (c, s, n) in self._series.items())
+        for labels, (counts, total_seconds, count) in series:
+            pairs = list(zip(self.label_names, labels))
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_labels(pairs, le=repr(bound))} {bucket_count}")
+            lines.append(f"{self.name}_bucket{_labels(pairs, le='+Inf')} {count}")
+            lines.append(f"{self.name}_sum{_labels(pairs)} {total_seconds!r}")
+            lines.append(f"{self.name}_count{_labels(pairs)} {count}")
+        return lines
+
+
+def _labels(pairs, **extra):
+    items = [*pairs, *extra.items()]
+    if not items:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in items)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+
+STAGE_SECONDS = Histogram(
+    "flood_stage_seconds", "Duração de cada etapa do cálculo de inundação.", ("stage",),
+)
+REQUEST_SECONDS = Histogram(
+    "flood_http_request_duration_seconds", "Duração dos pedidos HTTP por endpoint.",
+    ("endpoint", "method", "status"),
+)
+
+
+# ==================== TEMPOS POR PEDIDO ====================
+class RequestTimings:
+    """Soma das durações de cada etapa durante um pedido. As etapas de
+    zonas avaliadas em paralelo (FloodModel.simulate_zones) somam-se todas,
+    pelo que a soma pode passar o tempo total do pedido."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.durations = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    def server_timing(self):
+        """Valor do cabeçalho Server-Timing (durações em ms), com o total
+        do pedido no fim."""
+        with self._lock:
+            parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.durations.items()]
+        parts.append(f"total;dur={(time.perf_counter() - self.start) * 1000:.1f}")
+        return ", ".join(parts)
+
+
+_request_timings = contextvars.ContextVar("flood_request_timings", default=None)
+
+
+def start_request():
+    timings = RequestTimings()
+    _request_timings.set(timings)
+    return timings
+
+
+def end_request():
+    timings = _request_timings.get()
+    _request_timings.set(None)
+    return timings
+
+
+@contextmanager
+def stage(name):
+    """Cronometra o bloco como a etapa name: histograma do processo e, se
+    houver um pedido em curso neste contexto, os tempos desse pedido."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        STAGE_SECONDS.observe((name,), seconds)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.add(name, seconds)
+
+
+# ==================== EXPOSIÇÃO ====================
+def cache_metrics(caches):
+    """Linhas Prometheus do estado das caches, a partir de {nome: stats()}
+    (ver ByteLRUCache.stats)."""
+    metrics = [
+        ("flood_cache_entries", "gauge", "Entradas guardadas na cache.", "entries"),
+        ("flood_cache_resident_bytes", "gauge", "Bytes ocupados pela cache.", "resident_bytes"),
+        ("flood_cache_max_bytes", "gauge", "Orçamento de bytes da cache.", "max_bytes"),
+        ("flood_cache_hit_ratio", "gauge", "Fracção de consultas servidas pela cache.", "hit_ratio"),
+        ("flood_cache_hits_total", "counter", "Consultas servidas pela cache.", "hits"),
+        ("flood_cache_misses_total", "counter", "Consultas que não estavam na cache.", "misses"),
+        ("flood_cache_evictions_total", "counter", "Entradas despejadas por falta de espaço.", "evictions"),
+    ]
+    lines = []
+    for name, kind, help_text, field in metrics:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        lines += [f"{name}{_labels([('cache', cache)])} {stats[field]}" for cache, stats in caches.items()]
+    return lines
+
+
+def render_metrics(caches):
+    """Texto completo de /metrics."""
+    lines = [*STAGE_SECONDS.render(), *REQUEST_SECONDS.render(), *cache_metrics(caches)]
+    return "\n".join(lines) + "\n"
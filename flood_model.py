@@ -23,33 +23,101 @@ modelo "bathtub hidrologicamente conectado" usado por visualizadores públicos
 de risco costeiro.
 """
 
+import hashlib
+import json
+import logging
 import os
+import shutil
+import tempfile
 import unicodedata
-from functools import lru_cache
 
 import numpy as np
 import rasterio
 import rasterio.features
-import rasterio.warp
+import rasterio.windows
+import scipy.sparse
 from rasterio.enums import Resampling
 from scipy import ndimage
 from shapely.geometry import shape as shapely_shape
 from skimage.morphology import reconstruction
 
-DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+import flood_outofcore
+from flood_cache import ByteLRUCache
+from flood_metrics import stage
+
+logger = logging.getLogger(__name__)
+
+# Pasta dos dados estáticos (ver scripts/prepare_data.py); FLOOD_DATA_DIR
+# permite apontá-la para outro conjunto, por exemplo os dados sintéticos dos
+# benchmarks (benchmarks/synthetic_data.py).
+DATA_DIR = os.environ.get("FLOOD_DATA_DIR") or os.path.join(os.path.dirname(__file__), "data")
+
+# Província dos rasters de data/ (dem_luanda.tif, population_luanda.tif);
+# as outras ficam cada uma na sua pasta (ver flood_regions.py), com os
+# ficheiros nomeados da mesma forma (dem_benguela.tif, ...).
+PROVINCE = "Luanda"
 
 # Factor de downsampling aplicado ao DEM ao carregar — cada +1 aqui reduz a
 # memória em ~4x (metade da resolução em cada eixo). Serve para caber em
 # planos de hosting com pouca RAM (o processo sozinho, a 30m nativos,
 # ultrapassa 512MB). Ajustável por variável de ambiente sem tocar no código:
 # DEM_DOWNSAMPLE=1 mantém os 30m nativos do Copernicus GLO-30 (precisa de
-# ~1-2GB de RAM); o valor por omissão (2) usa ~60m efectivos.
+# ~1-2GB de RAM para construir a cache; com FLOOD_MEMORY_BUDGET_MB a
+# construção dos rasters fica mais pequena, mas um worker a servir continua
+# nos ~500MB — os 30m nativos NÃO cabem num plano de 512MB, ver abaixo); o
+# valor por omissão (2) usa ~60m efectivos.
 DEM_DOWNSAMPLE = max(1, int(os.environ.get("DEM_DOWNSAMPLE", "2")))
 
+# Cache em disco do DEM, da população e dos rasters derivados (ver
+# FloodModel._load_rasters) e, numa subpasta por conjunto de zonas, das
+# curvas de exposição (ver FloodModel.register_zones). Por omissão fica em
+# data/cache/; FLOOD_CACHE_DIR permite apontá-la para um volume persistente.
+# Incrementar RASTER_CACHE_VERSION sempre que mudar a forma como algum
+# deles é calculado — a chave só cobre os ficheiros de entrada e as zonas,
+# não o código.
+CACHE_DIR = os.environ.get("FLOOD_CACHE_DIR")
+RASTER_CACHE_VERSION = 2
+CACHED_RASTERS = (
+    "dem", "population", "sea_seed",
+    "depression_depth", "sea_level_threshold", "permanent_water_mask", "drainage_grid",
+)
+
+# Memória de trabalho (MB) dos tiles ao construir os rasters da cache: com
+# um valor > 0 o DEM é lido e processado por tiles, directamente para
+# ficheiros mapeados em memória (ver flood_outofcore), e compute_flood
+# trabalha por blocos de linhas. 0 = tudo em memória, mais rápido quando há
+# RAM para isso. Não é um tecto de RSS do processo: só dimensiona os tiles.
+# Ficam de fora as bibliotecas (~100-150MB), as páginas já tocadas dos
+# rasters mapeados, os limites, o registo das zonas e os resultados de
+# compute_flood — num DEM de 4M células, com 256, os tiles usam ~165MB mas
+# o pico de um worker da API chega aos ~500MB. Medir com
+# benchmarks/memory_budget.py.
+MEMORY_BUDGET_MB = float(os.environ.get("FLOOD_MEMORY_BUDGET_MB", "0"))
+
+# Orçamento de memória (MB) da cache de resultados de compute_flood e se as
+# entradas frias são guardadas comprimidas (ver flood_cache.ByteLRUCache).
+FLOOD_CACHE_MB = float(os.environ.get("FLOOD_CACHE_MB", "128"))
+FLOOD_CACHE_COMPRESS = os.environ.get("FLOOD_CACHE_COMPRESS", "1") != "0"
+
+# Orçamento de memória (MB) da cache de polígonos de flood_geojson, por
+# (cenário quantizado, zona de recorte).
+GEOJSON_CACHE_MB = float(os.environ.get("FLOOD_GEOJSON_CACHE_MB", "64"))
+
 # Profundidade de água (m) a partir da qual uma célula é considerada
 # "inundada" — abaixo disto é ruído numérico / poça insignificante.
 MIN_FLOOD_DEPTH = 0.05
 
+# Cotas (m) das sementes do mar (ligação hidrológica) e do oceano
+# permanente (ver FloodModel._build_rasters).
+SEA_SEED_LEVEL = 0.3
+PERMANENT_WATER_LEVEL = 0.05
+
+# Casas decimais a que os cenários são quantizados (nível de água em cm,
+# taxa de inundação em milésimas) — chave da cache de compute_flood e índice
+# dos níveis nas curvas de exposição por zona.
+WATER_LEVEL_DECIMALS = 2
+FLOOD_RATE_DECIMALS = 3
+
 # Classificação de severidade por profundidade média (m) na zona — recalibrada
 # para profundidades reais de inundação urbana (a antiga heurística usava
 # limiares de 8/15/25 m que não correspondiam a metros de água real).
@@ -89,27 +157,521 @@ def classify_severity(avg_depth_m):
     return "Crítica", 90
 
 
+def raster_paths(data_dir, province=PROVINCE):
+    """(DEM, população) de uma província em data_dir."""
+    slug = normalize(province)
+    return os.path.join(data_dir, f"dem_{slug}.tif"), os.path.join(data_dir, f"population_{slug}.tif")
+
+
+def raster_cache_key(data_dir, downsample=DEM_DOWNSAMPLE, province=PROVINCE):
+    """Chave da cache de rasters: hash do conteúdo do DEM, da população e
+    dos limites municipais (de que depende a drenagem) e do factor de
+    downsampling."""
+    h = hashlib.sha256(f"downsample={downsample}".encode())
+    for path in (*raster_paths(data_dir, province), os.path.join(data_dir, "municipalities.geojson")):
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    return h.hexdigest()[:16]
+
+
+def zones_cache_key(zones):
+    """Chave da cache de zonas dentro da pasta de rasters: hash dos ids e
+    das geometrias GeoJSON ({zone_id: geometria}), pela ordem dada."""
+    h = hashlib.sha256()
+    for zone_id, geometry in zones.items():
+        h.update(repr(zone_id).encode())
+        h.update(json.dumps(geometry, sort_keys=True).encode())
+    return h.hexdigest()[:16]
+
+
+def _save_arrays(target_dir, arrays):
+    """Escreve {nome: array} como .npy numa pasta temporária e só depois a
+    renomeia para target_dir — vários workers a arrancar ao mesmo tempo
+    nunca vêem uma cache escrita a meio (se outro a escreveu primeiro, fica
+    a dele). OSError se não der para escrever."""
+    os.makedirs(os.path.dirname(target_dir), exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(target_dir), prefix=".tmp-")
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), array)
+    try:
+        os.rename(tmp_dir, target_dir)
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)  # outro processo escreveu-a primeiro
+
+
+def _nbytes(value):
+    return sum(v.nbytes for v in value if isinstance(v, np.ndarray))
+
+
+def _geojson_nbytes(collection):
+    """Estimativa da memória de uma FeatureCollection de flood_geojson:
+    ~100 bytes por vértice (tuplo de dois floats) mais o dicionário de
+    cada feature."""
+    n_vertices = sum(
+        len(ring) for feature in collection["features"] for ring in feature["geometry"]["coordinates"]
+    )
+    return 100 * n_vertices + 600 * len(collection["features"])
+
+
+def _pack_flood_result(result):
+    """(flood_mask, depth) -> forma compacta sem perdas: máscara em bits e
+    profundidade só nas células com água (quase todo o grid é seco)."""
+    flood_mask, depth = result
+    wet = np.flatnonzero(depth)
+    return np.array(depth.shape), np.packbits(flood_mask.ravel()), wet.astype("int32"), depth.ravel()[wet]
+
+
+def _unpack_flood_result(packed):
+    shape, mask_bits, wet, values = packed
+    n = int(np.prod(shape))
+    flood_mask = np.unpackbits(mask_bits, count=n).view(bool).reshape(shape)
+    depth = np.zeros(n, dtype="float32")
+    depth[wet] = values
+    depth = depth.reshape(shape)
+    flood_mask.flags.writeable = False
+    depth.flags.writeable = False
+    return flood_mask, depth
+
+
+def _overlap_matrix(src_edges, dst_edges):
+    """Matriz esparsa (n_dst x n_src) com o peso de cada célula de origem em
+    cada célula de destino ao longo de um eixo: comprimento da sobreposição,
+    normalizado por linha. Bordas em ordem crescente."""
+    lo = np.searchsorted(src_edges, dst_edges[:-1], side="right") - 1
+    hi = np.searchsorted(src_edges, dst_edges[1:], side="left")
+    lo = np.clip(lo, 0, len(src_edges) - 2)
+    hi = np.clip(hi, lo, len(src_edges) - 1)
+    counts = hi - lo
+    rows = np.repeat(np.arange(len(dst_edges) - 1), counts)
+    cols = np.repeat(lo, counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+    overlap = np.clip(
+        np.minimum(dst_edges[1:][rows], src_edges[cols + 1]) - np.maximum(dst_edges[:-1][rows], src_edges[cols]),
+        0, None,
+    )
+    weights = scipy.sparse.csr_matrix((overlap, (rows, cols)), shape=(len(dst_edges) - 1, len(src_edges) - 1))
+    row_sums = np.asarray(weights.sum(axis=1)).ravel()
+    return scipy.sparse.diags(np.divide(1.0, row_sums, out=np.zeros_like(row_sums), where=row_sums > 0)) @ weights
+
+
+# Índice "nunca" (célula que não chega a inundar em nenhum cenário).
+_NEVER = np.iinfo("int32").max
+
+# Fracção do grid abaixo da qual compute_flood_window calcula só a janela
+# em vez do raster inteiro (partilhado em cache com os tiles e as outras
+# zonas).
+_SMALL_WINDOW_FRACTION = 0.25
+
+# Tamanho máximo (em elementos) das matrizes temporárias cenário x célula ao
+# avaliar vários cenários de uma vez numa curva de exposição.
+_BATCH_CELLS = 2_000_000
+
+# Arrays de uma _ExposureCurve (os irregular_* são as chaves de
+# curve.irregular) e estatísticas estáticas por zona, tal como ficam na
+# cache de zonas (ver FloodModel._save_zones).
+_IRREGULAR_FIELDS = ("dem", "depth", "k_connect", "j_pond", "in_zone", "pop")
+_CURVE_FIELDS = (
+    "coastal_levels", "coastal_cells", "coastal_dem", "coastal_min_dem", "coastal_pop",
+    "pond_levels", "pond_connect", "pond_depth", "pond_in_zone", "pond_pop",
+    *(f"irregular_{name}" for name in _IRREGULAR_FIELDS),
+)
+_ZONE_STATIC_FIELDS = ("population", "elevation_avg", "elevation_min", "elevation_max")
+_ZONE_FILES = ("dem_atoms", "pop_atoms", "zone_static", "curve_offsets", *(f"curve_{name}" for name in _CURVE_FIELDS))
+
+
+def _renumber(values, used):
+    """Posição de cada valor em used (valores distintos, por ordem
+    crescente) — o inverse de np.unique sem ordenar o array inteiro."""
+    lookup = np.zeros(int(used[-1]) + 1 if used.size else 1, dtype="int32")
+    lookup[used] = np.arange(used.size, dtype="int32")
+    return lookup[values]
+
+
+def _flat_index_dtype(shape):
+    """Inteiro mais estreito (int32/int64) para índices planos num raster."""
+    return np.int32 if shape[0] * shape[1] < np.iinfo(np.int32).max else np.int64
+
+
+def _union_positions(a, b):
+    """(união ordenada de a e b, posição de cada elemento de a nela,
+    posição de cada elemento de b nela) para índices inteiros não negativos
+    — uma máscara sobre o intervalo que cobrem, em vez do np.union1d, que
+    volta a ordenar tudo."""
+    both = np.concatenate([a, b]).astype("int64")
+    if not both.size:
+        empty = np.zeros(0, dtype="int64")
+        return empty, empty, empty
+    lo = int(both.min())
+    mask = np.zeros(int(both.max()) - lo + 1, dtype=bool)
+    mask[both - lo] = True
+    rank = np.cumsum(mask, dtype="int32" if mask.size < np.iinfo(np.int32).max else "int64") - 1
+    return np.flatnonzero(mask) + lo, rank[a - lo], rank[b - lo]
+
+
+def _concat_columns(parts, n_columns):
+    """Concatena, coluna a coluna, uma lista de tuplos de arrays."""
+    if not parts:
+        return [np.zeros(0)] * n_columns
+    return [np.concatenate(column) for column in zip(*parts)]
+
+
+class _ExposureCurve:
+    """Curva de exposição de uma zona: as células que contam para as
+    estatísticas da zona (as do DEM dentro dela, mais as que pesam na sua
+    população afectada) ordenadas pelo cenário a partir do qual ficam
+    inundadas, com somas acumuladas de células, elevação e população. Dá as
+    estatísticas de qualquer cenário por pesquisa binária, sem tocar nos
+    rasters completos.
+
+    Três grupos de células, por construção equivalentes a compute_flood:
+      - costeiras: inundadas a partir do nível k_flood (índice em cm), com
+        profundidade nível - dem — curva acumulada por nível;
+      - poças: inundadas a partir da taxa j_pond (índice em milésimas)
+        enquanto ainda não ligadas ao mar (k < k_connect), com profundidade
+        fixa depression_depth — ordenadas por j_pond;
+      - irregulares: as raras células em que, já ligadas ao mar, a poça
+        ainda é mais funda que a água do mar (depressões com semente de mar
+        no fundo) — avaliadas directamente pela fórmula de compute_flood."""
+
+    def __init__(self, chunks, params):
+        """chunks: blocos (células, na zona, peso na população) por ordem
+        crescente de célula — as somas por nível acumulam-se bloco a bloco,
+        só as poças e as irregulares guardam células."""
+        n_levels = params["n_levels"]
+        coastal_count = np.zeros(n_levels, dtype="int64")
+        coastal_cells = np.zeros(n_levels, dtype="int64")
+        coastal_dem = np.zeros(n_levels)
+        coastal_min_dem = np.full(n_levels, np.inf, dtype="float32")
+        coastal_pop = np.zeros(n_levels)
+        ponds, irregular = [], []
+        for cells, in_zone, weight in chunks:
+            keep = ~params["permanent_water"][cells]
+            cells, in_zone, weight = cells[keep], in_zone[keep], weight[keep]
+            regular = params["regular"][cells]
+            dem = params["dem"][cells]
+            depth = params["depth"][cells]
+            k_connect = params["k_connect"][cells]
+            k_flood = params["k_flood"][cells]
+            j_pond = params["j_pond"][cells]
+
+            coastal = regular & (k_flood < _NEVER)
+            levels = k_flood[coastal]
+            coastal_count += np.bincount(levels, minlength=n_levels)
+            coastal_cells += np.bincount(levels[in_zone[coastal]], minlength=n_levels)
+            np.add.at(coastal_dem, levels, np.where(in_zone, dem, 0.0)[coastal].astype("float64"))
+            np.minimum.at(coastal_min_dem, levels, np.where(in_zone, dem, np.inf)[coastal])
+            np.add.at(coastal_pop, levels, weight[coastal])
+
+            pond = regular & (depth > np.float32(MIN_FLOOD_DEPTH)) & (j_pond < _NEVER)
+            ponds.append((j_pond[pond], k_connect[pond], depth[pond], in_zone[pond], weight[pond]))
+            irregular.append((dem[~regular], depth[~regular], k_connect[~regular],
+                              j_pond[~regular], in_zone[~regular], weight[~regular]))
+
+        present = coastal_count > 0
+        self.coastal_levels = np.flatnonzero(present).astype("int32")
+        self.coastal_cells = np.cumsum(coastal_cells[present])
+        self.coastal_dem = np.cumsum(coastal_dem[present])
+        self.coastal_min_dem = np.minimum.accumulate(coastal_min_dem[present])
+        self.coastal_pop = np.cumsum(coastal_pop[present])
+
+        pond_levels, pond_connect, pond_depth, pond_in_zone, pond_pop = _concat_columns(ponds, 5)
+        order = np.argsort(pond_levels, kind="stable")
+        self.pond_levels = pond_levels[order]
+        self.pond_connect = pond_connect[order]
+        self.pond_depth = pond_depth[order]
+        self.pond_in_zone = pond_in_zone[order]
+        self.pond_pop = pond_pop[order]
+
+        self.irregular = dict(zip(
+            ("dem", "depth", "k_connect", "j_pond", "in_zone", "pop"), _concat_columns(irregular, 6),
+        ))
+
+    def arrays(self):
+        """{campo: array} da curva, pelos nomes de _CURVE_FIELDS."""
+        return {
+            name: self.irregular[name[len("irregular_"):]] if name.startswith("irregular_") else getattr(self, name)
+            for name in _CURVE_FIELDS
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """A curva a partir de arrays() — ex. fatias da cache de zonas
+        mapeada em memória."""
+        curve = cls.__new__(cls)
+        for name in _CURVE_FIELDS:
+            if not name.startswith("irregular_"):
+                setattr(curve, name, arrays[name])
+        curve.irregular = {name: arrays[f"irregular_{name}"] for name in _IRREGULAR_FIELDS}
+        return curve
+
+    def evaluate(self, k, j):
+        """Estatísticas da zona para um vector de cenários (níveis k em cm,
+        taxas j em milésimas, arrays inteiros do mesmo tamanho): arrays de
+        células inundadas, soma e máximo da profundidade e população
+        afectada, um valor por cenário. Os cenários são avaliados em
+        conjunto — a pesquisa binária e os prefixos de poças/irregulares
+        são partilhados por todos."""
+        k = np.asarray(k, dtype="int64")
+        j = np.asarray(j, dtype="int64")
+        water = (k / 10 ** WATER_LEVEL_DECIMALS).astype("float32")
+        coastal_on = k >= 1
+        n_flooded = np.zeros(k.size, dtype="int64")
+        depth_sum = np.zeros(k.size)
+        depth_max = np.zeros(k.size)
+        population = np.zeros(k.size)
+
+        if self.coastal_levels.size:
+            i = np.where(coastal_on, np.searchsorted(self.coastal_levels, k, side="right"), 0)
+            reached = i > 0
+            idx = np.maximum(i - 1, 0)
+            n_flooded[reached] = self.coastal_cells[idx[reached]]
+            depth_sum[reached] = n_flooded[reached] * water[reached].astype("float64") - self.coastal_dem[idx[reached]]
+            has_depth = n_flooded > 0
+            depth_max[has_depth] = water[has_depth] - self.coastal_min_dem[idx[has_depth]].astype("float32")
+            population[reached] = self.coastal_pop[idx[reached]]
+
+        # Poças: só o prefixo activo na maior taxa do lote entra na conta,
+        # em blocos de cenários para limitar a matriz cenário x célula.
+        n_active = np.searchsorted(self.pond_levels, j, side="right")
+        width = int(n_active.max()) if n_active.size else 0
+        if width:
+            rows = max(1, _BATCH_CELLS // width)
+            for start in range(0, k.size, rows):
+                sl = slice(start, start + rows)
+                flooded = np.arange(width)[None, :] < n_active[sl, None]
+                flooded &= (self.pond_connect[None, :width] > k[sl, None]) | ~coastal_on[sl, None]
+                counted = flooded & self.pond_in_zone[None, :width]
+                cell_depth = np.where(counted, self.pond_depth[None, :width], np.float32(0))
+                n_flooded[sl] += counted.sum(axis=1)
+                depth_sum[sl] += cell_depth.sum(axis=1, dtype="float64")
+                depth_max[sl] = np.maximum(depth_max[sl], cell_depth.max(axis=1))
+                population[sl] += flooded @ self.pond_pop[:width]
+
+        irr = self.irregular
+        if irr["dem"].size:
+            rows = max(1, _BATCH_CELLS // irr["dem"].size)
+            for start in range(0, k.size, rows):
+                sl = slice(start, start + rows)
+                coastal = coastal_on[sl, None] & (k[sl, None] >= irr["k_connect"][None, :])
+                coastal_depth = np.where(coastal, np.clip(water[sl, None] - irr["dem"][None, :], 0, None), np.float32(0))
+                pond_depth = np.where(j[sl, None] >= irr["j_pond"][None, :], irr["depth"][None, :], np.float32(0))
+                cell_depth = np.maximum(coastal_depth, pond_depth)
+                flooded = cell_depth > np.float32(MIN_FLOOD_DEPTH)
+                counted = flooded & irr["in_zone"][None, :]
+                counted_depth = np.where(counted, cell_depth, np.float32(0))
+                n_flooded[sl] += counted.sum(axis=1)
+                depth_sum[sl] += counted_depth.sum(axis=1, dtype="float64")
+                depth_max[sl] = np.maximum(depth_max[sl], counted_depth.max(axis=1))
+                population[sl] += flooded @ irr["pop"]
+
+        return n_flooded, depth_sum, depth_max, population
+
+
 class FloodModel:
-    def __init__(self, data_dir=DATA_DIR):
-        dem_path = os.path.join(data_dir, "dem_luanda.tif")
-        pop_path = os.path.join(data_dir, "population_luanda.tif")
-
-        with rasterio.open(dem_path) as ds:
-            new_h = max(1, ds.height // DEM_DOWNSAMPLE)
-            new_w = max(1, ds.width // DEM_DOWNSAMPLE)
-            self.dem = ds.read(
-                1, out_shape=(new_h, new_w), resampling=Resampling.average,
-            ).astype("float32")
+    def __init__(self, data_dir=DATA_DIR, cache_dir=None, downsample=DEM_DOWNSAMPLE, province=PROVINCE):
+        self.downsample = downsample
+        self.province = province
+        self.dem_path, self.pop_path = raster_paths(data_dir, province)
+
+        with rasterio.open(self.dem_path) as ds:
+            new_h = max(1, ds.height // downsample)
+            new_w = max(1, ds.width // downsample)
             self.dem_transform = ds.transform * ds.transform.scale(ds.width / new_w, ds.height / new_h)
             self.dem_crs = ds.crs
-            self.dem_shape = self.dem.shape
+            self.dem_shape = (new_h, new_w)
 
-        with rasterio.open(pop_path) as ds:
-            self.population = ds.read(1).astype("float32")
+        with rasterio.open(self.pop_path) as ds:
             self.pop_transform = ds.transform
             self.pop_crs = ds.crs
-            self.pop_shape = self.population.shape
+            self.pop_shape = ds.shape
+
+        # DEM, população e rasters derivados (depressões, ligação ao mar,
+        # oceano, drenagem) — os mais caros do arranque. Guardam-se em disco
+        # numa cache versionada e são sempre usados mapeados em memória, só
+        # de leitura: os arranques seguintes (cada reciclagem de worker
+        # gunicorn) não recalculam nada, e vários workers no mesmo host
+        # partilham as mesmas páginas físicas em vez de terem uma cópia
+        # cada (ver gunicorn.conf.py).
+        self.cache_dir = cache_dir or CACHE_DIR or os.path.join(data_dir, "cache")
+        self.tile_side = flood_outofcore.tile_side_for_budget(MEMORY_BUDGET_MB) if MEMORY_BUDGET_MB > 0 else None
+        self._load_rasters(data_dir, self.cache_dir)
+
+        # Pesos da agregação DEM -> grid de população (média por área, a
+        # mesma que o reproject "average" faz). Os dois grids estão em
+        # EPSG:4326 alinhados aos eixos, por isso o operador é separável:
+        # uma matriz esparsa por eixo em vez de uma por célula.
+        self.pop_weights_y, self.pop_weights_x = self._build_pop_weights()
+
+        # Resultados de compute_flood por cenário: cada entrada guarda dois
+        # arrays do tamanho do DEM (~39MB a 30m nativos), por isso a cache é
+        # limitada em bytes (FLOOD_CACHE_MB), não em número de entradas —
+        # num processo de longa duração (worker gunicorn) o alocador nem
+        # sempre devolve ao SO a memória libertada, e o tecto real de RSS
+        # fica acima do valor "lógico" da cache.
+        self._flood_cache = ByteLRUCache(
+            FLOOD_CACHE_MB * 1e6, sizeof=_nbytes,
+            compress=_pack_flood_result if FLOOD_CACHE_COMPRESS else None,
+            decompress=_unpack_flood_result,
+        )
+        # Polígonos de flood_geojson já vectorizados, por (cenário, zona): a
+        # vectorização custa mais que o próprio compute_flood e as vistas de
+        # província/município repetem-se muito.
+        self._geojson_cache = ByteLRUCache(GEOJSON_CACHE_MB * 1e6, sizeof=_geojson_nbytes)
+
+        # Zonas registadas (município, bairro, ...) — ver register_zones().
+        self._zone_index = {}
+        self._zone_curves = []
+
+    # ---------------------------------------------------------------- setup
+    def _load_rasters(self, data_dir, cache_dir):
+        key = raster_cache_key(data_dir, self.downsample, self.province)
+        key_dir = os.path.join(cache_dir, f"v{RASTER_CACHE_VERSION}", key)
+        self._key_dir = None
+        if not all(os.path.exists(os.path.join(key_dir, f"{name}.npy")) for name in CACHED_RASTERS):
+            if self.tile_side is not None:
+                key_dir = self._build_rasters_tiled(data_dir, key_dir)
+            else:
+                self._build_rasters(data_dir)
+                if not self._save_rasters(key_dir):
+                    return  # sem cache em disco: fica com as cópias em memória
 
+        self._key_dir = key_dir
+        for name in CACHED_RASTERS:
+            setattr(self, name, np.load(os.path.join(key_dir, f"{name}.npy"), mmap_mode="r"))
+        logger.info(f"Rasters mapeados em memória a partir da cache ({key_dir})")
+
+    def _row_blocks(self, first=0, last=None):
+        """Blocos de linhas do DEM (entre first e last) para os cálculos
+        sobre o raster inteiro: um só bloco sem orçamento de memória, de
+        ~um tile (tile_side² células) com ele."""
+        h, w = self.dem_shape
+        last = h if last is None else last
+        block = h if self.tile_side is None else max(1, self.tile_side ** 2 // w)
+        return [slice(start, min(start + block, last)) for start in range(first, last, block)]
+
+    def _build_rasters(self, data_dir):
+        builders = {
+            "dem": lambda: self._read_dem(),
+            "population": lambda: self._read_population(),
+            # Máscara-semente do "mar": células muito próximas do nível do
+            # mar. A área de interesse foi recortada com margem à volta da
+            # província, pelo que o oceano a oeste está sempre representado
+            # dentro do grid.
+            "sea_seed": lambda: self.dem <= SEA_SEED_LEVEL,
+            "depression_depth": self._build_depression_depth,
+            "sea_level_threshold": self._build_sea_level_threshold,
+            "permanent_water_mask": self._build_permanent_water_mask,
+            "drainage_grid": lambda: self._build_drainage_grid(data_dir),
+        }
+        for name in CACHED_RASTERS:
+            setattr(self, name, builders[name]())
+
+    def _build_rasters_tiled(self, data_dir, key_dir):
+        """Os mesmos rasters de _build_rasters, célula a célula, construídos
+        por tiles de tile_side (ver flood_outofcore) directamente em .npy
+        numa pasta temporária, renomeada para key_dir no fim como em
+        _save_rasters. Devolve a pasta onde ficaram — sem escrita na cache,
+        uma pasta temporária do sistema."""
+        try:
+            os.makedirs(os.path.dirname(key_dir), exist_ok=True)
+            tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(key_dir), prefix=".tmp-")
+        except OSError as e:
+            logger.warning(f"Não foi possível escrever a cache de rasters em {key_dir}: {e}")
+            tmp_dir = key_dir = tempfile.mkdtemp(prefix="flood-rasters-")
+        side = self.tile_side
+        grid = list(flood_outofcore.tiles(self.dem_shape, side))
+        h, w = self.dem_shape
+
+        def raster(name, dtype):
+            return flood_outofcore.open_raster(os.path.join(tmp_dir, f"{name}.npy"), self.dem_shape, dtype)
+
+        np.save(os.path.join(tmp_dir, "population.npy"), self._read_population())
+        dem = raster("dem", "float32")
+        flood_outofcore.read_resampled(self.dem_path, dem, side)
+        dem_max = max(dem[rows, cols].max() for rows, cols in grid)
+        sea_seed = raster("sea_seed", bool)
+        for rows, cols in grid:
+            sea_seed[rows, cols] = dem[rows, cols] <= SEA_SEED_LEVEL
+
+        # Ver _build_depression_depth: semente = DEM na orla do grid, cota
+        # máxima no interior; a profundidade substitui o DEM preenchido no
+        # mesmo ficheiro.
+        def depression_seed(rows, cols):
+            tile = dem[rows, cols]
+            seed = np.full(tile.shape, dem_max, dtype="float32")
+            if rows.start == 0:
+                seed[0] = tile[0]
+            if rows.stop == h:
+                seed[-1] = tile[-1]
+            if cols.start == 0:
+                seed[:, 0] = tile[:, 0]
+            if cols.stop == w:
+                seed[:, -1] = tile[:, -1]
+            return seed
+
+        depression = raster("depression_depth", "float32")
+        runs = flood_outofcore.reconstruct_erosion(depression_seed, dem, depression, side)
+        for rows, cols in grid:
+            depression[rows, cols] = np.clip(depression[rows, cols] - dem[rows, cols], 0, None)
+
+        threshold = raster("sea_level_threshold", "float32")
+        if any(sea_seed[rows, cols].any() for rows, cols in grid):
+            runs += flood_outofcore.reconstruct_erosion(
+                lambda rows, cols: np.where(sea_seed[rows, cols], dem[rows, cols], dem_max),
+                dem, threshold, side, footprint=ndimage.generate_binary_structure(2, 1),
+            )
+        else:
+            threshold[:] = np.inf
+
+        labels_path = os.path.join(tmp_dir, ".labels.npy")
+        flood_outofcore.largest_component(
+            lambda rows, cols: dem[rows, cols] <= PERMANENT_WATER_LEVEL,
+            raster("permanent_water_mask", bool),
+            flood_outofcore.open_raster(labels_path, self.dem_shape, "int32"), side,
+        )
+        os.remove(labels_path)
+
+        drainage = raster("drainage_grid", "float32")
+        shapes = self._drainage_shapes(data_dir)
+        if shapes:
+            flood_outofcore.rasterize(shapes, drainage, self.dem_transform, side, fill=0.5)
+        else:
+            drainage[:] = 0.5
+
+        for array in (dem, sea_seed, depression, threshold, drainage):
+            array.flush()
+        logger.info(f"Rasters construídos por tiles de {side}x{side} ({len(grid)} tiles, "
+                    f"{runs} reconstruções de tile)")
+        if tmp_dir != key_dir:
+            try:
+                os.rename(tmp_dir, key_dir)
+            except OSError:
+                shutil.rmtree(tmp_dir, ignore_errors=True)  # outro processo escreveu-a primeiro
+        return key_dir
+
+    def _read_dem(self):
+        with rasterio.open(self.dem_path) as ds:
+            return ds.read(1, out_shape=self.dem_shape, resampling=Resampling.average).astype("float32")
+
+    def _read_population(self):
+        with rasterio.open(self.pop_path) as ds:
+            return ds.read(1).astype("float32")
+
+    def _save_rasters(self, key_dir):
+        """Escreve os rasters numa pasta temporária e só depois a renomeia
+        para o nome final — vários workers a arrancar ao mesmo tempo nunca
+        vêem uma cache escrita a meio. Falhar a escrita (disco só de
+        leitura, sem espaço) não impede o arranque; devolve se a cache
+        ficou disponível."""
+        try:
+            _save_arrays(key_dir, {name: getattr(self, name) for name in CACHED_RASTERS})
+            logger.info(f"Rasters guardados em cache ({key_dir})")
+            return True
+        except OSError as e:
+            logger.warning(f"Não foi possível guardar a cache de rasters em {key_dir}: {e}")
+            return False
+
+    def _build_depression_depth(self):
         # Depressões preenchidas por reconstrução morfológica (equivalente a
         # "priority-flood"/imfill): filled - dem = profundidade da depressão
         # até ao ponto de transbordo mais baixo. Só se guarda a profundidade
@@ -118,45 +680,66 @@ class FloodModel:
         seed = self.dem.copy()
         seed[1:-1, 1:-1] = self.dem.max()
         filled_dem = reconstruction(seed, self.dem, method="erosion").astype("float32")
-        self.depression_depth = np.clip(filled_dem - self.dem, 0, None)
-        del seed, filled_dem
-
-        # Máscara-semente do "mar": células muito próximas do nível do mar.
-        # A área de interesse foi recortada com margem à volta da província,
-        # pelo que o oceano a oeste está sempre representado dentro do grid.
-        self.sea_seed = self.dem <= 0.3
+        return np.clip(filled_dem - self.dem, 0, None)
 
+    def _build_permanent_water_mask(self):
         # Água permanente (o próprio oceano Atlântico dentro da AOI): a maior
         # componente ligada ao nível do mar. Excluída de tudo o resto — não é
         # "inundação", já é água em qualquer cenário, e sem esta exclusão
         # cada pedido devolvia o oceano inteiro como mancha inundada.
-        labeled_sea, _ = ndimage.label(self.dem <= 0.05)
+        labeled_sea, _ = ndimage.label(self.dem <= PERMANENT_WATER_LEVEL)
         if labeled_sea.max() > 0:
             counts = np.bincount(labeled_sea.ravel())
             counts[0] = 0  # fundo (não-água) não conta
             largest_label = counts.argmax()
-            self.permanent_water_mask = labeled_sea == largest_label
-        else:
-            self.permanent_water_mask = np.zeros(self.dem_shape, dtype=bool)
+            return labeled_sea == largest_label
+        return np.zeros(self.dem_shape, dtype=bool)
 
-        self.drainage_grid = self._build_drainage_grid(data_dir)
+    def _build_sea_level_threshold(self):
+        """Nível de água mínimo a que cada célula fica hidrologicamente ligada
+        ao mar: a menor cota máxima ao longo de qualquer caminho (vizinhança
+        de 4, a mesma do ndimage.label usado antes) até uma célula-semente.
+        Com isto a componente costeira de qualquer cenário é uma única
+        comparação (sea_level_threshold <= nível de água), em vez de rotular
+        componentes ligadas em cada cenário novo.
 
-        self._flood_cache = {}
+        Priority-flood (reconstrução morfológica por erosão) a partir de
+        sea_seed. Sem sementes (AOI sem mar) nenhuma célula fica ligada em
+        nenhum nível."""
+        if not self.sea_seed.any():
+            return np.full(self.dem_shape, np.inf, dtype="float32")
+        seed = np.where(self.sea_seed, self.dem, self.dem.max())
+        return reconstruction(
+            seed, self.dem, method="erosion", footprint=ndimage.generate_binary_structure(2, 1),
+        ).astype("float32")
 
-    # ---------------------------------------------------------------- setup
-    def _build_drainage_grid(self, data_dir):
+    def _build_pop_weights(self):
+        def edges(transform, shape):
+            ys = transform.f + transform.e * np.arange(shape[0] + 1)
+            xs = transform.c + transform.a * np.arange(shape[1] + 1)
+            return -ys, xs  # y a crescer para norte -> ordem crescente
+
+        dem_y, dem_x = edges(self.dem_transform, self.dem_shape)
+        pop_y, pop_x = edges(self.pop_transform, self.pop_shape)
+        return _overlap_matrix(dem_y, pop_y), _overlap_matrix(dem_x, pop_x)
+
+    def _drainage_shapes(self, data_dir):
+        """(geometria, factor de drenagem) de cada município da província."""
         import geopandas as gpd
 
         munis_path = os.path.join(data_dir, "municipalities.geojson")
         gdf = gpd.read_file(munis_path)
-        gdf = gdf[gdf["NAME_1"] == "Luanda"]
+        gdf = gdf[gdf["NAME_1"].map(normalize) == normalize(self.province)]
 
         shapes = []
         for _, row in gdf.iterrows():
             risk = MUNICIPALITY_RISK.get(normalize(row["NAME_2"]), "Médio")
             factor = DRAINAGE_FACTOR.get(normalize(risk), 0.5)
             shapes.append((row.geometry, factor))
+        return shapes
 
+    def _build_drainage_grid(self, data_dir):
+        shapes = self._drainage_shapes(data_dir)
         if not shapes:
             return np.full(self.dem_shape, 0.5, dtype="float32")
 
@@ -166,127 +749,555 @@ class FloodModel:
         )
         return grid
 
+    def register_zones(self, zones):
+        """Rasteriza, uma única vez, todas as zonas conhecidas (dict
+        {zone_id: geometria GeoJSON}) num raster de rótulos inteiros por grid
+        (DEM e população). Com isto simulate_zone(zone_id=...) deixa de correr
+        geometry_mask por pedido: as estatísticas de todas as zonas saem de um
+        único np.bincount por cenário.
+
+        As zonas sobrepõem-se (a província contém os municípios, que contêm
+        os catchments de bairro; vários municípios pós-2024 sobrepõem-se ao
+        município-mãe do GADM), por isso o rótulo de cada célula não é a
+        zona mas o conjunto exacto de zonas que a contêm ("átomo" da
+        sobreposição). Reduz-se por átomo e soma-se por zona com uma matriz
+        esparsa zona x átomo.
+
+        Os rasters de átomos, as estatísticas estáticas e as curvas de
+        exposição ficam numa pasta da cache de rasters por conjunto de zonas
+        (ver zones_cache_key) e são usados mapeados em memória, como os
+        rasters: os arranques seguintes só os mapeiam, e os workers no mesmo
+        host partilham as páginas."""
+        zone_ids = list(zones)
+        self._zone_index = {zone_id: row for row, zone_id in enumerate(zone_ids)}
+        zones_dir = os.path.join(self._key_dir, f"zones-{zones_cache_key(zones)}") if self._key_dir else None
+        if zones_dir and all(os.path.exists(os.path.join(zones_dir, f"{name}.npy")) for name in _ZONE_FILES):
+            self._load_zones(zones_dir, len(zone_ids))
+            logger.info(f"{len(zone_ids)} zonas mapeadas em memória a partir da cache ({zones_dir})")
+            return
+        self._build_zones(zones, zone_ids)
+        if zones_dir:
+            try:
+                _save_arrays(zones_dir, self._zone_arrays())
+            except OSError as e:
+                logger.warning(f"Não foi possível guardar a cache de zonas em {zones_dir}: {e}")
+            else:
+                self._load_zones(zones_dir, len(zone_ids))
+
+    def _build_zones(self, zones, zone_ids):
+        dem_atoms = np.zeros(self.dem_shape, dtype="int32")
+        pop_atoms = np.zeros(self.pop_shape, dtype="int32")
+        dem_members, pop_members = [frozenset()], [frozenset()]
+
+        for zone_row, zone_id in enumerate(zone_ids):
+            geometry = zones[zone_id]
+            dem_mask = rasterio.features.geometry_mask(
+                [geometry], out_shape=self.dem_shape, transform=self.dem_transform, invert=True,
+            )
+            if not dem_mask.any():
+                dem_mask = self._nearest_cell_mask(geometry)
+            pop_mask = rasterio.features.geometry_mask(
+                [geometry], out_shape=self.pop_shape, transform=self.pop_transform, invert=True,
+            )
+            for atoms, members, mask in ((dem_atoms, dem_members, dem_mask), (pop_atoms, pop_members, pop_mask)):
+                # Cada átomo tocado pela zona dá origem a um átomo novo
+                # (o mesmo conjunto de zonas + esta); as células fora da
+                # zona ficam no átomo antigo.
+                touched = atoms[mask]
+                old = np.flatnonzero(np.bincount(touched, minlength=len(members)))
+                atoms[mask] = len(members) + _renumber(touched, old)
+                members.extend(members[a] | {zone_row} for a in old)
+
+        self._dem_atoms, self._dem_membership = self._compact_atoms(dem_atoms, dem_members, len(zone_ids))
+        self._pop_atoms, self._pop_membership = self._compact_atoms(pop_atoms, pop_members, len(zone_ids))
+
+        # Estatísticas que não dependem do cenário (população total,
+        # elevação média/mín/máx) — calculadas aqui uma vez.
+        n_dem_atoms = self._dem_membership.shape[1]
+        atom_index = np.arange(n_dem_atoms)
+        n_cells = self._dem_membership @ np.bincount(self._dem_atoms.ravel(), minlength=n_dem_atoms)
+        dem_sum = self._dem_membership @ np.bincount(
+            self._dem_atoms.ravel(), weights=self.dem.ravel(), minlength=n_dem_atoms,
+        )
+        self._zone_static = {
+            "population": self._pop_membership @ np.bincount(
+                self._pop_atoms.ravel(), weights=self.population.ravel(), minlength=self._pop_membership.shape[1],
+            ),
+            "elevation_avg": dem_sum / np.maximum(n_cells, 1),
+            "elevation_min": self._reduce_atoms(
+                np.minimum, ndimage.minimum(self.dem, self._dem_atoms, atom_index), self._dem_membership,
+            ),
+            "elevation_max": self._reduce_atoms(
+                np.maximum, ndimage.maximum(self.dem, self._dem_atoms, atom_index), self._dem_membership,
+            ),
+        }
+        self._zone_curves = self._build_exposure_curves()
+        logger.info(
+            f"{len(zone_ids)} zonas rasterizadas ({n_dem_atoms} átomos no grid do DEM, "
+            f"{self._pop_membership.shape[1]} no grid de população) e curvas de exposição calculadas"
+        )
+
+    def _zone_arrays(self):
+        """{nome: array} da cache de zonas: os rasters de átomos, as
+        estatísticas estáticas (uma linha por campo) e, por campo das
+        curvas, os arrays de todas as zonas concatenados, com as fronteiras
+        de cada zona em curve_offsets."""
+        arrays = {
+            "dem_atoms": self._dem_atoms, "pop_atoms": self._pop_atoms,
+            "zone_static": np.stack([self._zone_static[name] for name in _ZONE_STATIC_FIELDS]),
+        }
+        curves = [curve.arrays() for curve in self._zone_curves]
+        offsets = []
+        for name in _CURVE_FIELDS:
+            parts = [curve[name] for curve in curves]
+            # Zonas sem células num grupo têm arrays vazios float64 (ver
+            # _concat_columns): o tipo é o das que têm.
+            non_empty = [part for part in parts if part.size]
+            dtype = np.result_type(*non_empty) if non_empty else np.float64
+            arrays[f"curve_{name}"] = np.concatenate(
+                [part.astype(dtype, copy=False) for part in parts] or [np.zeros(0, dtype=dtype)]
+            )
+            offsets.append(np.concatenate([[0], np.cumsum([part.size for part in parts], dtype="int64")]))
+        arrays["curve_offsets"] = np.array(offsets, dtype="int64")
+        return arrays
+
+    def _load_zones(self, zones_dir, n_zones):
+        arrays = {name: np.load(os.path.join(zones_dir, f"{name}.npy"), mmap_mode="r") for name in _ZONE_FILES}
+        self._dem_atoms, self._pop_atoms = arrays["dem_atoms"], arrays["pop_atoms"]
+        self._zone_static = dict(zip(_ZONE_STATIC_FIELDS, arrays["zone_static"]))
+        offsets = np.asarray(arrays["curve_offsets"])
+        self._zone_curves = [
+            _ExposureCurve.from_arrays({
+                name: arrays[f"curve_{name}"][offsets[i, row]:offsets[i, row + 1]]
+                for i, name in enumerate(_CURVE_FIELDS)
+            })
+            for row in range(n_zones)
+        ]
+        # Só servem para construir as curvas.
+        self._dem_membership = self._pop_membership = None
+
+    @staticmethod
+    def _compact_atoms(atoms, members, n_zones):
+        """Renumera os átomos efectivamente presentes no raster (0..n-1) e
+        devolve-os com a matriz esparsa de pertença zona x átomo."""
+        used = np.flatnonzero(np.bincount(atoms.ravel(), minlength=len(members)))
+        rows, cols = [], []
+        for col, atom in enumerate(used):
+            rows.extend(members[atom])
+            cols.extend([col] * len(members[atom]))
+        membership = scipy.sparse.csr_matrix(
+            (np.ones(len(rows)), (rows, cols)), shape=(n_zones, len(used)),
+        )
+        return _renumber(atoms, used), membership
+
+    @staticmethod
+    def _reduce_atoms(ufunc, atom_values, membership):
+        """Reduz (mín/máx) valores por átomo para valores por zona, seguindo
+        a matriz de pertença; zonas sem átomos ficam a 0."""
+        out = np.zeros(membership.shape[0])
+        non_empty = np.diff(membership.indptr) > 0
+        if non_empty.any():
+            reduced = ufunc.reduceat(np.asarray(atom_values, dtype="float64")[membership.indices],
+                                     membership.indptr[:-1][non_empty])
+            out[non_empty] = reduced
+        return out
+
+    def _cell_activation(self):
+        """Para cada célula do DEM (arrays planos), o primeiro cenário
+        quantizado em que fica inundada por cada componente de compute_flood
+        — reproduz exactamente a aritmética float32 de compute_flood:
+          k_connect: índice do nível (cm) a partir do qual liga ao mar;
+          k_flood:   índice a partir do qual a água do mar passa MIN_FLOOD_DEPTH;
+          j_pond:    índice da taxa (milésimas) a partir do qual a poça transborda;
+          regular:   ligada ao mar, a água do mar é sempre >= a da poça.
+        Calculado por blocos de linhas (ver _row_blocks); com orçamento de
+        memória os resultados ficam em ficheiros temporários mapeados em
+        memória."""
+        h, w = self.dem_shape
+        scale = 10 ** WATER_LEVEL_DECIMALS
+        n_levels = int(np.ceil((float(self.dem.max()) + 2 * MIN_FLOOD_DEPTH) * scale)) + 2
+        levels = (np.arange(n_levels) / scale).astype("float32")
+
+        def output(dtype):
+            if self.tile_side is None:
+                return np.empty(h * w, dtype=dtype)
+            return np.memmap(tempfile.TemporaryFile(), dtype=dtype, mode="w+", shape=(h * w,))
+
+        params = {
+            "dem": self.dem.ravel(), "depth": self.depression_depth.ravel(),
+            "permanent_water": self.permanent_water_mask.ravel(), "n_levels": n_levels,
+            "k_connect": output("int32"), "k_flood": output("int32"), "j_pond": output("int32"),
+            "regular": output(bool),
+        }
+        for rows in self._row_blocks():
+            cells = slice(rows.start * w, rows.stop * w)
+            for name, values in self._block_activation(rows, levels).items():
+                params[name][cells] = values
+        return params
+
+    def _block_activation(self, rows, levels):
+        dem = self.dem[rows].ravel()
+        depth = self.depression_depth[rows].ravel()
+        threshold = self.sea_level_threshold[rows].ravel()
+        drainage = self.drainage_grid[rows].ravel()
+        min_depth = np.float32(MIN_FLOOD_DEPTH)
+        scale = 10 ** WATER_LEVEL_DECIMALS
+        n_levels = levels.size
+
+        connected = np.isfinite(threshold)
+        k_connect = np.full(dem.size, _NEVER, dtype="int32")
+        k_connect[connected] = np.searchsorted(levels, threshold[connected], side="left")
+        k_connect[k_connect >= n_levels] = _NEVER
+
+        k_deep = np.clip(np.floor((dem.astype("float64") + MIN_FLOOD_DEPTH) * scale) - 1, 0, n_levels - 1).astype("int32")
+        while True:
+            short = (k_deep < n_levels - 1) & ~(levels[k_deep] - dem > min_depth)
+            if not short.any():
+                break
+            k_deep[short] += 1
+        k_flood = np.maximum(np.maximum(k_connect, k_deep), 1)
+
+        rate_scale = 10 ** FLOOD_RATE_DECIMALS
+        ponds = depth > 0
+        j_pond = np.full(dem.size, _NEVER, dtype="int32")
+        j = np.clip(np.floor(depth[ponds] / drainage[ponds] / 2.0 * rate_scale) - 1, 0, None).astype("int64")
+        while True:
+            short = ~(((j / rate_scale) * 2.0).astype("float32") * drainage[ponds] >= depth[ponds])
+            if not short.any():
+                break
+            j[short] += 1
+        j_pond[ponds] = np.minimum(j, _NEVER - 1)
+
+        return {"k_connect": k_connect, "k_flood": k_flood, "j_pond": j_pond, "regular": (threshold - dem) >= depth}
+
+    def _build_exposure_curves(self):
+        """Uma _ExposureCurve por zona registada, a partir dos átomos de
+        register_zones: células do DEM na zona (contam para área/profundidade)
+        e o peso de cada célula do DEM na população afectada da zona (a
+        transposta da agregação DEM -> população, aplicada à população da
+        zona). Cada zona é percorrida pelos blocos de linhas que toca (ver
+        _row_blocks), para a memória temporária ser a de um bloco."""
+        params = self._cell_activation()
+        dem_order = np.argsort(self._dem_atoms.ravel(), kind="stable").astype(_flat_index_dtype(self.dem_shape))
+        dem_starts = np.concatenate([[0], np.cumsum(np.bincount(self._dem_atoms.ravel()))])
+        pop_order = np.argsort(self._pop_atoms.ravel(), kind="stable")
+        pop_starts = np.concatenate([[0], np.cumsum(np.bincount(self._pop_atoms.ravel()))])
+        population = self.population.ravel()
+        weights_y = self.pop_weights_y.T.tocsr()
+        dem_w = self.dem_shape[1]
+
+        def zone_atoms(membership, row):
+            return membership.indices[membership.indptr[row]:membership.indptr[row + 1]]
+
+        def zone_chunks(row):
+            # Células do DEM da zona: uma lista crescente por átomo.
+            dem_lists = [dem_order[dem_starts[a]:dem_starts[a + 1]] for a in zone_atoms(self._dem_membership, row)]
+            dem_lists = [cells for cells in dem_lists if cells.size]
+            pop_atoms = zone_atoms(self._pop_membership, row)
+            pop_cells = np.sort(np.concatenate([pop_order[pop_starts[a]:pop_starts[a + 1]] for a in pop_atoms]
+                                               or [np.zeros(0, dtype=pop_order.dtype)]))
+            zone_pop = scipy.sparse.csr_matrix(
+                (population[pop_cells], np.unravel_index(pop_cells, self.pop_shape)), shape=self.pop_shape,
+            )
+
+            # Linhas do DEM que a zona toca: as das suas células e as que
+            # pesam na sua população.
+            touched = [cells[[0, -1]] // dem_w for cells in dem_lists]
+            if pop_cells.size:
+                touched.append(self.pop_weights_y[np.unique(pop_cells // self.pop_shape[1])].indices)
+            touched = np.concatenate(touched or [np.zeros(0, dtype="int64")])
+            if not touched.size:
+                return
+            for rows in self._row_blocks(int(touched.min()), int(touched.max()) + 1):
+                lo, hi = rows.start * dem_w, rows.stop * dem_w
+                dem_cells = np.sort(np.concatenate(
+                    [cells[np.searchsorted(cells, lo):np.searchsorted(cells, hi)] for cells in dem_lists]
+                    or [np.zeros(0, dtype=dem_order.dtype)]
+                )).astype("int64")
+                contribution = (weights_y[rows] @ zone_pop @ self.pop_weights_x).tocoo()
+                pop_cells_on_dem = (contribution.row.astype("int64") + rows.start) * dem_w + contribution.col
+
+                cells, dem_positions, pop_positions = _union_positions(dem_cells, pop_cells_on_dem)
+                weight = np.zeros(cells.size)
+                weight[pop_positions] = contribution.data
+                in_zone = np.zeros(cells.size, dtype=bool)
+                in_zone[dem_positions] = True
+                yield cells, in_zone, weight
+
+        return [_ExposureCurve(zone_chunks(row), params) for row in range(self._dem_membership.shape[0])]
+
     # ------------------------------------------------------------ flood core
+    def cache_stats(self):
+        """Contadores da cache de compute_flood (acertos, falhas, despejos,
+        bytes residentes) — para dimensionar FLOOD_CACHE_MB a partir de
+        dados."""
+        return self._flood_cache.stats()
+
+    def geojson_cache_stats(self):
+        """Contadores da cache de polígonos de flood_geojson."""
+        return self._geojson_cache.stats()
+
+    def memory_bytes(self):
+        """Estimativa da memória do modelo em uso: os rasters (mapeados em
+        memória, mas as páginas lidas contam para o RSS), as curvas de
+        exposição das zonas e o conteúdo das caches."""
+        rasters = sum(getattr(self, name).nbytes for name in CACHED_RASTERS)
+        curves = sum(_nbytes(vars(c).values()) + _nbytes(c.irregular.values()) for c in self._zone_curves)
+        caches = self._flood_cache.stats()["resident_bytes"] + self._geojson_cache.stats()["resident_bytes"]
+        return rasters + curves + caches
+
+    def close(self):
+        """Liberta as caches de resultados — para modelos descartados antes
+        do fim do processo (ver flood_regions)."""
+        self._flood_cache.clear()
+        self._geojson_cache.clear()
+
     def _flood_key(self, water_level_m, flood_rate_frac):
-        return (round(water_level_m, 2), round(flood_rate_frac, 3))
+        return (round(water_level_m, WATER_LEVEL_DECIMALS), round(flood_rate_frac, FLOOD_RATE_DECIMALS))
+
+    def _scenario_index(self, water_level_m, flood_rate_frac):
+        """Cenário quantizado como inteiros (nível em cm, taxa em
+        milésimas) — o índice das curvas de exposição."""
+        water_level_m, flood_rate_frac = self._flood_key(water_level_m, flood_rate_frac)
+        return round(water_level_m * 10 ** WATER_LEVEL_DECIMALS), round(flood_rate_frac * 10 ** FLOOD_RATE_DECIMALS)
 
     def compute_flood(self, water_level_m, flood_rate_frac):
         """Devolve (flood_mask, depth) alinhados ao grid do DEM, com cache
         por combinação (nível de água, taxa de inundação) — reutilizado
         entre municípios/bairros de um mesmo pedido de província."""
         key = self._flood_key(water_level_m, flood_rate_frac)
-        if key in self._flood_cache:
-            return self._flood_cache[key]
+        cached = self._flood_cache.get(key)
+        if cached is not None:
+            return cached
+        with stage("compute_flood"):
+            result = self._compute_flood(*key)
+        self._flood_cache.put(key, result)
+        return result
+
+    def _compute_flood(self, water_level_m, flood_rate_frac):
+        # Por blocos de linhas (ver _row_blocks): os temporários float64 de
+        # _flood_depth custam ~30 bytes por célula.
+        depth = np.empty(self.dem_shape, dtype="float32")
+        for rows in self._row_blocks():
+            depth[rows] = self._flood_depth((rows, slice(None)), water_level_m, flood_rate_frac)
+        flood_mask = depth > MIN_FLOOD_DEPTH
+
+        flood_mask.flags.writeable = False
+        depth.flags.writeable = False
+        return flood_mask, depth
 
-        water_level_m, flood_rate_frac = key
+    def compute_flood_window(self, water_level_m, flood_rate_frac, window):
+        """(flood_mask, depth) de compute_flood só na janela (linhas,
+        colunas) do grid. Uma janela pequena (menos de
+        _SMALL_WINDOW_FRACTION do grid) de um cenário que não está em cache
+        calcula-se só a ela, sem a guardar — uma zona pequena num grid fino
+        (30 m nativos) não paga o raster inteiro; as restantes recortam o
+        resultado de compute_flood."""
+        key = self._flood_key(water_level_m, flood_rate_frac)
+        n_cells = (window[0].stop - window[0].start) * (window[1].stop - window[1].start)
+        if key in self._flood_cache or n_cells >= _SMALL_WINDOW_FRACTION * self.dem_shape[0] * self.dem_shape[1]:
+            flood_mask, depth = self.compute_flood(*key)
+            return flood_mask[window], depth[window]
+        with stage("compute_flood"):
+            depth = self._flood_depth(window, *key)
+        return depth > MIN_FLOOD_DEPTH, depth
 
+    def _flood_depth(self, window, water_level_m, flood_rate_frac):
+        dem = self.dem[window]
         # 1) Maré / storm surge: ligado hidrologicamente ao mar.
-        coastal_candidate = self.dem <= max(water_level_m, 0)
-        if water_level_m > 0 and coastal_candidate.any():
-            labeled, _ = ndimage.label(coastal_candidate)
-            sea_labels = set(np.unique(labeled[self.sea_seed & coastal_candidate]))
-            sea_labels.discard(0)
-            coastal_mask = np.isin(labeled, list(sea_labels)) if sea_labels else np.zeros_like(coastal_candidate)
+        if water_level_m > 0:
+            coastal_mask = self.sea_level_threshold[window] <= water_level_m
         else:
-            coastal_mask = np.zeros_like(coastal_candidate)
-        coastal_depth = np.where(coastal_mask, np.clip(water_level_m - self.dem, 0, None), 0.0)
+            coastal_mask = np.zeros(dem.shape, dtype=bool)
+        coastal_depth = np.where(coastal_mask, np.clip(water_level_m - dem, 0, None), 0.0)
 
         # 2) Poças interiores: depressões que transbordam com a chuva,
         #    moduladas pela drenagem local (pior drenagem -> transborda com
         #    menos chuva).
-        max_pond_depth = (flood_rate_frac * 2.0) * self.drainage_grid
-        pond_mask = (self.depression_depth > 0) & (self.depression_depth <= max_pond_depth)
-        pond_depth = np.where(pond_mask, self.depression_depth, 0.0)
+        depression_depth = self.depression_depth[window]
+        max_pond_depth = (flood_rate_frac * 2.0) * self.drainage_grid[window]
+        pond_mask = (depression_depth > 0) & (depression_depth <= max_pond_depth)
+        pond_depth = np.where(pond_mask, depression_depth, 0.0)
 
         depth = np.maximum(coastal_depth, pond_depth).astype("float32")
-        depth[self.permanent_water_mask] = 0.0
-        flood_mask = depth > MIN_FLOOD_DEPTH
+        depth[self.permanent_water_mask[window]] = 0.0
+        return depth
 
-        result = (flood_mask, depth)
-        self._flood_cache[key] = result
-        # Cada entrada guarda dois arrays do tamanho do DEM (~39MB); limite
-        # baixo de propósito para não deixar a memória crescer sem controlo
-        # num processo de longa duração (ex.: worker gunicorn em produção) —
-        # o alocador do Python/numpy nem sempre devolve memória libertada ao
-        # SO, por isso o tecto real de RSS fica bem acima do valor "lógico"
-        # da cache; mantém-se este número pequeno de propósito.
-        if len(self._flood_cache) > 6:
-            self._flood_cache.pop(next(iter(self._flood_cache)))
-        return result
+    def _flood_fraction_on_pop_grid(self, flood_mask, window=None):
+        """Fracção inundada de cada célula do grid de população (média por
+        área das células do DEM que a cobrem) — os pesos separáveis de
+        pop_weights_y/x aplicados como dois produtos esparsos, em vez de um
+        reproject GDAL por cenário.
 
-    @lru_cache(maxsize=6)
-    def _flood_fraction_on_pop_grid(self, water_level_m, flood_rate_frac):
-        flood_mask, _ = self.compute_flood(water_level_m, flood_rate_frac)
-        fraction = np.zeros(self.pop_shape, dtype="float32")
-        rasterio.warp.reproject(
-            source=flood_mask.astype("float32"),
-            destination=fraction,
-            src_transform=self.dem_transform, src_crs=self.dem_crs,
-            dst_transform=self.pop_transform, dst_crs=self.pop_crs,
-            resampling=rasterio.warp.Resampling.average,
-        )
-        return fraction
+        window: (linhas, colunas) do grid de população; calcula-se só essa
+        janela, lendo apenas as células do DEM que lhe dão peso."""
+        with stage("pop_aggregate"):
+            return self._aggregate_to_pop_grid(flood_mask, window)
+
+    def _aggregate_to_pop_grid(self, flood_mask, window):
+        if window is None:
+            partial = self.pop_weights_y @ flood_mask.astype("float32")
+            return (self.pop_weights_x @ partial.T).T
+        weights_y = self.pop_weights_y[window[0]]
+        weights_x = self.pop_weights_x[window[1]]
+        if not weights_y.nnz or not weights_x.nnz:
+            return np.zeros((weights_y.shape[0], weights_x.shape[0]), dtype="float32")
+        dem_rows = slice(weights_y.indices.min(), weights_y.indices.max() + 1)
+        dem_cols = slice(weights_x.indices.min(), weights_x.indices.max() + 1)
+        partial = weights_y[:, dem_rows] @ flood_mask[dem_rows, dem_cols].astype("float32")
+        return (weights_x[:, dem_cols] @ partial.T).T
+
+    def _zone_window(self, geometry, transform, shape, halo=1):
+        """Janela (linhas, colunas) do grid com a caixa envolvente da
+        geometria mais halo células, recortada ao grid, e o transform dessa
+        janela — as operações por zona rasterizam e reduzem só aqui, com
+        custo proporcional ao tamanho da zona e não ao do grid."""
+        west, south, east, north = shapely_shape(geometry).bounds
+        inverse = ~transform
+        col0, row0 = inverse * (west, north)
+        col1, row1 = inverse * (east, south)
+        row0, row1 = sorted((row0, row1))
+        col0, col1 = sorted((col0, col1))
+        row0 = min(max(int(np.floor(row0)) - halo, 0), shape[0])
+        col0 = min(max(int(np.floor(col0)) - halo, 0), shape[1])
+        row1 = min(max(int(np.ceil(row1)) + halo, row0), shape[0])
+        col1 = min(max(int(np.ceil(col1)) + halo, col0), shape[1])
+        window = rasterio.windows.Window(col0, row0, col1 - col0, row1 - row0)
+        return (slice(row0, row1), slice(col0, col1)), rasterio.windows.transform(window, transform)
+
+    def _zone_mask(self, geometry, transform, shape):
+        """(janela, máscara da geometria dentro da janela) — ver _zone_window."""
+        window, window_transform = self._zone_window(geometry, transform, shape)
+        out_shape = (window[0].stop - window[0].start, window[1].stop - window[1].start)
+        if 0 in out_shape:
+            return window, np.zeros(out_shape, dtype=bool)
+        with stage("rasterize"):
+            return window, rasterio.features.geometry_mask(
+                [geometry], out_shape=out_shape, transform=window_transform, invert=True,
+            )
+
+    def _dem_zone_mask(self, geometry):
+        """Máscara da zona no grid do DEM, recortada à sua janela; zonas
+        menores que um pixel ficam com a célula mais próxima do centróide."""
+        window, zone_mask = self._zone_mask(geometry, self.dem_transform, self.dem_shape)
+        if not zone_mask.any():
+            row, col = self._nearest_cell(geometry)
+            window, zone_mask = (slice(row, row + 1), slice(col, col + 1)), np.ones((1, 1), dtype=bool)
+        return window, zone_mask
 
     # ------------------------------------------------------- info sem cenário
     def zone_population(self, geometry):
         """População real (WorldPop) dentro da zona, sem correr nenhum
         cenário de inundação — usado pelos endpoints informativos."""
-        pop_zone_mask = rasterio.features.geometry_mask(
-            [geometry], out_shape=self.pop_shape, transform=self.pop_transform, invert=True,
-        )
-        return float(self.population[pop_zone_mask].sum())
+        window, pop_zone_mask = self._zone_mask(geometry, self.pop_transform, self.pop_shape)
+        return float(self.population[window][pop_zone_mask].sum())
 
     def zone_area_km2(self, geometry):
-        deg_to_km_lat = 111.0
-        deg_to_km_lon = 111.0 * np.cos(np.radians(8.8))
+        deg_to_km_lat, deg_to_km_lon = self._deg_to_km()
         return shapely_shape(geometry).area * deg_to_km_lat * deg_to_km_lon
 
     def zone_elevation(self, geometry):
-        zone_mask = rasterio.features.geometry_mask(
-            [geometry], out_shape=self.dem_shape, transform=self.dem_transform, invert=True,
-        )
-        if not zone_mask.any():
-            zone_mask = self._nearest_cell_mask(geometry)
-        vals = self.dem[zone_mask]
+        window, zone_mask = self._dem_zone_mask(geometry)
+        vals = self.dem[window][zone_mask]
         return float(vals.mean()) if vals.size else 0.0
 
     # --------------------------------------------------------------- zonas
-    def simulate_zone(self, geometry, water_level_m, flood_rate_frac):
+    def simulate_zone(self, geometry, water_level_m, flood_rate_frac, zone_id=None):
         """geometry: dict GeoJSON (WGS84) da zona (província/município/bairro
         catchment). Devolve estatísticas + a mancha de inundação recortada à
-        zona, em metros e população reais."""
+        zona, em metros e população reais. Se zone_id tiver sido registado
+        com register_zones(), as estatísticas vêm dos rasters de rótulos
+        pré-calculados em vez de rasterizar a geometria de novo."""
         water_level_m = float(water_level_m)
         flood_rate_frac = float(flood_rate_frac)
+
+        if zone_id in self._zone_index:
+            row = self._zone_index[zone_id]
+            static = self._zone_static
+            k, j = self._scenario_index(water_level_m, flood_rate_frac)
+            n_flooded, depth_sum, depth_max, affected_population = (
+                v[0] for v in self._zone_curves[row].evaluate([k], [j])
+            )
+            return self._zone_result(
+                n_flooded=int(n_flooded),
+                avg_depth=float(depth_sum / n_flooded) if n_flooded else 0.0,
+                max_depth=float(depth_max),
+                affected_population=float(affected_population),
+                total_population=float(static["population"][row]),
+                elevation=(float(static["elevation_avg"][row]), float(static["elevation_min"][row]),
+                           float(static["elevation_max"][row])),
+            )
+
         flood_mask, depth = self.compute_flood(water_level_m, flood_rate_frac)
 
-        zone_mask = rasterio.features.geometry_mask(
-            [geometry], out_shape=self.dem_shape, transform=self.dem_transform, invert=True,
+        window, zone_mask = self._dem_zone_mask(geometry)
+        zone_dem = self.dem[window][zone_mask]
+        elevation = (
+            float(zone_dem.mean()) if zone_dem.size else 0.0,
+            float(zone_dem.min()) if zone_dem.size else 0.0,
+            float(zone_dem.max()) if zone_dem.size else 0.0,
         )
-        if not zone_mask.any():
-            zone_mask = self._nearest_cell_mask(geometry)
-
-        zone_dem = self.dem[zone_mask]
-        elevation = {
-            "avg": float(zone_dem.mean()) if zone_dem.size else 0.0,
-            "min": float(zone_dem.min()) if zone_dem.size else 0.0,
-            "max": float(zone_dem.max()) if zone_dem.size else 0.0,
-        }
 
-        flooded_depths = depth[zone_mask & flood_mask]
+        flooded_depths = depth[window][zone_mask & flood_mask[window]]
         is_flooded = flooded_depths.size > 0
-        avg_depth = float(flooded_depths.mean()) if is_flooded else 0.0
-        max_depth = float(flooded_depths.max()) if is_flooded else 0.0
-        flooded_area_km2 = flooded_depths.size * self._dem_cell_area_km2()
 
-        pop_zone_mask = rasterio.features.geometry_mask(
-            [geometry], out_shape=self.pop_shape, transform=self.pop_transform, invert=True,
+        pop_window, pop_zone_mask = self._zone_mask(geometry, self.pop_transform, self.pop_shape)
+        population = self.population[pop_window]
+        fraction = self._flood_fraction_on_pop_grid(flood_mask, pop_window)
+
+        return self._zone_result(
+            n_flooded=flooded_depths.size,
+            avg_depth=float(flooded_depths.mean()) if is_flooded else 0.0,
+            max_depth=float(flooded_depths.max()) if is_flooded else 0.0,
+            affected_population=float((population * fraction)[pop_zone_mask].sum()),
+            total_population=float(population[pop_zone_mask].sum()),
+            elevation=elevation,
         )
-        total_population = float(self.population[pop_zone_mask].sum())
-        fraction = self._flood_fraction_on_pop_grid(*self._flood_key(water_level_m, flood_rate_frac))
-        affected_population = float((self.population * fraction)[pop_zone_mask].sum())
-        affected_population = min(affected_population, total_population)
 
+    def simulate_zones(self, zones, water_level_m, flood_rate_frac):
+        """simulate_zone para uma lista de (geometry, zone_id). Devolve um
+        iterador com os resultados pela ordem de zones, cada um disponível
+        assim que calculado.
+
+        Corre em série: a API regista todas as zonas que simula (ver
+        register_zones), e cada zona registada custa ~0.1 ms nas curvas de
+        exposição — passar o trabalho a outra thread sairia mais caro do que
+        fazê-lo."""
+        water_level_m = float(water_level_m)
+        flood_rate_frac = float(flood_rate_frac)
+        return (self.simulate_zone(g, water_level_m, flood_rate_frac, zone_id=z) for g, z in zones)
+
+    def simulate_zones_batch(self, zone_ids, scenarios):
+        """Varrimento de cenários: estatísticas de várias zonas registadas
+        para uma lista de (water_level_m, flood_rate_frac), avaliadas em
+        bloco sobre as curvas de exposição — não passa por compute_flood
+        nem pela sua cache. Devolve matrizes cenário x zona."""
+        k, j = np.array([self._scenario_index(float(w), float(f)) for w, f in scenarios], dtype="int64").reshape(-1, 2).T
+        shape = (len(scenarios), len(zone_ids))
+        n_flooded = np.zeros(shape, dtype="int64")
+        depth_sum = np.zeros(shape)
+        affected = np.zeros(shape)
+        for col, zone_id in enumerate(zone_ids):
+            row = self._zone_index[zone_id]
+            n, d, _, pop = self._zone_curves[row].evaluate(k, j)
+            n_flooded[:, col] = n
+            depth_sum[:, col] = d
+            affected[:, col] = np.minimum(pop, self._zone_static["population"][row])
+
+        flooded = n_flooded > 0
+        return {
+            "flooded": flooded,
+            "avgDepth": np.round(np.divide(depth_sum, n_flooded, out=np.zeros(shape), where=flooded), 2),
+            "affectedPopulation": np.where(flooded, np.round(affected), 0).astype("int64"),
+            "floodedAreaKm2": np.round(n_flooded * self._dem_cell_area_km2(), 3),
+        }
+
+    def _zone_result(self, n_flooded, avg_depth, max_depth, affected_population, total_population, elevation):
+        is_flooded = n_flooded > 0
+        flooded_area_km2 = n_flooded * self._dem_cell_area_km2()
+        affected_population = min(affected_population, total_population)
         severity, recovery_days = (classify_severity(avg_depth) if is_flooded else ("Nenhuma", 0))
+        elevation_avg, elevation_min, elevation_max = elevation
 
         return {
             "flooded": bool(is_flooded),
@@ -297,43 +1308,67 @@ class FloodModel:
             "affectedPopulation": int(round(affected_population)) if is_flooded else 0,
             "totalPopulation": int(round(total_population)),
             "floodedAreaKm2": round(flooded_area_km2, 3),
-            "elevation": round(elevation["avg"], 1),
-            "elevation_min": round(elevation["min"], 1),
-            "elevation_max": round(elevation["max"], 1),
+            "elevation": round(elevation_avg, 1),
+            "elevation_min": round(elevation_min, 1),
+            "elevation_max": round(elevation_max, 1),
         }
 
+    def _deg_to_km(self):
+        # graus -> km (latitude, longitude) aproximados à latitude do centro
+        # do grid (Luanda, ~-8.8°; Cabinda a -5°, Namibe a -15°) — a mesma
+        # para as áreas das zonas e as áreas inundadas.
+        center_lat = self.dem_transform.f + self.dem_transform.e * self.dem_shape[0] / 2
+        return 111.0, 111.0 * np.cos(np.radians(center_lat))
+
     def _dem_cell_area_km2(self):
-        # graus -> km aproximados a esta latitude (Luanda, ~-8.8°)
-        deg_to_km_lat = 111.0
-        deg_to_km_lon = 111.0 * np.cos(np.radians(8.8))
+        deg_to_km_lat, deg_to_km_lon = self._deg_to_km()
         px_w = abs(self.dem_transform.a) * deg_to_km_lon
         px_h = abs(self.dem_transform.e) * deg_to_km_lat
         return px_w * px_h
 
-    def _nearest_cell_mask(self, geometry):
+    def _nearest_cell(self, geometry):
         """Fallback para zonas menores que um pixel do DEM (ex.: bairro
-        pontual sem catchment válido): usa a célula mais próxima do
+        pontual sem catchment válido): a célula mais próxima do
         centróide."""
-        geom = shapely_shape(geometry)
-        c = geom.centroid
+        c = shapely_shape(geometry).centroid
         row, col = rasterio.transform.rowcol(self.dem_transform, c.x, c.y)
+        return min(max(row, 0), self.dem_shape[0] - 1), min(max(col, 0), self.dem_shape[1] - 1)
+
+    def _nearest_cell_mask(self, geometry):
         mask = np.zeros(self.dem_shape, dtype=bool)
-        row = min(max(row, 0), self.dem_shape[0] - 1)
-        col = min(max(col, 0), self.dem_shape[1] - 1)
-        mask[row, col] = True
+        mask[self._nearest_cell(geometry)] = True
         return mask
 
     # ------------------------------------------------------------- polígonos
-    def flood_geojson(self, water_level_m, flood_rate_frac, clip_geometry=None):
+    def flood_geojson(self, water_level_m, flood_rate_frac, clip_geometry=None, clip_key=None):
         """Vectoriza a mancha de inundação em polígonos por banda de
         severidade, para desenho no mapa (substitui os pontos aleatórios do
-        heatmap antigo por geometria real)."""
-        flood_mask, depth = self.compute_flood(float(water_level_m), float(flood_rate_frac))
+        heatmap antigo por geometria real).
 
-        if clip_geometry is not None:
-            clip_mask = rasterio.features.geometry_mask(
-                [clip_geometry], out_shape=self.dem_shape, transform=self.dem_transform, invert=True,
-            )
+        clip_key: identificador hashable de clip_geometry (p.ex. o tuplo dos
+        zone_ids que a compõem). Com ele o resultado fica em cache por
+        (cenário quantizado, clip_key) e é devolvido o mesmo objecto em
+        pedidos repetidos — não deve ser alterado por quem o recebe."""
+        if clip_key is None:
+            return self._flood_geojson(water_level_m, flood_rate_frac, clip_geometry)
+        key = (self._flood_key(water_level_m, flood_rate_frac), clip_key)
+        collection = self._geojson_cache.get(key)
+        if collection is None:
+            collection = self._flood_geojson(water_level_m, flood_rate_frac, clip_geometry)
+            self._geojson_cache.put(key, collection)
+        return collection
+
+    def _flood_geojson(self, water_level_m, flood_rate_frac, clip_geometry):
+        # Com recorte, todo o pipeline (cenário, sieve, bandas, shapes) corre
+        # só na janela da geometria: fora dela a máscara é vazia de qualquer
+        # forma.
+        transform = self.dem_transform
+        if clip_geometry is None:
+            flood_mask, depth = self.compute_flood(float(water_level_m), float(flood_rate_frac))
+        else:
+            window, clip_mask = self._zone_mask(clip_geometry, self.dem_transform, self.dem_shape)
+            transform = rasterio.windows.transform(rasterio.windows.Window.from_slices(*window), transform)
+            flood_mask, depth = self.compute_flood_window(float(water_level_m), float(flood_rate_frac), window)
             flood_mask = flood_mask & clip_mask
 
         if not flood_mask.any():
@@ -358,35 +1393,37 @@ class FloodModel:
             sieve_size = 80
         else:
             sieve_size = 200
-        flood_mask = rasterio.features.sieve(flood_mask.astype("uint8"), size=sieve_size, connectivity=8) > 0
+        with stage("sieve"):
+            flood_mask = rasterio.features.sieve(flood_mask.astype("uint8"), size=sieve_size, connectivity=8) > 0
         if not flood_mask.any():
             return {"type": "FeatureCollection", "features": []}
 
         band_edges = [b[0] for b in SEVERITY_BANDS]
         band_labels = [b[1] for b in SEVERITY_BANDS]
-        band_id = np.zeros(self.dem_shape, dtype="uint8")
+        band_id = np.zeros(flood_mask.shape, dtype="uint8")
         prev = 0.0
         for i, edge in enumerate(band_edges):
             band_id[(depth > prev) & (depth <= edge) & flood_mask] = i + 1
             prev = edge
 
         features = []
-        for i, label in enumerate(band_labels, start=1):
-            band_mask = band_id == i
-            if not band_mask.any():
-                continue
-            band_depth = float(depth[band_mask].mean())
-            for geom_dict, value in rasterio.features.shapes(
-                band_id, mask=band_mask, transform=self.dem_transform
-            ):
-                poly = shapely_shape(geom_dict).simplify(0.0003, preserve_topology=True)
-                if poly.is_empty or poly.area < 1e-8:
+        with stage("vectorize"):
+            for i, label in enumerate(band_labels, start=1):
+                band_mask = band_id == i
+                if not band_mask.any():
                     continue
-                features.append({
-                    "type": "Feature",
-                    "geometry": poly.__geo_interface__,
-                    "properties": {"severity": label, "avgDepth": round(band_depth, 2)},
-                })
+                band_depth = float(depth[band_mask].mean())
+                for geom_dict, value in rasterio.features.shapes(
+                    band_id, mask=band_mask, transform=transform
+                ):
+                    poly = shapely_shape(geom_dict).simplify(0.0003, preserve_topology=True)
+                    if poly.is_empty or poly.area < 1e-8:
+                        continue
+                    features.append({
+                        "type": "Feature",
+                        "geometry": poly.__geo_interface__,
+                        "properties": {"severity": label, "avgDepth": round(band_depth, 2)},
+                    })
 
         return {"type": "FeatureCollection", "features": features}
 
@@ -0,0 +1,173 @@
+"""
+flood_outofcore.py
+===================
+Construção por tiles dos rasters do FloodModel, para DEMs que não cabem
+inteiros em memória (DEM_DOWNSAMPLE=1 em hosts pequenos): cada raster é
+escrito directamente num .npy mapeado em memória (o mesmo formato da cache
+em disco, ver FloodModel._load_rasters) e só um tile, mais um halo de uma
+célula, está em memória de trabalho de cada vez.
+
+  - reconstrução morfológica por erosão (depressões preenchidas, nível de
+    ligação ao mar): reconstrução local de cada tile com o halo a fazer de
+    fronteira, repetida nos tiles cujos vizinhos mudaram na fronteira
+    comum até nada mudar. Cada passo só baixa valores que continuam a ser
+    majorantes do resultado exacto, e o ponto fixo é o mesmo da
+    reconstrução do raster inteiro — o resultado é idêntico, célula a
+    célula, ao de skimage sobre o raster completo;
+  - maior componente ligada (oceano permanente): rótulos por tile, unidos
+    nas fronteiras entre tiles com scipy.sparse.csgraph;
+  - leitura do DEM reamostrado e rasterização por janelas.
+"""
+
+import math
+
+import numpy as np
+import rasterio
+import rasterio.features
+import rasterio.windows
+import scipy.sparse
+import scipy.sparse.csgraph
+from rasterio.enums import Resampling
+from scipy import ndimage
+from skimage.morphology import reconstruction
+
+# Memória de trabalho por célula de tile (bytes): a reconstrução do skimage
+# guarda a imagem em float64 a dobrar e listas ligadas de índices int64.
+BYTES_PER_TILE_CELL = 100
+MIN_TILE_SIDE = 256
+
+
+def tile_side_for_budget(budget_mb):
+    """Lado (células) dos tiles para um orçamento de memória de trabalho em
+    MB: um quarto do orçamento para o tile em curso (a reconstrução do
+    skimage e as cópias de cada passo cabem no resto). Só limita a memória
+    dos tiles — os rasters de saída, do tamanho do DEM, ficam mapeados em
+    disco e as páginas tocadas contam no RSS à parte, tal como o resto do
+    processo (ver FLOOD_MEMORY_BUDGET_MB em flood_model)."""
+    cells = budget_mb * 1e6 / 4 / BYTES_PER_TILE_CELL
+    return max(MIN_TILE_SIDE, int(math.sqrt(cells)))
+
+
+def tiles(shape, side):
+    """(linhas, colunas) de cada tile, por ordem de linhas."""
+    for row in range(0, shape[0], side):
+        for col in range(0, shape[1], side):
+            yield slice(row, min(row + side, shape[0])), slice(col, min(col + side, shape[1]))
+
+
+def open_raster(path, shape, dtype):
+    """Raster novo num .npy mapeado em memória, para escrita."""
+    return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+
+
+def read_resampled(path, out, side):
+    """Banda 1 de path reamostrada (média) para out.shape, lida por janelas
+    — as mesmas janelas fraccionárias que uma leitura com out_shape do
+    raster inteiro usa para cada célula de destino."""
+    with rasterio.open(path) as ds:
+        scale_y, scale_x = ds.height / out.shape[0], ds.width / out.shape[1]
+        for rows, cols in tiles(out.shape, side):
+            window = rasterio.windows.Window(
+                cols.start * scale_x, rows.start * scale_y,
+                (cols.stop - cols.start) * scale_x, (rows.stop - rows.start) * scale_y,
+            )
+            out[rows, cols] = ds.read(
+                1, window=window, out_shape=(rows.stop - rows.start, cols.stop - cols.start),
+                resampling=Resampling.average,
+            )
+
+
+def rasterize(shapes, out, transform, side, fill):
+    """rasterio.features.rasterize(shapes) no grid de out, por janelas."""
+    for rows, cols in tiles(out.shape, side):
+        window = rasterio.windows.Window.from_slices(rows, cols)
+        out[rows, cols] = rasterio.features.rasterize(
+            shapes, out_shape=(rows.stop - rows.start, cols.stop - cols.start),
+            transform=rasterio.windows.transform(window, transform), fill=fill, dtype=out.dtype,
+        )
+
+
+def reconstruct_erosion(seed_tile, mask, out, side, footprint=None):
+    """out = reconstruction(semente, mask, method="erosion", footprint) do
+    skimage, calculada por tiles. seed_tile(linhas, colunas) devolve a
+    semente (>= mask) de um tile. Devolve o número de reconstruções de
+    tile feitas."""
+    grid = list(tiles(out.shape, side))
+    n_cols = math.ceil(out.shape[1] / side)
+    for rows, cols in grid:
+        out[rows, cols] = seed_tile(rows, cols)
+
+    pending = set(range(len(grid)))
+    runs = 0
+    backwards = False
+    while pending:
+        # Varrimentos alternados (para a frente/para trás) propagam nos dois
+        # sentidos com menos passagens.
+        for index in sorted(pending, reverse=backwards):
+            if index not in pending:
+                continue
+            pending.discard(index)
+            runs += 1
+            rows, cols = grid[index]
+            halo = (slice(max(rows.start - 1, 0), min(rows.stop + 1, out.shape[0])),
+                    slice(max(cols.start - 1, 0), min(cols.stop + 1, out.shape[1])))
+            inner = (slice(rows.start - halo[0].start, rows.stop - halo[0].start),
+                     slice(cols.start - halo[1].start, cols.stop - halo[1].start))
+            result = reconstruction(
+                np.array(out[halo]), np.asarray(mask[halo]), method="erosion", footprint=footprint,
+            )[inner].astype(out.dtype)
+            changed = result != out[rows, cols]
+            if not changed.any():
+                continue
+            out[rows, cols] = result
+            tile_row, tile_col = divmod(index, n_cols)
+            for d_row, d_col, edge in (
+                (-1, 0, changed[0]), (1, 0, changed[-1]), (0, -1, changed[:, 0]), (0, 1, changed[:, -1]),
+                (-1, -1, changed[0, 0]), (-1, 1, changed[0, -1]), (1, -1, changed[-1, 0]), (1, 1, changed[-1, -1]),
+            ):
+                neighbour_row, neighbour_col = tile_row + d_row, tile_col + d_col
+                if edge.any() and 0 <= neighbour_row and 0 <= neighbour_col < n_cols:
+                    neighbour = neighbour_row * n_cols + neighbour_col
+                    if neighbour < len(grid):
+                        pending.add(neighbour)
+        backwards = not backwards
+    return runs
+
+
+def largest_component(binary_tile, out, labels, side):
+    """out = maior componente ligada (vizinhança de 4, a do ndimage.label
+    por omissão) da máscara dada por binary_tile(linhas, colunas). labels:
+    raster int32 de trabalho com a forma de out."""
+    grid = list(tiles(out.shape, side))
+    sizes = [np.zeros(1, dtype="int64")]  # rótulo 0 = fundo
+    offset = 0
+    for rows, cols in grid:
+        tile_labels, n = ndimage.label(binary_tile(rows, cols))
+        sizes.append(np.bincount(tile_labels.ravel(), minlength=n + 1)[1:])
+        tile_labels[tile_labels > 0] += offset
+        labels[rows, cols] = tile_labels
+        offset += n
+    sizes = np.concatenate(sizes)
+    if offset == 0:
+        for rows, cols in grid:
+            out[rows, cols] = False
+        return
+
+    # Componentes que continuam de um tile para o vizinho: pares de rótulos
+    # lado a lado em cada fronteira entre tiles.
+    pairs = []
+    for start in range(side, out.shape[0], side):
+        pairs.append(np.stack([labels[start - 1], labels[start]]))
+    for start in range(side, out.shape[1], side):
+        pairs.append(np.stack([labels[:, start - 1], labels[:, start]]))
+    edges = np.concatenate(pairs, axis=1) if pairs else np.zeros((2, 0), dtype="int32")
+    edges = edges[:, (edges[0] > 0) & (edges[1] > 0)]
+    graph = scipy.sparse.coo_matrix(
+        (np.ones(edges.shape[1], dtype="int8"), (edges[0], edges[1])), shape=(offset + 1, offset + 1),
+    )
+    _, component = scipy.sparse.csgraph.connected_components(graph, directed=False)
+    component_sizes = np.bincount(component[1:], weights=sizes[1:])
+    is_largest = component == component_sizes.argmax()
+    is_largest[0] = False
+    for rows, cols in grid:
+        out[rows, cols] = is_largest[labels[rows, cols]]
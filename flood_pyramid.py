@@ -0,0 +1,198 @@
+"""
+flood_pyramid.py
+=================
+Pirâmide de resoluções do DEM: um FloodModel por factor de downsampling
+(por exemplo 8/4/2/1 = 240/120/60/30 m), cada um com os seus próprios
+rasters derivados (depressões, ligação ao mar, ...) na cache em disco — a
+chave da cache inclui o factor — e a escolha do nível por zona: o mais fino
+em que a janela da zona não passa de PYRAMID_MAX_CELLS células. A vista da
+província corre num nível grosso, barato; um bairro usa os 30 m nativos, só
+na sua janela (ver FloodModel.compute_flood_window). Os tiles do mapa usam o
+nível mais grosso que ainda tem células do tamanho de um pixel do tile.
+
+FloodPyramid tem a interface do FloodModel que a API usa (simulate_zone(s),
+flood_geojson, register_zones, ...) e despacha cada chamada para o nível da
+zona. Sem FLOOD_DEM_PYRAMID tem um só nível, DEM_DOWNSAMPLE — o
+comportamento de sempre. As caches de cada nível (FLOOD_CACHE_MB,
+FLOOD_GEOJSON_CACHE_MB) são independentes; os níveis grossos ocupam muito
+menos por entrada.
+"""
+
+import logging
+import os
+
+import numpy as np
+import rasterio.transform
+from shapely.geometry import shape as shapely_shape
+
+from flood_model import DATA_DIR, DEM_DOWNSAMPLE, PROVINCE, FloodModel
+
+logger = logging.getLogger(__name__)
+
+# Factores de downsampling da pirâmide, separados por vírgulas (ex.
+# "8,4,2,1"); vazio = só DEM_DOWNSAMPLE. Cada nível a mais custa os seus
+# rasters na cache em disco e as curvas de exposição das zonas que lhe
+# calham.
+PYRAMID_DOWNSAMPLES = sorted(
+    {max(1, int(f)) for f in os.environ.get("FLOOD_DEM_PYRAMID", "").split(",") if f.strip()} or {DEM_DOWNSAMPLE},
+    reverse=True,
+)
+
+# Células (na janela da zona) a partir das quais se desce para um nível
+# mais grosso: por omissão a província fica a ~120 m, os municípios a
+# ~60 m e os bairros nos 30 m nativos.
+PYRAMID_MAX_CELLS = int(os.environ.get("FLOOD_PYRAMID_MAX_CELLS", "250000"))
+
+
+def _merge_stats(stats):
+    """Soma os contadores de várias ByteLRUCache.stats()."""
+    merged = {key: sum(s[key] for s in stats) for key in stats[0] if key != "hit_ratio"}
+    lookups = merged["hits"] + merged["misses"]
+    merged["hit_ratio"] = round(merged["hits"] / lookups, 4) if lookups else 0.0
+    return merged
+
+
+class FloodPyramid:
+    def __init__(self, data_dir=DATA_DIR, cache_dir=None, downsamples=None, province=PROVINCE):
+        # Do mais grosso para o mais fino.
+        downsamples = sorted(set(downsamples or PYRAMID_DOWNSAMPLES), reverse=True)
+        self.levels = [
+            FloodModel(data_dir, cache_dir=cache_dir, downsample=f, province=province) for f in downsamples
+        ]
+        self.finest = self.levels[-1]
+        self.province = province
+        self.cache_dir = self.finest.cache_dir
+        self._zone_levels = {}
+        self._clip_levels = {}
+        if len(self.levels) > 1:
+            logger.info("Pirâmide do DEM: " + ", ".join(
+                f"{level.downsample}x {level.dem_shape}" for level in self.levels))
+
+    # Atributos do nível mais fino (elevação num ponto, /api/health).
+    @property
+    def dem(self):
+        return self.finest.dem
+
+    @property
+    def dem_transform(self):
+        return self.finest.dem_transform
+
+    @property
+    def dem_shape(self):
+        return self.finest.dem_shape
+
+    def _flood_key(self, water_level_m, flood_rate_frac):
+        return self.finest._flood_key(water_level_m, flood_rate_frac)
+
+    # ------------------------------------------------------------- níveis
+    def level_for_bounds(self, bounds):
+        """Índice do nível mais fino em que a caixa (oeste, sul, este, norte)
+        cobre no máximo PYRAMID_MAX_CELLS células; o mais grosso se nenhum."""
+        west, south, east, north = bounds
+        for index in range(len(self.levels) - 1, 0, -1):
+            transform = self.levels[index].dem_transform
+            if (east - west) / abs(transform.a) * (north - south) / abs(transform.e) <= PYRAMID_MAX_CELLS:
+                return index
+        return 0
+
+    def level_for_resolution(self, pixel_deg):
+        """O nível mais grosso com células não maiores que pixel_deg (graus)
+        — o que um tile com pixels desse tamanho consegue mostrar."""
+        for level in self.levels:
+            if abs(level.dem_transform.a) <= pixel_deg:
+                return level
+        return self.finest
+
+    def _zone_level(self, geometry, zone_id):
+        level = self._zone_levels.get(zone_id)
+        if level is None:
+            level = self.level_for_bounds(shapely_shape(geometry).bounds)
+        return level
+
+    # -------------------------------------------------------------- zonas
+    def register_zones(self, zones):
+        """FloodModel.register_zones de cada zona no seu nível (ver
+        level_for_bounds)."""
+        groups = {}
+        for zone_id, geometry in zones.items():
+            level = self.level_for_bounds(shapely_shape(geometry).bounds)
+            self._zone_levels[zone_id] = level
+            groups.setdefault(level, {})[zone_id] = geometry
+        for index, group in sorted(groups.items()):
+            self.levels[index].register_zones(group)
+
+    def zone_population(self, geometry):
+        return self.finest.zone_population(geometry)
+
+    def zone_area_km2(self, geometry):
+        return self.finest.zone_area_km2(geometry)
+
+    def simulate_zone(self, geometry, water_level_m, flood_rate_frac, zone_id=None):
+        level = self.levels[self._zone_level(geometry, zone_id)]
+        return level.simulate_zone(geometry, water_level_m, flood_rate_frac, zone_id=zone_id)
+
+    def simulate_zones(self, zones, water_level_m, flood_rate_frac):
+        """FloodModel.simulate_zones por nível; com todas as zonas no mesmo
+        nível (o caso da API) os resultados continuam a sair à medida que
+        são calculados."""
+        zones = list(zones)
+        levels = [self._zone_level(geometry, zone_id) for geometry, zone_id in zones]
+        if len(set(levels)) <= 1:
+            level = self.levels[levels[0]] if levels else self.finest
+            return level.simulate_zones(zones, water_level_m, flood_rate_frac)
+        results = [None] * len(zones)
+        for index in set(levels):
+            positions = [i for i, level in enumerate(levels) if level == index]
+            group = self.levels[index].simulate_zones([zones[i] for i in positions], water_level_m, flood_rate_frac)
+            for i, result in zip(positions, group):
+                results[i] = result
+        return iter(results)
+
+    def simulate_zones_batch(self, zone_ids, scenarios):
+        """FloodModel.simulate_zones_batch por nível, com as colunas de
+        volta pela ordem de zone_ids."""
+        levels = [self._zone_levels[zone_id] for zone_id in zone_ids]
+        if len(set(levels)) <= 1:
+            level = self.levels[levels[0]] if levels else self.finest
+            return level.simulate_zones_batch(zone_ids, scenarios)
+        stats = {}
+        for index in sorted(set(levels)):
+            columns = [i for i, level in enumerate(levels) if level == index]
+            group = self.levels[index].simulate_zones_batch([zone_ids[i] for i in columns], scenarios)
+            for name, matrix in group.items():
+                if name not in stats:
+                    stats[name] = np.zeros((len(scenarios), len(zone_ids)), dtype=matrix.dtype)
+                stats[name][:, columns] = matrix
+        return stats
+
+    # ---------------------------------------------------------- inundação
+    def compute_flood(self, water_level_m, flood_rate_frac):
+        return self.finest.compute_flood(water_level_m, flood_rate_frac)
+
+    def flood_geojson(self, water_level_m, flood_rate_frac, clip_geometry=None, clip_key=None):
+        """FloodModel.flood_geojson no nível da zona de recorte (sem recorte,
+        no da área coberta inteira)."""
+        if clip_geometry is None:
+            height, width = self.dem_shape
+            index = self.level_for_bounds(rasterio.transform.array_bounds(height, width, self.dem_transform))
+        else:
+            index = self._clip_levels.get(clip_key) if clip_key is not None else None
+            if index is None:
+                index = self.level_for_bounds(shapely_shape(clip_geometry).bounds)
+                if clip_key is not None:
+                    self._clip_levels[clip_key] = index
+        return self.levels[index].flood_geojson(water_level_m, flood_rate_frac, clip_geometry, clip_key)
+
+    # ------------------------------------------------------------- caches
+    def cache_stats(self):
+        return _merge_stats([level.cache_stats() for level in self.levels])
+
+    def geojson_cache_stats(self):
+        return _merge_stats([level.geojson_cache_stats() for level in self.levels])
+
+    def memory_bytes(self):
+        return sum(level.memory_bytes() for level in self.levels)
+
+    def close(self):
+        for level in self.levels:
+            level.close()
@@ -0,0 +1,167 @@
+"""
+flood_regions.py
+=================
+Registo das regiões (províncias) com dados para o motor de inundação, cada
+uma com o seu FloodModel (ou FloodPyramid), construído só no primeiro
+pedido que precisa dela. Luanda fica em data/, como sempre; cada outra
+província numa pasta de data/regions/ com os mesmos ficheiros, nomeados
+pela província:
+
+    data/regions/benguela/dem_benguela.tif
+    data/regions/benguela/population_benguela.tif
+    data/regions/benguela/municipalities.geojson
+
+Os modelos carregados ficam por ordem de uso; quando a memória estimada de
+todos (FloodModel.memory_bytes) passa REGION_MEMORY_MB, os parados há mais
+tempo são descartados — nunca um com pedidos em curso (ver
+RegionRegistry.use) nem uma região fixa (a província principal). Um pedido
+a uma região descartada volta a construí-la, a partir da cache de rasters
+em disco.
+"""
+
+import glob
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from flood_model import normalize
+
+logger = logging.getLogger(__name__)
+
+# Subpasta de data/ com uma pasta por província adicional.
+REGIONS_DIR = "regions"
+
+# Orçamento de memória (MB) do conjunto dos modelos de região carregados —
+# ao passá-lo, descartam-se os parados há mais tempo.
+REGION_MEMORY_MB = float(os.environ.get("FLOOD_REGION_MEMORY_MB", "1024"))
+
+
+def discover_regions(data_dir):
+    """{província normalizada: pasta} das províncias com DEM, população e
+    limites municipais em data_dir ou numa pasta de data_dir/regions/."""
+    regions = {}
+    for directory in [data_dir, *sorted(glob.glob(os.path.join(data_dir, REGIONS_DIR, "*")))]:
+        if not os.path.exists(os.path.join(directory, "municipalities.geojson")):
+            continue
+        for dem_path in sorted(glob.glob(os.path.join(directory, "dem_*.tif"))):
+            slug = os.path.basename(dem_path)[len("dem_"):-len(".tif")]
+            if os.path.exists(os.path.join(directory, f"population_{slug}.tif")):
+                regions.setdefault(slug, directory)
+    return regions
+
+
+class RegionRegistry:
+    """Modelos por região, construídos por loader(nome, pasta) no primeiro
+    pedido. regions: {nome da província: pasta}; pinned: regiões nunca
+    descartadas. O modelo devolvido pelo loader tem de ter memory_bytes() e
+    close()."""
+
+    def __init__(self, regions, loader, memory_mb=REGION_MEMORY_MB, pinned=()):
+        self._regions = {normalize(name): (name, directory) for name, directory in regions.items()}
+        self._loader = loader
+        self.max_bytes = memory_mb * 1e6
+        self._pinned = {normalize(name) for name in pinned}
+        self._models = OrderedDict()  # do uso mais antigo para o mais recente
+        self._users = {}
+        self._build_locks = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    def __contains__(self, name):
+        return normalize(name) in self._regions
+
+    def names(self):
+        return sorted(name for name, _ in self._regions.values())
+
+    def region(self, name):
+        """(nome tal como registado, pasta) — ex. "benguela" -> ("Benguela",
+        "data/regions/benguela")."""
+        return self._regions[normalize(name)]
+
+    def get(self, name):
+        """Modelo da região, construído se preciso. Sem use() à volta pode
+        ser descartado logo a seguir — só para regiões fixas."""
+        with self.use(name) as model:
+            return model
+
+    @contextmanager
+    def use(self, name):
+        """Modelo da região (KeyError se não houver dados para ela),
+        protegido de ser descartado enquanto o bloco corre."""
+        slug = normalize(name)
+        if slug not in self._regions:
+            raise KeyError(name)
+        with self._lock:
+            self._users[slug] = self._users.get(slug, 0) + 1
+            build_lock = self._build_locks.setdefault(slug, threading.Lock())
+        try:
+            # Um lock por região: dois pedidos à mesma região nova constroem
+            # o modelo uma vez; regiões diferentes constroem em paralelo.
+            with build_lock:
+                with self._lock:
+                    model = self._models.get(slug)
+                    if model is not None:
+                        self._models.move_to_end(slug)
+                if model is None:
+                    model = self._load(slug)
+            self._evict()
+            yield model
+        finally:
+            with self._lock:
+                self._users[slug] -= 1
+            self._evict()
+
+    def add(self, name, model):
+        """Regista um modelo já construído para a região (ex. o da província
+        principal, construído no arranque em paralelo com o resto)."""
+        slug = normalize(name)
+        if slug not in self._regions:
+            raise KeyError(name)
+        with self._lock:
+            self._models[slug] = model
+            self._models.move_to_end(slug)
+            self.loads += 1
+        self._evict()
+
+    def _load(self, slug):
+        name, directory = self._regions[slug]
+        start = time.perf_counter()
+        model = self._loader(name, directory)
+        with self._lock:
+            self._models[slug] = model
+            self.loads += 1
+        logger.info(f"Região {name} carregada em {time.perf_counter() - start:.1f}s "
+                    f"({model.memory_bytes() / 1e6:.0f} MB)")
+        return model
+
+    def _evict(self):
+        """Descarta, do uso mais antigo para o mais recente, regiões paradas
+        e não fixas até a memória estimada caber em max_bytes."""
+        evicted = []
+        with self._lock:
+            sizes = {slug: model.memory_bytes() for slug, model in self._models.items()}
+            total = sum(sizes.values())
+            for slug in list(self._models):
+                if total <= self.max_bytes:
+                    break
+                if slug in self._pinned or self._users.get(slug):
+                    continue
+                evicted.append((slug, self._models.pop(slug)))
+                total -= sizes[slug]
+                self.evictions += 1
+        for slug, model in evicted:
+            model.close()
+            logger.info(f"Região {self._regions[slug][0]} descartada (memória das regiões: {total / 1e6:.0f} MB)")
+
+    def stats(self):
+        with self._lock:
+            loaded = {self._regions[slug][0]: model.memory_bytes() for slug, model in self._models.items()}
+        return {
+            "available": self.names(), "loaded": sorted(loaded),
+            "resident_bytes": int(sum(loaded.values())), "max_bytes": int(self.max_bytes),
+            "loads": self.loads, "evictions": self.evictions,
+        }
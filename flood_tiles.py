@@ -0,0 +1,401 @@
+"""
+flood_tiles.py
+===============
+Mancha de inundação servida em tiles XYZ (Web Mercator), para o mapa
+MapLibre só pedir a área visível em vez de receber de uma vez toda a
+FeatureCollection de FloodModel.flood_geojson.
+
+  - tiles vectoriais Mapbox Vector Tile (.pbf), camada "flood" com uma
+    feature (MultiPolygon) por banda de severidade, recortada do
+    resultado (em cache) de FloodModel.compute_flood e simplificada à
+    resolução do próprio tile (1 pixel de tile), com sieve proporcional ao
+    zoom para não mandar manchas menores que um par de pixels.
+  - tiles raster PNG (256x256) da profundidade, amostrada directamente do
+    array de profundidade em cache, com uma rampa de cores fixa — o mapa
+    mostra a superfície de água contínua a qualquer zoom sem o servidor
+    construir geometria nenhuma.
+
+Cada tile é calculado no nível da pirâmide do DEM (flood_pyramid) mais
+grosso que ainda tem células do tamanho de um pixel do tile: a zoom baixo
+não se varre o grid de 30 m para desenhar pixels de centenas de metros.
+
+Cada tile gerado fica numa cache LRU limitada em bytes, por (cenário
+quantizado, z, x, y). As codificações MVT (protobuf) e PNG são feitas aqui
+à mão — os formatos usados são pequenos (uma camada de polígonos com
+atributos; RGBA sem filtros) e evitam mais uma dependência no deploy.
+"""
+
+import hashlib
+import math
+import os
+import struct
+import zlib
+
+import numpy as np
+import rasterio.errors
+import rasterio.features
+import rasterio.windows
+import shapely
+
+from flood_cache import ByteLRUCache
+from flood_model import SEVERITY_BANDS
+
+# Resolução interna de cada tile vectorial (unidades MVT por lado) e margem
+# à volta do tile incluída na geometria, para o MapLibre não desenhar
+# costuras nos limites entre tiles.
+MVT_EXTENT = 4096
+MVT_BUFFER = 64
+MVT_LAYER = "flood"
+MAX_ZOOM = 22
+
+# Tiles raster de profundidade: lado em pixels e rampa de cores fixa
+# (profundidade em m -> RGBA), nas cores das bandas de severidade do mapa.
+# Acima do último ponto a cor satura; células sem inundação são transparentes.
+PNG_TILE_SIZE = 256
+DEPTH_COLOR_STOPS = [
+    (0.00, (66, 165, 245, 150)),
+    (0.30, (66, 165, 245, 190)),
+    (0.80, (255, 152, 0, 205)),
+    (1.50, (244, 67, 54, 215)),
+    (3.00, (136, 14, 79, 230)),
+]
+
+# Orçamento de memória (MB) da cache de tiles gerados.
+TILE_CACHE_MB = float(os.environ.get("FLOOD_TILE_CACHE_MB", "64"))
+
+# Memória fixa de cada entrada da cache de tiles (bytes): a chave (cenário,
+# z, x, y), a entrada do dicionário e o objecto do tile. Conta também para
+# os tiles vazios (b"") — sem ela, pedidos a z/x/y sem inundação juntavam
+# entradas de 0 bytes que nunca seriam despejadas.
+TILE_ENTRY_OVERHEAD = 300
+
+
+def tile_bounds(z, x, y):
+    """(oeste, sul, este, norte) em graus de um tile XYZ."""
+    n = 2 ** z
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return west, south, east, north
+
+
+def valid_tile(z, x, y):
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def _mercator_y(lat):
+    return np.log(np.tan(np.pi / 4 + np.radians(lat) / 2))
+
+
+def _depth_colormap(steps=256):
+    """Tabela (steps, 4) uint8: índice i -> cor da profundidade
+    i / (steps - 1) * profundidade máxima da rampa."""
+    depths = np.array([d for d, _ in DEPTH_COLOR_STOPS])
+    colors = np.array([c for _, c in DEPTH_COLOR_STOPS], dtype=np.float64)
+    levels = np.linspace(0.0, depths[-1], steps)
+    return np.column_stack([np.interp(levels, depths, colors[:, i]) for i in range(4)]).round().astype(np.uint8)
+
+
+DEPTH_COLORMAP = _depth_colormap()
+
+
+class FloodTiler:
+    def __init__(self, model):
+        self.model = model
+        # Entradas da cache: bytes (MVT) ou (etag, bytes) (PNG).
+        self._cache = ByteLRUCache(TILE_CACHE_MB * 1e6, sizeof=_tile_nbytes)
+        self._empty_png = _encode_png(np.zeros((PNG_TILE_SIZE, PNG_TILE_SIZE, 4), dtype=np.uint8))
+
+    def cache_stats(self):
+        return self._cache.stats()
+
+    def mvt_tile(self, water_level_m, flood_rate_frac, z, x, y):
+        """Bytes do tile MVT (vazio — b"" — se não houver inundação nele)."""
+        key = ("mvt", self.model._flood_key(water_level_m, flood_rate_frac), z, x, y)
+        tile = self._cache.get(key)
+        if tile is None:
+            tile = self._build_mvt(water_level_m, flood_rate_frac, z, x, y)
+            self._cache.put(key, tile)
+        return tile
+
+    def depth_png(self, water_level_m, flood_rate_frac, z, x, y):
+        """(etag, bytes PNG) do tile de profundidade; fora da área coberta,
+        ou sem inundação, é um tile transparente."""
+        key = ("png", self.model._flood_key(water_level_m, flood_rate_frac), z, x, y)
+        tile = self._cache.get(key)
+        if tile is None:
+            png = self._build_depth_png(water_level_m, flood_rate_frac, z, x, y)
+            tile = (hashlib.md5(png).hexdigest(), png)
+            self._cache.put(key, tile)
+        return tile
+
+    # ------------------------------------------------------------- internos
+    def _build_depth_png(self, water_level_m, flood_rate_frac, z, x, y):
+        west, south, east, north = tile_bounds(z, x, y)
+        model = self._level((east - west) / PNG_TILE_SIZE)
+
+        # Centro de cada pixel do tile em graus (x linear, y em Mercator) e a
+        # célula do DEM que lhe cai por baixo (vizinho mais próximo).
+        frac = (np.arange(PNG_TILE_SIZE) + 0.5) / PNG_TILE_SIZE
+        lons = west + frac * (east - west)
+        merc_north, merc_south = _mercator_y(north), _mercator_y(south)
+        lats = np.degrees(np.arctan(np.sinh(merc_north - frac * (merc_north - merc_south))))
+        inverse = ~model.dem_transform
+        cols = np.floor(inverse.a * lons + inverse.c).astype(np.int64)
+        rows = np.floor(inverse.e * lats + inverse.f).astype(np.int64)
+        height, width = model.dem_shape
+        col_ok = (cols >= 0) & (cols < width)
+        row_ok = (rows >= 0) & (rows < height)
+        if not col_ok.any() or not row_ok.any():
+            return self._empty_png
+
+        flood_mask, depth = model.compute_flood(float(water_level_m), float(flood_rate_frac))
+        r, c = np.clip(rows, 0, height - 1), np.clip(cols, 0, width - 1)
+        tile_depth = depth[np.ix_(r, c)]
+        inside = flood_mask[np.ix_(r, c)] & row_ok[:, None] & col_ok[None, :]
+        if not inside.any():
+            return self._empty_png
+
+        max_depth = DEPTH_COLOR_STOPS[-1][0]
+        index = np.rint(np.clip(tile_depth, 0.0, max_depth) / max_depth * (len(DEPTH_COLORMAP) - 1))
+        rgba = DEPTH_COLORMAP[index.astype(np.intp)]
+        rgba[~inside] = 0
+        return _encode_png(rgba)
+
+    def _level(self, pixel_deg):
+        """Modelo onde calcular um tile com pixels de pixel_deg graus: o
+        nível da pirâmide (FloodPyramid.level_for_resolution) ou o próprio
+        FloodModel."""
+        level_for_resolution = getattr(self.model, "level_for_resolution", None)
+        return level_for_resolution(pixel_deg) if level_for_resolution else self.model
+
+    @staticmethod
+    def _tile_window(model, bounds, halo_deg):
+        """Janela do grid do DEM de model que cobre o tile (com halo), ou
+        None se o tile cair fora da área coberta."""
+        west, south, east, north = bounds
+        window = rasterio.windows.from_bounds(
+            west - halo_deg, south - halo_deg, east + halo_deg, north + halo_deg, model.dem_transform,
+        ).round_offsets(op="floor").round_lengths(op="ceil")
+        full = rasterio.windows.Window(0, 0, model.dem_shape[1], model.dem_shape[0])
+        try:
+            window = window.intersection(full)
+        except rasterio.errors.WindowError:
+            return None
+        if window.width <= 0 or window.height <= 0:
+            return None
+        return window
+
+    def _build_mvt(self, water_level_m, flood_rate_frac, z, x, y):
+        bounds = tile_bounds(z, x, y)
+        west, south, east, north = bounds
+        # O mapa desenha o tile vectorial com PNG_TILE_SIZE pixels de lado;
+        # MVT_EXTENT é só a precisão das coordenadas.
+        model = self._level((east - west) / PNG_TILE_SIZE)
+        px_deg = (east - west) / MVT_EXTENT
+        window = self._tile_window(model, bounds, halo_deg=MVT_BUFFER * px_deg)
+        if window is None:
+            return b""
+
+        flood_mask, depth = model.compute_flood(float(water_level_m), float(flood_rate_frac))
+        rows, cols = window.toslices()
+        flood_mask, depth = flood_mask[rows, cols], depth[rows, cols]
+        if not flood_mask.any():
+            return b""
+
+        # Sieve proporcional ao zoom: manchas com menos de ~2x2 pixels do
+        # tile não se vêem — a zoom baixo isso são dezenas de células do DEM.
+        cell_px = abs(model.dem_transform.a) / px_deg
+        sieve_size = int(math.ceil(4 / max(cell_px, 1e-9) ** 2))
+        if sieve_size > 1:
+            flood_mask = rasterio.features.sieve(flood_mask.astype("uint8"), size=sieve_size, connectivity=8) > 0
+            if not flood_mask.any():
+                return b""
+
+        band_id = np.zeros(flood_mask.shape, dtype="uint8")
+        prev = 0.0
+        for i, (edge, _, _) in enumerate(SEVERITY_BANDS):
+            band_id[(depth > prev) & (depth <= edge) & flood_mask] = i + 1
+            prev = edge
+
+        # Graus -> unidades do tile (x linear, y em Mercator). As operações
+        # shapely correm sobre o array inteiro de polígonos de cada banda, não
+        # polígono a polígono — a zoom baixo são milhares deles.
+        merc_north, merc_south = _mercator_y(north), _mercator_y(south)
+        window_transform = rasterio.windows.transform(window, model.dem_transform)
+
+        def to_tile(c):
+            return np.column_stack([
+                (c[:, 0] - west) / px_deg,
+                (merc_north - _mercator_y(c[:, 1])) / (merc_north - merc_south) * MVT_EXTENT,
+            ])
+
+        features = []
+        for i, (_, label, _) in enumerate(SEVERITY_BANDS, start=1):
+            band_mask = band_id == i
+            if not band_mask.any():
+                continue
+            polygons = _polygons_from_shapes(
+                rasterio.features.shapes(band_id, mask=band_mask, transform=window_transform)
+            )
+            polygons = shapely.simplify(shapely.transform(polygons, to_tile), 1.0, preserve_topology=True)
+            polygons = shapely.clip_by_rect(polygons, -MVT_BUFFER, -MVT_BUFFER,
+                                            MVT_EXTENT + MVT_BUFFER, MVT_EXTENT + MVT_BUFFER)
+            polygons = shapely.get_parts(shapely.set_precision(polygons, 1.0))
+            polygons = polygons[(shapely.get_type_id(polygons) == 3) & ~shapely.is_empty(polygons)]
+            if len(polygons):
+                # Uma feature (MultiPolygon) por banda de severidade.
+                features.append((_encode_polygons(polygons), {"severity": label}))
+
+        return _encode_layer(MVT_LAYER, features) if features else b""
+
+
+def _tile_nbytes(tile):
+    """Memória de uma entrada da cache de tiles: bytes (MVT) ou (etag,
+    bytes) (PNG), mais TILE_ENTRY_OVERHEAD."""
+    return TILE_ENTRY_OVERHEAD + (len(tile[1]) if isinstance(tile, tuple) else len(tile))
+
+
+def _polygons_from_shapes(shapes):
+    """Array de Polygons a partir da saída de rasterio.features.shapes,
+    construído de uma vez (shapely.from_ragged_array) em vez de um
+    shape() por mancha."""
+    coords, ring_offsets, polygon_offsets = [], [0], [0]
+    for geom_dict, _ in shapes:
+        for ring in geom_dict["coordinates"]:
+            coords.extend(ring)
+            ring_offsets.append(len(coords))
+        polygon_offsets.append(len(ring_offsets) - 1)
+    return shapely.from_ragged_array(
+        shapely.GeometryType.POLYGON,
+        np.asarray(coords, dtype=np.float64).reshape(-1, 2),
+        (np.asarray(ring_offsets), np.asarray(polygon_offsets)),
+    )
+
+
+# ==================== CODIFICAÇÃO PNG ====================
+def _png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def _encode_png(rgba):
+    """PNG RGBA 8 bits de um array (altura, largura, 4) uint8."""
+    height, width, _ = rgba.shape
+    # Cada linha precedida do byte de filtro 0 (nenhum).
+    raw = np.zeros((height, width * 4 + 1), dtype=np.uint8)
+    raw[:, 1:] = rgba.reshape(height, width * 4)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+        + _png_chunk(b"IDAT", zlib.compress(raw.tobytes(), 6))
+        + _png_chunk(b"IEND", b"")
+    )
+
+
+# ==================== CODIFICAÇÃO MVT (protobuf) ====================
+# Só o subconjunto da especificação Mapbox Vector Tile 2.1 necessário aqui:
+# uma camada, features de polígonos, atributos string/double.
+def _varint(value):
+    out = bytearray()
+    while True:
+        bits = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(bits | 0x80)
+        else:
+            out.append(bits)
+            return bytes(out)
+
+
+def _varints(values):
+    """Concatenação dos varints de um array de inteiros não negativos
+    (vectorizado — os comandos de geometria de um tile são milhões)."""
+    values = np.asarray(values, dtype=np.uint64)
+    n_bytes = np.ones(values.shape, dtype=np.int64)
+    for shift in (7, 14, 21, 28, 35, 42, 49, 56, 63):
+        n_bytes += values >= np.uint64(1 << shift)
+    offsets = np.cumsum(n_bytes) - n_bytes
+    out = np.empty(int(n_bytes.sum()), dtype=np.uint8)
+    for b in range(int(n_bytes.max(initial=0))):
+        sel = n_bytes > b
+        bits = (values[sel] >> np.uint64(7 * b)) & np.uint64(0x7F)
+        out[offsets[sel] + b] = bits | np.where(n_bytes[sel] > b + 1, np.uint64(0x80), np.uint64(0))
+    return out.tobytes()
+
+
+def _field(number, wire_type, payload):
+    key = _varint((number << 3) | wire_type)
+    if wire_type == 2:
+        return key + _varint(len(payload)) + payload
+    return key + payload
+
+
+def _packed(number, values):
+    return _field(number, 2, _varints(values))
+
+
+def _encode_polygons(polygons):
+    """Comandos de geometria MVT (MoveTo/LineTo/ClosePath com deltas em
+    zigzag) de um array de Polygons já em coordenadas inteiras do tile.
+    Anel exterior com área positiva (sentido horário com y para baixo), como
+    manda a especificação."""
+    polygons = shapely.orient_polygons(polygons)
+    _, coords, (ring_offsets, _) = shapely.to_ragged_array(polygons)
+    coords = np.rint(coords).astype(np.int64)
+
+    # Cada anel sem o ponto de fecho (repetido); anéis degenerados fora.
+    ring_len = np.diff(ring_offsets)
+    ring_of_point = np.repeat(np.arange(len(ring_len)), ring_len)
+    valid = ring_len - 1 >= 3
+    closing = np.arange(len(coords)) == ring_offsets[1:][ring_of_point] - 1
+    points = coords[valid[ring_of_point] & ~closing]
+    n = ring_len[valid] - 1
+    if not len(n):
+        return np.empty(0, dtype=np.int64)
+
+    # Deltas em relação ao ponto anterior (o cursor segue de anel em anel).
+    deltas = np.diff(points, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+    zigzag = (deltas << 1) ^ (deltas >> 63)
+
+    # Por anel: MoveTo(1) dx dy, LineTo(n-1) 2*(n-1) valores, ClosePath.
+    size = 2 * n + 3
+    start = np.cumsum(size) - size
+    commands = np.empty(int(size.sum()), dtype=np.int64)
+    is_command = np.zeros(len(commands), dtype=bool)
+    for pos, value in ((start, 1 | (1 << 3)), (start + 3, 2 | ((n - 1) << 3)), (start + 2 * n + 2, 7 | (1 << 3))):
+        commands[pos] = value
+        is_command[pos] = True
+    commands[~is_command] = zigzag.ravel()
+    return commands
+
+
+def _encode_value(value):
+    if isinstance(value, str):
+        return _field(1, 2, value.encode("utf-8"))
+    return _field(3, 1, np.float64(value).tobytes())
+
+
+def _encode_layer(name, features):
+    """Tile com uma única camada; features: lista de (comandos, atributos)."""
+    keys, values = [], []
+    body = []
+    for fid, (geometry, props) in enumerate(features, start=1):
+        tags = []
+        for k, v in props.items():
+            if k not in keys:
+                keys.append(k)
+            if v not in values:
+                values.append(v)
+            tags += [keys.index(k), values.index(v)]
+        feature = _field(1, 0, _varint(fid)) + _packed(2, tags) + _field(3, 0, _varint(3)) + _packed(4, geometry)
+        body.append(_field(2, 2, feature))
+    layer = (
+        _field(15, 0, _varint(2))
+        + _field(1, 2, name.encode("utf-8"))
+        + b"".join(body)
+        + b"".join(_field(3, 2, k.encode("utf-8")) for k in keys)
+        + b"".join(_field(4, 2, _encode_value(v)) for v in values)
+        + _field(5, 0, _varint(MVT_EXTENT))
+    )
+    return _field(3, 2, layer)
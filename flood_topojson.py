@@ -0,0 +1,238 @@
+"""
+flood_topojson.py
+==================
+Conversão das FeatureCollections da API (mancha de inundação, catchments
+de bairro, pontos de rótulo) para TopoJSON quantizado, para ligações
+móveis lentas:
+
+  - coordenadas quantizadas para inteiros numa grelha de Q x Q sobre a
+    caixa envolvente ("transform" da topologia) e cada arco codificado em
+    deltas — inteiros pequenos em vez de floats de 15 dígitos;
+  - fronteiras partilhadas entre polígonos (os catchments Voronoi
+    vizinhos partilham todas as arestas) guardadas uma única vez em
+    "arcs" e referenciadas pelos dois lados.
+
+Segue a especificação TopoJSON 1.0 e lê-se no cliente com
+topojson-client (topojson.feature). Implementado aqui em numpy — a
+junção/deduplicação de arcos é a parte cara e o pacote "topojson" em
+Python traz dependências pesadas sem ser mais rápido para este caso.
+"""
+
+import numpy as np
+
+# Resolução por omissão da grelha de quantização (pontos por eixo). Sobre a
+# província de Luanda (~2°) dá ~2 m por passo — abaixo do pixel do DEM.
+DEFAULT_QUANTIZATION = 100_000
+
+
+def to_topology(collections, quantization=DEFAULT_QUANTIZATION):
+    """dict {nome: FeatureCollection GeoJSON} -> Topology TopoJSON com um
+    objecto GeometryCollection por nome. Geometrias suportadas: Point,
+    MultiPoint, Polygon e MultiPolygon."""
+    features = {name: collection["features"] for name, collection in collections.items()}
+
+    # Primeira passagem: todos os anéis e pontos, para a caixa envolvente.
+    rings, points = [], []
+    for feature_list in features.values():
+        for feature in feature_list:
+            _collect(feature.get("geometry"), rings, points)
+    all_coords = list(rings) + ([np.asarray(points, dtype=np.float64)] if points else [])
+    if all_coords:
+        stacked = np.concatenate(all_coords)
+        x0, y0 = stacked.min(axis=0)
+        x1, y1 = stacked.max(axis=0)
+    else:
+        x0 = y0 = 0.0
+        x1 = y1 = 1.0
+    quantization = int(quantization)
+    scale = (
+        (x1 - x0) / (quantization - 1) if x1 > x0 else 1.0,
+        (y1 - y0) / (quantization - 1) if y1 > y0 else 1.0,
+    )
+    translate = (float(x0), float(y0))
+
+    lengths = np.array([len(ring) for ring in rings], dtype=np.int64)
+    coords = _quantize(np.concatenate(rings), translate, scale) if rings else np.empty((0, 2), dtype=np.int64)
+    builder = _ArcBuilder(coords, lengths)
+    ring_arcs = iter(builder.ring_arcs())
+    objects = {}
+    for name, feature_list in features.items():
+        geometries = []
+        for feature in feature_list:
+            geometry = _encode_geometry(feature.get("geometry"), ring_arcs, translate, scale)
+            if feature.get("properties"):
+                geometry["properties"] = feature["properties"]
+            if "id" in feature:
+                geometry["id"] = feature["id"]
+            geometries.append(geometry)
+        objects[name] = {"type": "GeometryCollection", "geometries": geometries}
+
+    return {
+        "type": "Topology",
+        "bbox": [float(x0), float(y0), float(x1), float(y1)],
+        "transform": {"scale": [float(scale[0]), float(scale[1])], "translate": list(translate)},
+        "objects": objects,
+        "arcs": builder.encoded_arcs(),
+    }
+
+
+def topology_nbytes(topology):
+    """Estimativa da memória de uma Topology: ~100 bytes por posição de
+    arco (lista de dois inteiros) mais ~500 por geometria."""
+    n_positions = sum(len(arc) for arc in topology["arcs"])
+    n_geometries = sum(len(obj["geometries"]) for obj in topology["objects"].values())
+    return 100 * n_positions + 500 * n_geometries
+
+
+def _collect(geometry, rings, points):
+    """Anéis (arrays Nx2, pela ordem em que _encode_geometry os consome) e
+    pontos de uma geometria GeoJSON."""
+    if geometry is None:
+        return
+    kind, coords = geometry["type"], geometry["coordinates"]
+    if kind == "Point":
+        points.append(coords[:2])
+    elif kind == "MultiPoint":
+        points.extend(c[:2] for c in coords)
+    elif kind == "Polygon":
+        rings.extend(np.asarray(ring, dtype=np.float64)[:, :2] for ring in coords)
+    elif kind == "MultiPolygon":
+        rings.extend(np.asarray(ring, dtype=np.float64)[:, :2] for polygon in coords for ring in polygon)
+    else:
+        raise ValueError(f"Geometria {kind} não suportada em TopoJSON aqui")
+
+
+def _quantize(coords, translate, scale):
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    return np.rint((coords - translate) / scale).astype(np.int64)
+
+
+def _encode_geometry(geometry, ring_arcs, translate, scale):
+    if geometry is None:
+        return {"type": None}
+    kind, coords = geometry["type"], geometry["coordinates"]
+    if kind == "Point":
+        return {"type": kind, "coordinates": _quantize(coords[:2], translate, scale)[0].tolist()}
+    if kind == "MultiPoint":
+        return {"type": kind, "coordinates": _quantize([c[:2] for c in coords], translate, scale).tolist()}
+    if kind == "Polygon":
+        arcs = _polygon_arcs(coords, ring_arcs)
+        return {"type": kind, "arcs": arcs} if arcs else {"type": None}
+    polygons = [arcs for arcs in (_polygon_arcs(polygon, ring_arcs) for polygon in coords) if arcs]
+    return {"type": kind, "arcs": polygons} if polygons else {"type": None}
+
+
+def _polygon_arcs(polygon, ring_arcs):
+    """Arcos de cada anel; um polígono cujo anel exterior colapsou na
+    quantização desaparece (os buracos colapsados só são omitidos)."""
+    rings = [next(ring_arcs) for _ in polygon]
+    if not rings or rings[0] is None:
+        return []
+    return [arcs for arcs in rings if arcs is not None]
+
+
+class _ArcBuilder:
+    """Corta os anéis quantizados em arcos nas junções (pontos onde anéis
+    diferentes deixam de seguir juntos) e deduplica os arcos partilhados,
+    como o topojson de referência. Os arcos são guardados como sequências
+    de identificadores de ponto; as coordenadas só se montam no fim."""
+
+    def __init__(self, coords, lengths):
+        """coords: pontos quantizados de todos os anéis, concatenados;
+        lengths: número de pontos de cada anel (com o ponto de fecho)."""
+        self.n_rings = len(lengths)
+        ring_of = np.repeat(np.arange(self.n_rings), lengths)
+        # Sem o ponto de fecho e sem pontos repetidos consecutivos (a
+        # quantização junta vértices próximos); depois de deduplicar, o
+        # último ponto pode voltar a coincidir com o primeiro.
+        coords, ring_of = _drop_closing(coords, ring_of)
+        repeated = np.zeros(len(coords), dtype=bool)
+        repeated[1:] = (ring_of[1:] == ring_of[:-1]) & (coords[1:] == coords[:-1]).all(axis=1)
+        coords, ring_of = _drop_closing(coords[~repeated], ring_of[~repeated])
+        lengths = np.bincount(ring_of, minlength=self.n_rings)
+        self.valid = lengths >= 3
+        valid_points = self.valid[ring_of]
+        self.coords, self.ring_of = coords[valid_points], ring_of[valid_points]
+        self.lengths = lengths[self.valid]
+        self.arcs = []
+        self._arc_index = {}
+
+    def ring_arcs(self):
+        """Lista, por anel de entrada, dos índices de arco (negativos = arco
+        percorrido ao contrário, ~i) ou None se o anel colapsou."""
+        if not len(self.lengths):
+            self.points = np.empty((0, 2), dtype=np.int64)
+            return [None] * self.n_rings
+
+        # Identificador inteiro por ponto distinto.
+        self.points, point_id = np.unique(self.coords, axis=0, return_inverse=True)
+        point_id = point_id.ravel()
+
+        # Vizinhos (anterior, seguinte) de cada ocorrência, ciclicamente por
+        # anel. Junção: ponto que aparece com pares de vizinhos diferentes.
+        offsets = np.concatenate([[0], np.cumsum(self.lengths)])
+        index = np.arange(len(point_id))
+        ring_of = np.repeat(np.arange(len(self.lengths)), self.lengths)
+        start, length = offsets[ring_of], self.lengths[ring_of]
+        prev_id = point_id[start + (index - start - 1) % length]
+        next_id = point_id[start + (index - start + 1) % length]
+        pairs = np.column_stack([point_id, np.minimum(prev_id, next_id), np.maximum(prev_id, next_id)])
+        distinct = np.unique(pairs, axis=0)
+        junction = np.bincount(distinct[:, 0], minlength=len(self.points)) > 1
+
+        result, position = [], 0
+        for valid in self.valid:
+            if not valid:
+                result.append(None)
+                continue
+            ids = point_id[offsets[position]:offsets[position + 1]]
+            result.append(self._cut(ids, np.flatnonzero(junction[ids])))
+            position += 1
+        return result
+
+    def _cut(self, ids, cuts):
+        if not len(cuts):
+            # Anel sem junções: um só arco fechado, a começar no menor ponto
+            # para que o mesmo anel noutro polígono seja reconhecido.
+            shift = int(ids.argmin())
+            return [self._arc(np.concatenate([ids[shift:], ids[:shift + 1]]))]
+        first = cuts[0]
+        ring = np.concatenate([ids[first:], ids[:first + 1]])
+        bounds = [*(cuts - first).tolist(), len(ids)]
+        return [self._arc(ring[a:b + 1]) for a, b in zip(bounds[:-1], bounds[1:])]
+
+    def _arc(self, ids):
+        key = ids.tobytes()
+        index = self._arc_index.get(key)
+        if index is not None:
+            return index
+        index = self._arc_index.get(ids[::-1].tobytes())
+        if index is not None:
+            return ~index
+        self._arc_index[key] = len(self.arcs)
+        self.arcs.append(ids)
+        return len(self.arcs) - 1
+
+    def encoded_arcs(self):
+        """Arcos em deltas: primeiro ponto absoluto, os seguintes relativos
+        ao anterior."""
+        if not self.arcs:
+            return []
+        lengths = np.array([len(arc) for arc in self.arcs])
+        coords = self.points[np.concatenate(self.arcs)]
+        deltas = np.diff(coords, axis=0, prepend=coords[:1])
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        deltas[starts] = coords[starts]
+        flat = deltas.tolist()
+        return [flat[a:a + n] for a, n in zip(starts.tolist(), lengths.tolist())]
+
+
+def _drop_closing(coords, ring_of):
+    """Remove o último ponto de cada anel quando é igual ao primeiro."""
+    if not len(coords):
+        return coords, ring_of
+    last = np.append(ring_of[1:] != ring_of[:-1], True)
+    first = np.flatnonzero(np.insert(ring_of[1:] != ring_of[:-1], 0, True))
+    first_of = first[np.searchsorted(ring_of[first], ring_of)]
+    closing = last & (np.arange(len(coords)) != first_of) & (coords == coords[first_of]).all(axis=1)
+    return coords[~closing], ring_of[~closing]
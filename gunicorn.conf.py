@@ -0,0 +1,39 @@
+"""
+Configuração do gunicorn em produção (ver Procfile).
+
+O processo mestre importa a aplicação antes de criar os workers
+(preload_app), mas esse import só traz o código (FLOOD_LOAD_ON_IMPORT=0) —
+as bibliotecas ficam partilhadas pelos workers sem cópia. Os dados carregam
+em cada worker, numa thread de fundo começada logo depois do fork
+(flood_api.after_fork): o worker aceita ligações desde o primeiro momento,
+/api/health/live responde já e os endpoints que precisam dos dados
+respondem 503 com Retry-After até /api/health/ready dizer que está pronto.
+
+Com a cache em disco quente (rasters, átomos e curvas de exposição das
+zonas, ver FloodModel.register_zones) o carregamento de um worker é quase
+só mapear ficheiros, e os workers no mesmo host partilham as mesmas páginas
+físicas. A frio, cada worker constrói a cache em paralelo (a escrita é
+atómica, o primeiro a acabar fica); para o evitar, construí-la antes do
+arranque com scripts/build_cache.py.
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+# Um worker por omissão, como no Procfile antigo (--workers 1); mais só com
+# WEB_CONCURRENCY explícito.
+workers = int(os.environ.get("WEB_CONCURRENCY", "1"))
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+timeout = 120
+max_requests = 200
+max_requests_jitter = 50
+preload_app = True
+
+# O import de flood_api no mestre não carrega os dados (ver acima).
+os.environ["FLOOD_LOAD_ON_IMPORT"] = "0"
+
+
+def post_fork(server, worker):
+    import flood_api
+
+    flood_api.after_fork()
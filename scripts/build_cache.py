@@ -0,0 +1,71 @@
+"""
+build_cache.py
+===============
+Pré-constrói a cache em disco dos rasters usados por FloodModel (DEM já
+reamostrado, população e os derivados: depressões, ligação ao mar, oceano
+permanente, drenagem), para que o primeiro arranque do servidor — e cada
+reciclagem de worker gunicorn — só tenha de os mapear em memória. Corre-se depois de scripts/prepare_data.py
+ou em cada deploy (por exemplo no passo de build da plataforma).
+
+A cache fica em data/cache/ (ou em FLOOD_CACHE_DIR), numa pasta por versão e
+por hash do DEM + população + limites municipais + DEM_DOWNSAMPLE; pastas de chaves
+antigas podem ser apagadas à mão sem problema. Com FLOOD_DEM_PYRAMID constrói
+um nível por factor de downsampling (ver flood_pyramid.py). Constrói a de cada
+província com dados (data/ e data/regions/, ver flood_regions.py), ou só a de
+--province; sem FLOOD_CACHE_DIR a de cada província fica na sua pasta.
+
+Uso:
+    cd backend && source .venv/bin/activate && python scripts/build_cache.py [--force]
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import flood_model  # noqa: E402
+from flood_model import DATA_DIR, RASTER_CACHE_VERSION, FloodModel, normalize, raster_cache_key  # noqa: E402
+from flood_pyramid import PYRAMID_DOWNSAMPLES  # noqa: E402
+from flood_regions import discover_regions  # noqa: E402
+
+
+def log(msg):
+    print(f"[build_cache] {msg}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pré-constrói a cache de rasters do FloodModel")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--cache-dir", default=flood_model.CACHE_DIR)
+    parser.add_argument("--province", help="só esta província (por omissão, todas as que têm dados)")
+    parser.add_argument("--force", action="store_true", help="recalcula mesmo que a cache já exista")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    regions = discover_regions(args.data_dir)
+    if args.province:
+        if normalize(args.province) not in regions:
+            raise SystemExit(f"Sem dados para a província {args.province} (disponíveis: {', '.join(sorted(regions))})")
+        regions = {normalize(args.province): regions[normalize(args.province)]}
+
+    for province, region_dir in sorted(regions.items()):
+        cache_dir = args.cache_dir or os.path.join(region_dir, "cache")
+        for downsample in PYRAMID_DOWNSAMPLES:
+            key = raster_cache_key(region_dir, downsample, province)
+            key_dir = os.path.join(cache_dir, f"v{RASTER_CACHE_VERSION}", key)
+            if args.force and os.path.isdir(key_dir):
+                shutil.rmtree(key_dir)
+                log(f"Cache existente removida: {key_dir}")
+
+            start = time.perf_counter()
+            FloodModel(region_dir, cache_dir=cache_dir, downsample=downsample, province=province)
+            log(f"Cache de {province} pronta em {key_dir} "
+                f"({time.perf_counter() - start:.1f}s, downsample={downsample})")
+
+
+if __name__ == "__main__":
+    main()
@@ -15,14 +15,31 @@ todos os ficheiros estáticos usados pelo motor de inundação em backend/data/:
                                por bairro já que os bairros só existem como
                                pontos
 
+Ao lado de cada GeoJSON de limites fica uma cópia em FlatGeobuf (.fgb),
+que a API lê de preferência (ver read_boundaries em flood_api.py): binária,
+só com as linhas e colunas que a API usa (ver BINARY_COLUMNS) — as
+províncias com dados, os municípios de cada uma — e geometrias
+simplificadas. Com --binary-only regeneram-se só estas cópias, a partir
+dos GeoJSON já em data/ (depois de os editar, ou de correr
+fetch_bairros.py), sem descarregar nada.
+
+Com --province NOME (outra província do GADM, ex. Benguela) gera só os
+limites municipais, o DEM e a população dessa província, em
+backend/data/regions/<nome>/ (dem_<nome>.tif, population_<nome>.tif) — a API
+carrega-a no primeiro pedido (ver flood_regions.py). Os bairros só existem
+para Luanda.
+
 Uso:
-    cd backend && source .venv/bin/activate && python scripts/prepare_data.py
+    cd backend && source .venv/bin/activate && python scripts/prepare_data.py [--province NOME | --binary-only]
 
 Todas as fontes são públicas e não exigem chave de API.
 """
 
+import argparse
+import glob
 import io
 import os
+import unicodedata
 import zipfile
 
 import geopandas as gpd
@@ -51,12 +68,20 @@ WORLDPOP_URL = (
     "constrained/ago_pop_2020_CN_100m_R2024B_v1.tif"
 )
 AOI_BUFFER_DEG = 0.06  # ~6-7 km de margem à volta da fronteira da província
+PROVINCE = "Luanda"  # a dos ficheiros de data/; as outras vão para data/regions/
 
 
 def log(msg):
     print(f"[prepare_data] {msg}")
 
 
+def province_slug(name):
+    """Nome da província nos ficheiros (flood_model.normalize)."""
+    s = unicodedata.normalize("NFD", str(name))
+    s = "".join(c for c in s if unicodedata.category(c) != "Mn")
+    return s.replace(" ", "").replace("-", "").replace("_", "").lower()
+
+
 # ==================== 1. LIMITES ADMINISTRATIVOS (GADM) ====================
 def fetch_gadm(level):
     log(f"A descarregar GADM nível {level}...")
@@ -69,12 +94,13 @@ def fetch_gadm(level):
     return gdf
 
 
-def step_boundaries():
+def step_boundaries(save=True):
     gdf1 = fetch_gadm(1)
     gdf2 = fetch_gadm(2)
-    gdf1.to_file(os.path.join(DATA_DIR, "provinces.geojson"), driver="GeoJSON")
-    gdf2.to_file(os.path.join(DATA_DIR, "municipalities.geojson"), driver="GeoJSON")
-    log("Guardado provinces.geojson e municipalities.geojson")
+    if save:
+        gdf1.to_file(os.path.join(DATA_DIR, "provinces.geojson"), driver="GeoJSON")
+        gdf2.to_file(os.path.join(DATA_DIR, "municipalities.geojson"), driver="GeoJSON")
+        log("Guardado provinces.geojson e municipalities.geojson")
     return gdf1, gdf2
 
 
@@ -97,7 +123,7 @@ def dem_tile_urls_for_bounds(minx, miny, maxx, maxy):
     return urls
 
 
-def step_dem(aoi_bounds):
+def step_dem(aoi_bounds, out_path):
     minx, miny, maxx, maxy = aoi_bounds
     urls = dem_tile_urls_for_bounds(minx, miny, maxx, maxy)
     srcs = []
@@ -109,7 +135,7 @@ def step_dem(aoi_bounds):
         except Exception:
             log(f"Tile DEM indisponível (assume oceano/sem dados): {url.split('/')[-1]}")
     if not srcs:
-        raise RuntimeError("Nenhum tile Copernicus DEM encontrado para a área de Luanda")
+        raise RuntimeError("Nenhum tile Copernicus DEM encontrado para a área da província")
 
     res = srcs[0].res
     mosaic, out_transform = rio_merge(srcs, bounds=aoi_bounds, res=res)
@@ -119,7 +145,6 @@ def step_dem(aoi_bounds):
     mosaic = mosaic.astype("float32")
     mosaic[mosaic < -100] = 0.0  # nodata/oceano -> nível do mar
 
-    out_path = os.path.join(DATA_DIR, "dem_luanda.tif")
     profile = {
         "driver": "GTiff",
         "height": mosaic.shape[1],
@@ -135,12 +160,12 @@ def step_dem(aoi_bounds):
     with rasterio.open(out_path, "w", **profile) as dst:
         dst.write(mosaic[0], 1)
     size_mb = os.path.getsize(out_path) / 1e6
-    log(f"Guardado dem_luanda.tif ({mosaic.shape[2]}x{mosaic.shape[1]} px, {size_mb:.1f} MB, "
+    log(f"Guardado {os.path.basename(out_path)} ({mosaic.shape[2]}x{mosaic.shape[1]} px, {size_mb:.1f} MB, "
         f"elevação {mosaic.min():.1f}–{mosaic.max():.1f} m)")
 
 
 # ==================== 3. POPULAÇÃO (WorldPop) ====================
-def step_population(aoi_bounds):
+def step_population(aoi_bounds, out_path):
     minx, miny, maxx, maxy = aoi_bounds
     raw_path = os.path.join(TMP_DIR, "ago_pop_full.tif")
     if not os.path.exists(raw_path):
@@ -169,12 +194,11 @@ def step_population(aoi_bounds):
         "predictor": 2,
         "nodata": 0,
     })
-    out_path = os.path.join(DATA_DIR, "population_luanda.tif")
     with rasterio.open(out_path, "w", **profile) as dst:
         dst.write(data, 1)
 
     size_mb = os.path.getsize(out_path) / 1e6
-    log(f"Guardado population_luanda.tif ({data.shape[1]}x{data.shape[0]} px, {size_mb:.1f} MB, "
+    log(f"Guardado {os.path.basename(out_path)} ({data.shape[1]}x{data.shape[0]} px, {size_mb:.1f} MB, "
         f"população total na área: {data.sum():,.0f})")
     os.remove(raw_path)
 
@@ -302,24 +326,96 @@ def step_fill_missing_municipalities(municipalities_gdf, catchments_gdf):
     return municipalities_gdf
 
 
+# ==================== 5. LIMITES EM FLATGEOBUF (para a API) ====================
+# Colunas que a API usa de cada ficheiro de limites; as outras (GADM tem
+# uma dúzia) não vão para o .fgb.
+BINARY_COLUMNS = {
+    "provinces": ["GID_1", "NAME_1"],
+    "municipalities": ["GID_2", "NAME_1", "NAME_2"],
+    "bairros_com_municipio": ["name", "municipality"],
+    "bairro_catchments": ["name", "municipality"],
+}
+# Tolerância (graus, ~1 m) da simplificação das geometrias: tira os
+# vértices redundantes sem mexer nas zonas rasterizadas, muito abaixo de uma
+# célula do DEM (30 m).
+SIMPLIFY_TOLERANCE_DEG = 1e-5
+
+
+def write_binary(gdf, out_dir, name):
+    gdf = gdf[[c for c in BINARY_COLUMNS[name] if c in gdf.columns] + ["geometry"]]
+    gdf = gdf[~gdf.geometry.is_empty]
+    gdf = gdf.set_geometry(gdf.geometry.simplify(SIMPLIFY_TOLERANCE_DEG, preserve_topology=True))
+    path = os.path.join(out_dir, f"{name}.fgb")
+    # Sem índice espacial: com ele o GDAL reordena as feições (curva de
+    # Hilbert), e a API depende da ordem do GeoJSON (ids das listagens). O
+    # tipo de geometria fica por feição: sem isso um ficheiro com Polygon e
+    # MultiPolygon passa tudo a MultiPolygon.
+    gdf.to_file(path, driver="FlatGeobuf", SPATIAL_INDEX="NO", geometry_type="Unknown", promote_to_multi=False)
+    log(f"Guardado {os.path.relpath(path, DATA_DIR)} ({len(gdf)} feições, {os.path.getsize(path) / 1e6:.2f} MB)")
+
+
+def step_binary_boundaries(provinces_gdf):
+    """.fgb de cada GeoJSON de limites de data/ e de cada pasta de
+    data/regions/: das províncias, só as que têm dados; dos municípios de
+    data/, só os de Luanda (as regiões já têm só os seus)."""
+    region_dirs = sorted(glob.glob(os.path.join(DATA_DIR, "regions", "*", "municipalities.geojson")))
+    region_dirs = [os.path.dirname(path) for path in region_dirs]
+    with_data = {province_slug(PROVINCE)} | {os.path.basename(d) for d in region_dirs}
+    write_binary(provinces_gdf[provinces_gdf["NAME_1"].map(province_slug).isin(with_data)], DATA_DIR, "provinces")
+
+    municipalities = gpd.read_file(os.path.join(DATA_DIR, "municipalities.geojson"))
+    write_binary(municipalities[municipalities["NAME_1"] == PROVINCE], DATA_DIR, "municipalities")
+    for name in ("bairros_com_municipio", "bairro_catchments"):
+        path = os.path.join(DATA_DIR, f"{name}.geojson")
+        if os.path.exists(path):
+            write_binary(gpd.read_file(path), DATA_DIR, name)
+    for directory in region_dirs:
+        write_binary(gpd.read_file(os.path.join(directory, "municipalities.geojson")), directory, "municipalities")
+
+
 # ==================== MAIN ====================
 def main():
-    gdf1, gdf2 = step_boundaries()
-    luanda = gdf1[gdf1["NAME_1"] == "Luanda"]
-    minx, miny, maxx, maxy = luanda.total_bounds
+    parser = argparse.ArgumentParser(description="Gera os dados estáticos do motor de inundação")
+    parser.add_argument("--province", default=PROVINCE, help="província do GADM (NAME_1)")
+    parser.add_argument("--binary-only", action="store_true",
+                        help="só regenera os .fgb a partir dos GeoJSON de data/, sem descargas")
+    args = parser.parse_args()
+
+    if args.binary_only:
+        step_binary_boundaries(gpd.read_file(os.path.join(DATA_DIR, "provinces.geojson")))
+        return
+
+    # Outra província: os limites de data/ (com os municípios pós-2024 de
+    # Luanda acrescentados) ficam como estão.
+    is_main = args.province == PROVINCE
+    gdf1, gdf2 = step_boundaries(save=is_main)
+    province = gdf1[gdf1["NAME_1"] == args.province]
+    if province.empty:
+        raise SystemExit(f"Província {args.province} não existe no GADM ({', '.join(sorted(gdf1['NAME_1']))})")
+    slug = province_slug(args.province)
+    out_dir = DATA_DIR if is_main else os.path.join(DATA_DIR, "regions", slug)
+    os.makedirs(out_dir, exist_ok=True)
+    if not is_main:
+        gdf2[gdf2["NAME_1"] == args.province].to_file(os.path.join(out_dir, "municipalities.geojson"), driver="GeoJSON")
+        log(f"Guardado municipalities.geojson ({args.province})")
+
+    minx, miny, maxx, maxy = province.total_bounds
     aoi_bounds = (minx - AOI_BUFFER_DEG, miny - AOI_BUFFER_DEG,
                   maxx + AOI_BUFFER_DEG, maxy + AOI_BUFFER_DEG)
-    log(f"AOI (Luanda + margem): {aoi_bounds}")
-
-    step_dem(aoi_bounds)
-    step_population(aoi_bounds)
-    catchments_gdf = step_bairro_catchments(gdf2)
-    step_fill_missing_municipalities(gdf2, catchments_gdf)
-
-    log("Concluído. Ficheiros em backend/data/:")
-    for f in sorted(os.listdir(DATA_DIR)):
-        p = os.path.join(DATA_DIR, f)
-        log(f"  {f}  ({os.path.getsize(p)/1e6:.2f} MB)")
+    log(f"AOI ({args.province} + margem): {aoi_bounds}")
+
+    step_dem(aoi_bounds, os.path.join(out_dir, f"dem_{slug}.tif"))
+    step_population(aoi_bounds, os.path.join(out_dir, f"population_{slug}.tif"))
+    if is_main:
+        catchments_gdf = step_bairro_catchments(gdf2)
+        step_fill_missing_municipalities(gdf2, catchments_gdf)
+    step_binary_boundaries(gdf1)
+
+    log(f"Concluído. Ficheiros em {out_dir}:")
+    for f in sorted(os.listdir(out_dir)):
+        p = os.path.join(out_dir, f)
+        if os.path.isfile(p):
+            log(f"  {f}  ({os.path.getsize(p)/1e6:.2f} MB)")
 
 
 if __name__ == "__main__":
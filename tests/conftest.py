@@ -0,0 +1,49 @@
+"""
+Fixtures partilhadas: um conjunto de dados sintético pequeno (ver
+benchmarks/synthetic_data.py), gerado uma vez por sessão — os dados reais
+de data/ não estão no repositório.
+"""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from synthetic_data import generate  # noqa: E402
+
+# Lado do DEM sintético (células de ~30 m): pequeno para os testes correrem
+# em segundos, com oceano, encosta e depressões como os dados reais.
+SYNTHETIC_SIZE = 256
+
+
+@pytest.fixture(scope="session")
+def synthetic_dir(tmp_path_factory):
+    data_dir = str(tmp_path_factory.mktemp("synthetic"))
+    generate(data_dir, size=SYNTHETIC_SIZE, seed=0)
+    return data_dir
+
+
+@pytest.fixture(scope="session")
+def synthetic_model(synthetic_dir, tmp_path_factory):
+    """FloodModel dos dados sintéticos à resolução nativa, construído em
+    memória, com uma cache de rasters própria."""
+    from flood_model import FloodModel
+
+    return FloodModel(synthetic_dir, cache_dir=str(tmp_path_factory.mktemp("cache")), downsample=1)
+
+
+@pytest.fixture(scope="session")
+def api_client(synthetic_dir, tmp_path_factory):
+    """Test client do Flask sobre os dados sintéticos, já carregados.
+    FLOOD_DATA_DIR e FLOOD_CACHE_DIR são lidos no import de flood_api."""
+    cache_dir = str(tmp_path_factory.mktemp("api-cache"))
+    os.environ.update(FLOOD_DATA_DIR=synthetic_dir, FLOOD_CACHE_DIR=cache_dir,
+                      FLOOD_JOB_DIR=os.path.join(cache_dir, "jobs"))
+    import flood_api
+
+    flood_api.wait_until_ready()
+    return flood_api.app.test_client()
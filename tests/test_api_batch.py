@@ -0,0 +1,46 @@
+"""
+/api/simulate/batch: validação do corpo e de cada cenário (400 com o índice
+do cenário, nunca 500) e a mancha de inundação só quando pedida.
+"""
+
+import pytest
+
+
+def _batch(client, **body):
+    return client.post("/api/simulate/batch", json={"scenarios": [{"waterLevel": 1.0, "floodRate": 50}], **body})
+
+
+def test_batch_defaults_to_no_geojson(api_client):
+    response = _batch(api_client)
+    assert response.status_code == 200
+    payload = response.get_json()
+    assert "geojson" not in payload and payload["parameters"]["includeGeojson"] is False
+    assert len(payload["stats"]["floodedAreaKm2"]) == 1
+
+
+def test_batch_geojson_when_requested(api_client):
+    response = _batch(api_client, includeGeojson=True)
+    assert response.status_code == 200
+    assert len(response.get_json()["geojson"]) == 1
+
+
+@pytest.mark.parametrize("value", ["false", 1, None, [True]])
+def test_batch_include_geojson_must_be_boolean(api_client, value):
+    assert _batch(api_client, includeGeojson=value).status_code == 400
+
+
+@pytest.mark.parametrize("scenario", [
+    5, None, "x", [1, 2],
+    {"waterLevel": "abc"}, {"waterLevel": [1]},
+    {"waterLevel": "nan"}, {"waterLevel": "inf"}, {"waterLevel": 1e308}, {"waterLevel": -1e308},
+    {"floodRate": "nan"}, {"floodRate": 1e308}, {"floodRate": -5},
+])
+def test_batch_rejects_invalid_scenario(api_client, scenario):
+    response = api_client.post("/api/simulate/batch", json={"scenarios": [{"waterLevel": 1.0}, scenario]})
+    assert response.status_code == 400
+    assert response.get_json()["error"].startswith("Cenário 1 inválido")
+
+
+@pytest.mark.parametrize("body", [[1, 2], "x", None])
+def test_batch_rejects_non_object_body(api_client, body):
+    assert api_client.post("/api/simulate/batch", json=body).status_code == 400
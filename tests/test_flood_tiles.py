@@ -0,0 +1,131 @@
+"""
+flood_tiles: codificações MVT (protobuf) e PNG feitas à mão, descodificadas
+de volta e comparadas com a entrada, e o limite da cache de tiles.
+"""
+
+import io
+import math
+
+import numpy as np
+import pytest
+import shapely
+
+import flood_tiles
+from flood_model import SEVERITY_BANDS
+from flood_tiles import FloodTiler, _encode_layer, _encode_png, _encode_polygons, _varint, _varints
+
+WATER_LEVEL_M = 3.0
+FLOOD_RATE_FRAC = 0.9
+
+
+def _tile_at(lon, lat, z):
+    n = 2 ** z
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return x, y
+
+
+def _model_tile(model, z):
+    """(z, x, y) do tile no centro do grid do modelo."""
+    height, width = model.dem_shape
+    lon, lat = model.dem_transform * (width / 2, height / 2)
+    return (z, *_tile_at(lon, lat, z))
+
+
+def _decode_commands(commands):
+    """Anéis [(x, y), ...] de um fluxo de comandos de geometria MVT."""
+    rings, ring, cursor, i = [], [], (0, 0), 0
+    while i < len(commands):
+        command, count = commands[i] & 7, commands[i] >> 3
+        i += 1
+        if command == 7:
+            rings.append(ring)
+            continue
+        for _ in range(count):
+            dx, dy = ((v >> 1) ^ -(v & 1) for v in commands[i:i + 2])
+            cursor = (cursor[0] + dx, cursor[1] + dy)
+            i += 2
+            if command == 1:
+                ring = []
+            ring.append(cursor)
+    return rings
+
+
+POLYGONS = np.array([
+    shapely.Polygon([(0, 0), (100, 0), (100, 100), (0, 100)], [[(10, 10), (20, 10), (20, 20), (10, 20)]]),
+    shapely.box(200, 200, 300, 260),
+    shapely.Polygon([(-40, 4000), (4130, 4010), (2000, 4130)]),
+])
+
+
+def test_varints_match_scalar_encoding():
+    values = [0, 1, 127, 128, 255, 300, 16383, 16384, 2 ** 31 - 1, 2 ** 32, 2 ** 56 + 5, 2 ** 64 - 1]
+    assert _varints(values) == b"".join(_varint(v) for v in values)
+    assert _varints([]) == b""
+
+
+def test_polygon_commands_roundtrip():
+    rings = _decode_commands([int(v) for v in _encode_polygons(POLYGONS)])
+    oriented = shapely.orient_polygons(POLYGONS)
+    expected = [
+        [tuple(map(int, p)) for p in ring.coords[:-1]]
+        for polygon in oriented for ring in (polygon.exterior, *polygon.interiors)
+    ]
+    assert rings == expected
+    # Anel exterior com área positiva e buracos com área negativa, com y
+    # para baixo (especificação MVT 2.1).
+    areas = [shapely.Polygon(ring).area * (1 if shapely.Polygon(ring).exterior.is_ccw else -1) for ring in rings]
+    assert [area > 0 for area in areas] == [True, False, True, True]
+
+
+def test_layer_decodes_with_mapbox_vector_tile():
+    mapbox_vector_tile = pytest.importorskip("mapbox_vector_tile")
+    tile = _encode_layer("flood", [
+        (_encode_polygons(POLYGONS), {"severity": "Alta"}),
+        (_encode_polygons(POLYGONS[1:2]), {"severity": "Baixa", "depth": 1.5}),
+    ])
+    layer = mapbox_vector_tile.decode(tile, default_options={"y_coord_down": True})["flood"]
+    assert layer["extent"] == flood_tiles.MVT_EXTENT and layer["version"] == 2
+    assert [f["properties"] for f in layer["features"]] == [{"severity": "Alta"}, {"severity": "Baixa", "depth": 1.5}]
+    decoded = [shapely.geometry.shape(f["geometry"]) for f in layer["features"]]
+    assert decoded[0].equals(shapely.MultiPolygon(list(POLYGONS)))
+    assert decoded[1].equals(POLYGONS[1])
+
+
+def test_png_decodes_with_pil():
+    image_module = pytest.importorskip("PIL.Image")
+    rgba = np.random.default_rng(0).integers(0, 256, size=(37, 53, 4), dtype=np.uint8)
+    image = image_module.open(io.BytesIO(_encode_png(rgba)))
+    assert image.mode == "RGBA"
+    assert np.array_equal(np.asarray(image), rgba)
+
+
+def test_model_tiles_decode(synthetic_model):
+    mapbox_vector_tile = pytest.importorskip("mapbox_vector_tile")
+    image_module = pytest.importorskip("PIL.Image")
+    tiler = FloodTiler(synthetic_model)
+    z, x, y = _model_tile(synthetic_model, 14)
+
+    layer = mapbox_vector_tile.decode(tiler.mvt_tile(WATER_LEVEL_M, FLOOD_RATE_FRAC, z, x, y))["flood"]
+    labels = [label for _, label, _ in SEVERITY_BANDS]
+    assert layer["features"]
+    for feature in layer["features"]:
+        assert feature["properties"]["severity"] in labels
+        assert shapely.geometry.shape(feature["geometry"]).is_valid
+
+    _, png = tiler.depth_png(WATER_LEVEL_M, FLOOD_RATE_FRAC, z, x, y)
+    pixels = np.asarray(image_module.open(io.BytesIO(png)))
+    assert pixels.shape == (flood_tiles.PNG_TILE_SIZE, flood_tiles.PNG_TILE_SIZE, 4)
+    assert (pixels[..., 3] > 0).any()
+
+
+def test_empty_tiles_count_against_cache_budget(synthetic_model, monkeypatch):
+    monkeypatch.setattr(flood_tiles, "TILE_CACHE_MB", 0.01)
+    tiler = FloodTiler(synthetic_model)
+    # Tiles longe do grid: todos vazios.
+    for x in range(1000):
+        assert tiler.mvt_tile(WATER_LEVEL_M, FLOOD_RATE_FRAC, 12, x, 0) == b""
+    stats = tiler.cache_stats()
+    assert 0 < stats["resident_bytes"] <= stats["max_bytes"]
+    assert stats["entries"] <= stats["max_bytes"] // flood_tiles.TILE_ENTRY_OVERHEAD
+    assert stats["evictions"] > 0
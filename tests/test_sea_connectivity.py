@@ -0,0 +1,45 @@
+"""
+Componente costeira de FloodModel: a máscara dada pelo raster pré-calculado
+sea_level_threshold (reconstrução morfológica, "priority-flood") tem de
+coincidir, célula a célula e numa varredura de níveis de água, com a
+abordagem original — rotular as componentes ligadas de dem <= nível e
+manter as que tocam sea_seed.
+"""
+
+import numpy as np
+import pytest
+from scipy import ndimage
+
+# Níveis (m) a varrer: passos finos perto do nível do mar, onde as
+# componentes ligadas mudam mais, e depois passos largos até cotas altas.
+WATER_LEVELS = [-1.0, 0.0, 0.01, 0.05, 0.1, 0.2, 0.3, 0.31, 0.5, 0.75, 1.0, 1.25, 1.5, 2.0, 3.0, 5.0, 10.0, 25.0,
+                50.0, 100.0]
+
+
+def coastal_mask_by_labeling(model, water_level_m):
+    """Implementação original (rotulagem por cenário), mantida aqui como
+    referência."""
+    coastal_candidate = model.dem <= max(water_level_m, 0)
+    if not (water_level_m > 0 and coastal_candidate.any()):
+        return np.zeros_like(coastal_candidate)
+    labeled, _ = ndimage.label(coastal_candidate)
+    sea_labels = set(np.unique(labeled[model.sea_seed & coastal_candidate]))
+    sea_labels.discard(0)
+    return np.isin(labeled, list(sea_labels)) if sea_labels else np.zeros_like(coastal_candidate)
+
+
+@pytest.mark.parametrize("water_level_m", WATER_LEVELS)
+def test_threshold_matches_labeling(synthetic_model, water_level_m):
+    expected = coastal_mask_by_labeling(synthetic_model, water_level_m)
+    actual = (synthetic_model.sea_level_threshold <= water_level_m) & (water_level_m > 0)
+    assert int((expected != actual).sum()) == 0
+
+
+def test_sweep_covers_partial_coast(synthetic_model):
+    # A varredura só prova alguma coisa se passar por níveis em que parte
+    # — mas não todo — o terreno abaixo do nível está ligado ao mar.
+    partial = [
+        level for level in WATER_LEVELS
+        if 0 < coastal_mask_by_labeling(synthetic_model, level).sum() < (synthetic_model.dem <= level).sum()
+    ]
+    assert partial